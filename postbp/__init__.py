@@ -7,12 +7,15 @@ __version__ = "2.0.0"
 from .common import (
     prj2hex,  #noqa
     pij_to_shp, #noqa
+    write_sorted, #noqa
 )
 from .dataloader import(
     read_fireshp,  #noqa
+    iter_fireshp,  #noqa
     read_pointcsv,   #noqa
     read_pointshp,   #noqa
     validify_fireshp, #noqa
+    check_fireshp, #noqa
 ) 
 
 from .postbp import (
@@ -21,6 +24,7 @@ from .postbp import (
     generate_ssr,  #noqa
     generate_fireshed,   #noqa
     generate_fireplain,  #noqa
+    generate_fireshed_sizes,  #noqa
 )
 
 from .spreadrose import (
@@ -33,14 +37,67 @@ from .tessellation import (
     create_arcs,  #noqa
     nodes_from_hexagons,  #noqa
     create_hexagons,   #noqa
+    create_hexagon_levels,   #noqa
+    parent_lookup,   #noqa
+    renumber_hexagons,   #noqa
 )
 
 from .finalfirevectors import (
     generate_fire_vectors,    #noqa
     pij_from_vectors,      #noqa
+    pij_from_perimeters,      #noqa
 )
 from .dailyfirevectors import (
     generate_daily_vectors,    #noqa
     calc_angles,        #noqa
     select_angle,       #noqa
 )
+from .counts import (
+    merge_counts,    #noqa
+    burn_prob_from_counts,    #noqa
+    ign_prob_from_counts,    #noqa
+    pij_from_counts,    #noqa
+    ssr_from_counts,    #noqa
+    rollup_counts,    #noqa
+    rollup_burned,    #noqa
+    rollup_vectors,    #noqa
+)
+from .tiling import (
+    create_tiles,    #noqa
+    route_fires,    #noqa
+    tiled_burn_prob,    #noqa
+    tiled_fire_vectors,    #noqa
+    tiled_pij,    #noqa
+)
+from .vectorblocks import (
+    VectorBlocks,    #noqa
+    generate_daily_blocks,    #noqa
+    counts_from_blocks,    #noqa
+    pij_from_blocks,    #noqa
+    angle_counts,    #noqa
+)
+from .network import (
+    pij_to_matrix,    #noqa
+    arcs_to_matrix,    #noqa
+    node_strength,    #noqa
+    multi_hop_exposure,    #noqa
+    k_hop_reach,    #noqa
+    top_k_sources,    #noqa
+    transmission_clusters,    #noqa
+)
+from .rasterize import (
+    cell_to_hex,    #noqa
+    rasterize_burn_counts,    #noqa
+    check_raster,    #noqa
+)
+from .hexgrid import (
+    HexGrid,    #noqa
+)
+from .pipeline import (
+    load_config,    #noqa
+    run_pipeline,    #noqa
+)
+from .catalog import (
+    FireCatalog,    #noqa
+    link_ignitions,    #noqa
+)
@@ -0,0 +1,222 @@
+'''Module for an indexed catalog of fire perimeters and ignition points.
+1. the perimeters and ignition points are sorted once by (iteration, fire, day).
+2. the start and end rows of each fire are kept as offset arrays, with a lookup from each fire to its position.
+3. the perimeters, days, daily perimeters and ignition point of any fire are then slices of the sorted frames, instead of a scan of the full frames for every fire.
+4. link_ignitions matches the fires to their ignition point with one spatial join, reporting fires without ignition point (orphans) and with more than one (duplicates).
+'''
+
+import warnings
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+POLICIES = ('first', 'last', 'drop', 'error')
+
+def _offsets(frame, columns):
+    """Find the first row of each key of a frame sorted by the columns
+    """
+    if len(frame) == 0:
+        return np.array([0]), []
+    keys = frame[columns]
+    change = keys.ne(keys.shift()).any(axis=1).to_numpy()
+    starts = np.flatnonzero(change)
+    offsets = np.append(starts, len(frame))
+    uniques = [k if len(columns) > 1 else k[0] for k in keys.iloc[starts].itertuples(index=False, name=None)]
+    return offsets, uniques
+
+class FireCatalog:
+    """Fire perimeters (and ignition points) indexed by fire
+
+    Attributes:
+        keys (list): columns identifying a fire, ['iteration', 'fire'] if both frames have iteration IDs, otherwise ['fire'].
+                     A fire is then given as (iteration ID, fire ID), or as fire ID.
+        fireshp (GeoDataFrame): the perimeters sorted by keys (and day)
+        offsets (array): rows of fire k are fireshp[offsets[k]:offsets[k+1]]
+        ignitions (GeoDataFrame): the ignition points sorted by keys, None if not given
+    """
+    def __init__(self, fireshp, ignition=None, keys=None):
+        if keys is None:
+            frames = [fireshp] if ignition is None else [fireshp, ignition]
+            keys = ['iteration', 'fire'] if all('iteration' in f.columns for f in frames) else ['fire']
+        self.keys = list(keys)
+        sortBy = self.keys + (['day'] if 'day' in fireshp.columns else [])
+        self.fireshp = fireshp.sort_values(by=sortBy, kind='stable')
+        self.offsets, fires = _offsets(self.fireshp, self.keys)
+        self._position = {f: k for k, f in enumerate(fires)}
+        self._fires = fires
+        self._days = self.fireshp['day'].to_numpy() if 'day' in self.fireshp.columns else None
+
+        self.ignitions = None
+        self._ignition = {}
+        if ignition is not None:
+            self.ignitions = ignition.sort_values(by=self.keys, kind='stable')
+            ignOffsets, ignFires = _offsets(self.ignitions, self.keys)
+            self._ignition = {f: (ignOffsets[k], ignOffsets[k+1]) for k, f in enumerate(ignFires)}
+
+    def __len__(self):
+        return len(self._fires)
+
+    def __iter__(self):
+        return iter(self._fires)
+
+    def __contains__(self, fire):
+        return fire in self._position
+
+    def _rows(self, fire):
+        k = self._position[fire]
+        return self.offsets[k], self.offsets[k+1]
+
+    def fires(self):
+        """List the fires with the number of perimeters and ignition points of each
+
+        Returns:
+            DataFrame: return the fire keys, the number of perimeters (perimeters) and of ignition points (ignitions) of each fire
+        """
+        if self.keys == ['fire']:
+            fires = pd.DataFrame({'fire': self._fires})
+        else:
+            fires = pd.DataFrame(self._fires, columns=self.keys)
+        fires['perimeters'] = np.diff(self.offsets) if len(self) else np.array([], dtype=int)
+        fires['ignitions'] = [self._ignition[f][1] - self._ignition[f][0] if f in self._ignition else 0 for f in self._fires]
+        return fires
+
+    def perimeters(self, fire):
+        """Perimeters of one fire (all days for daily perimeters, sorted by day)
+
+        Args:
+            fire: fire ID, or (iteration ID, fire ID)
+
+        Returns:
+            GeoDataFrame: return the perimeters of the fire
+        """
+        start, end = self._rows(fire)
+        return self.fireshp.iloc[start:end]
+
+    def days(self, fire):
+        """Days of spread of one fire, from daily perimeters
+
+        Args:
+            fire: fire ID, or (iteration ID, fire ID)
+
+        Returns:
+            array: return the unique days of spread, sorted
+        """
+        start, end = self._rows(fire)
+        return np.unique(self._days[start:end])
+
+    def day(self, fire, day):
+        """Perimeters of one fire on one day, from daily perimeters
+
+        Args:
+            fire: fire ID, or (iteration ID, fire ID)
+            day (int): day of spread
+
+        Returns:
+            GeoDataFrame: return the perimeters of the fire on the day, empty if the fire did not spread on the day
+        """
+        start, end = self._rows(fire)
+        days = self._days[start:end]
+        return self.fireshp.iloc[start + np.searchsorted(days, day, side='left'):start + np.searchsorted(days, day, side='right')]
+
+    def ignition(self, fire):
+        """Ignition point(s) of one fire
+
+        Args:
+            fire: fire ID, or (iteration ID, fire ID)
+
+        Returns:
+            GeoDataFrame: return the ignition points of the fire, empty if the fire has no ignition point
+        """
+        if self.ignitions is None:
+            raise ValueError('The catalog has no ignition points, please create it with the ignition points.')
+        if fire not in self._ignition:
+            return self.ignitions.iloc[0:0]
+        start, end = self._ignition[fire]
+        return self.ignitions.iloc[start:end]
+
+def _ignition_points(ignition, hexagon, keys):
+    """Identify the hexagon of every ignition point with one spatial join, keeping the points in input order (ignPt is NaN outside the hexagons)
+    """
+    pts = ignition[keys + ['geometry']].reset_index(drop=True)
+    if pts.crs != hexagon.crs:
+        pts = pts.to_crs(hexagon.crs)
+    joined = gpd.sjoin(pts, hexagon[['Node_ID', 'geometry']], how='left', predicate='within')
+    joined = joined.loc[~joined.index.duplicated(keep='first')]
+    points = pd.DataFrame(pts[keys])
+    points['ignPt'] = joined['Node_ID'].reindex(points.index)
+    points['x'] = pts.geometry.x
+    points['y'] = pts.geometry.y
+    return points
+
+def _resolve_duplicates(points, keys, policy='first'):
+    """Keep one ignition point per fire: the first or last in input order, or none (drop) for fires with more than one
+    """
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown policy {policy}, please use one of {list(POLICIES)}.')
+    duplicated = points.duplicated(subset=keys, keep=False)
+    if policy == 'error' and duplicated.any():
+        nFires = len(points.loc[duplicated, keys].drop_duplicates())
+        raise ValueError(f'{nFires} fires have more than one ignition point, see the report of link_ignitions.')
+    if policy in ('drop', 'error'):
+        return points.loc[~duplicated]
+    return points.drop_duplicates(subset=keys, keep=policy)
+
+def _ignition_map(linkage, keys):
+    """Lookup from each fire (fire ID, or (iteration ID, fire ID) as in FireCatalog) to its ignition hexagon and coordinates
+    """
+    fires = linkage[keys[0]] if len(keys) == 1 else zip(*[linkage[k] for k in keys])
+    return dict(zip(fires, zip(linkage['ignPt'], linkage['x'], linkage['y'])))
+
+def _warn_linkage(report):
+    if len(report):
+        issues = ', '.join(f'{n} {issue}' for issue, n in report['issue'].value_counts().items())
+        warnings.warn(f'Ignition points not linked one to one with fires ({issues}), see link_ignitions for the report.')
+
+def link_ignitions(fireshp, ignition, hexagons, policy='first', keys=None, **kwargs):
+    """Link every fire to one ignition point and its hexagon with one spatial join and one join on the fire keys.
+       Note to give two variable names when using this function.
+
+    Args:
+        fireshp (GeoDataFrame): fire perimeter dataset (final or daily) with fire ID (and iteration ID) and geometry
+        ignition (GeoDataFrame): ignition point shapes with fire ID (and iteration ID) field in attributes
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        policy (str, optional): for fires with more than one ignition point, keep the 'first' or 'last' point in input order,
+                                'drop' the fire, or raise an 'error'. Defaults to 'first'.
+        keys (list, optional): columns identifying a fire. Defaults to ['iteration', 'fire'] if both frames have iteration IDs, otherwise ['fire'].
+
+    Returns:
+        DataFrame: the fire keys, ignition hexagon ID (ignPt) and ignition point coordinates (x, y) of each linked fire
+        DataFrame: the fire keys, issue and number of ignition points (ignitions) of each fire not linked one to one, with issue
+                   'no_ignition' (fire without ignition point), 'no_fire' (ignition point without fire perimeter),
+                   'outside' (ignition point not within a hexagon, the fire is linked to its other ignition points if any)
+                   or 'duplicate' (more than one ignition point within the hexagons, resolved by policy)
+    """
+    hexagon = hexagons
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    if keys is None:
+        keys = ['iteration', 'fire'] if all('iteration' in f.columns for f in [fireshp, ignition]) else ['fire']
+    keys = list(keys)
+
+    points = _ignition_points(ignition, hexagon, keys)
+    counts = points.groupby(keys).size().rename('ignitions').reset_index()
+    fires = pd.DataFrame(fireshp[keys]).drop_duplicates()
+    both = fires.merge(counts, on=keys, how='outer', indicator=True)
+    both['ignitions'] = both['ignitions'].fillna(0).astype(int)
+
+    # points outside the hexagons and points without fire perimeter are left out before resolving duplicates,
+    # so a fire is linked to its points within the hexagons, and only fires with perimeters are duplicates
+    inside = points['ignPt'].notna()
+    withFire = points.set_index(keys).index.isin(fires.set_index(keys).index)
+    outside = fires.merge(points.loc[~inside, keys].drop_duplicates(), on=keys, how='inner').assign(issue='outside')
+    duplicated = points.loc[inside & withFire].groupby(keys).size()
+    duplicated = duplicated.loc[duplicated > 1].reset_index()[keys].assign(issue='duplicate')
+    points = _resolve_duplicates(points.loc[inside & withFire], keys, policy)
+    linkage = fires.merge(points, on=keys, how='inner')
+    linkage['ignPt'] = linkage['ignPt'].astype(int)
+
+    report = pd.concat([both.loc[both['_merge'] == 'left_only', keys].assign(issue='no_ignition'),
+                        both.loc[both['_merge'] == 'right_only', keys].assign(issue='no_fire'),
+                        outside, duplicated])
+    report = report.merge(both[keys + ['ignitions']], on=keys, how='left').reset_index(drop=True)
+    return linkage, report
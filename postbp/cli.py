@@ -0,0 +1,29 @@
+'''Command line entry point of postbp, running the pipeline from a JSON config file:
+
+    postbp config.json --targets burn_prob pij --n-jobs 2
+'''
+
+import argparse
+from .pipeline import STAGES, run_pipeline
+
+def main(argv=None):
+    """Parse the command line arguments and run the pipeline
+
+    Args:
+        argv (list, optional): command line arguments. Defaults to sys.argv.
+
+    Returns:
+        int: exit status
+    """
+    parser = argparse.ArgumentParser(prog='postbp', description='Run the postbp pipeline from a JSON config file, '
+                                                                'recomputing only the stages whose inputs changed.')
+    parser.add_argument('config', help='path of the JSON config file')
+    parser.add_argument('--targets', nargs='+', choices=list(STAGES), help='stages to run, defaults to the targets in the config')
+    parser.add_argument('--n-jobs', type=int, default=None, help='number of stages run concurrently')
+    parser.add_argument('--force', action='store_true', help='recompute all stages needed for the targets')
+    args = parser.parse_args(argv)
+    run_pipeline(args.config, targets=args.targets, n_jobs=args.n_jobs, force=args.force)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -1,9 +1,12 @@
 """The common module contains common functions and classes used by the other modules.
 """
 import geopandas as gpd
+import numpy as np
 from shapely.geometry import LineString #, Polygon, Point
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from tqdm import tqdm
 
+
 def prj2hex(shp0, hexagons, threshold=0):
     """Generate a geometric intersection of shp0 and the hexagon shapefile.
     option to set threshold
@@ -16,11 +19,11 @@ def prj2hex(shp0, hexagons, threshold=0):
     Returns:
         GeoDataFrame: Return a GeoDataFrame of the intersection with hexagon ID field as attributes
     """    
-    thresholdArea = hexagons.at[1,'geometry'].area * threshold
+    thresholdArea = hexagons.geometry.iloc[0].area * threshold
     try:
         shp1 = gpd.overlay(shp0, hexagons, how='intersection') 
-    except:
-        pass    
+    except Exception as e:
+        raise ValueError(f'{e}: the overlay with hexagons failed, invalid geometry can be repaired with validify_fireshp or check_fireshp') from e
     shp1['areaFire'] = shp1.geometry.area
     shp1 = shp1.loc[shp1['areaFire'] > thresholdArea]
     shp1.drop(labels='areaFire', axis=1, inplace=True)
@@ -52,4 +55,73 @@ def pij_to_shp(pij_input, nodes, **kwargs):
     pijLine = [LineString(xy) for xy in zip(pij['geometry_x'], pij['geometry_y'])]
     pijshp = gpd.GeoDataFrame(pij, crs = SRID, geometry = pijLine )
     pijshp.drop(labels = ['geometry_x', 'geometry_y', 'Node_ID_x', 'Node_ID_y'], axis = 1, inplace = True)
-    return pijshp
\ No newline at end of file
+    return pijshp
+
+def write_sorted(frame, path_n_file_name, by=None, row_group_size=100000):
+    """Write fire vectors, pij, counts or burn probability to a parquet file sorted by Node_ID, in row groups with min/max statistics,
+       so that reading the rows of a range of Node_IDs (e.g. a tile of hexagons numbered along a Hilbert curve with renumber_hexagons)
+       touches only a few contiguous row groups. Requires pyarrow.
+
+    Args:
+        frame (DataFrame or GeoDataFrame): table to write
+        path_n_file_name (str): path and file name of the parquet file
+        by (list, optional): columns to sort by. Defaults to column_i, column_j for vectors and pij, or Node_ID.
+        row_group_size (int, optional): number of rows in each row group. Defaults to 100000.
+
+    Returns:
+        DataFrame or GeoDataFrame: return the sorted table as written
+    """
+    if by is None:
+        by = ['column_i', 'column_j'] if {'column_i', 'column_j'} <= set(frame.columns) else ['Node_ID']
+    frame = frame.sort_values(by=by, kind='stable').reset_index(drop=True)
+    frame.to_parquet(path_n_file_name, index=False, row_group_size=row_group_size, write_statistics=True)
+    return frame
+
+def _map_parallel(func, tasks, n_jobs=1, executor='process'):
+    """Apply func to each tuple of arguments in tasks, in a pool of n_jobs processes (or threads) if n_jobs > 1
+
+    Returns:
+        list: results in the order of tasks
+    """
+    if n_jobs == 1:
+        return [func(*task) for task in tqdm(tasks)]
+    Pool = ThreadPoolExecutor if executor == 'thread' else ProcessPoolExecutor
+    with Pool(max_workers=n_jobs) as executor:
+        futures = [executor.submit(func, *task) for task in tasks]
+        return [future.result() for future in tqdm(futures)]
+
+def _map_fires(func, fires, args, n_jobs=1):
+    """Apply func(fire, *args) to every fire, in a pool of n_jobs threads if n_jobs > 1.
+       func must not modify args, which are shared by the threads. The fires are linked to their ignition point beforehand (see link_ignitions),
+       so an error is not expected per fire and is raised.
+
+    Returns:
+        list: results in the order of fires
+    """
+    def run(i):
+        return func(i, *args)
+
+    if n_jobs == 1:
+        return [run(i) for i in tqdm(fires)]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(tqdm(executor.map(run, fires), total=len(fires)))
+
+def _node_table(nodes):
+    """Sort Node_ID and coordinates of the nodes once, for repeated lookups with _node_coords
+    """
+    ids = nodes['Node_ID'].to_numpy()
+    order = np.argsort(ids)
+    return ids[order], nodes.geometry.x.to_numpy()[order], nodes.geometry.y.to_numpy()[order]
+
+def _node_coords(table, node_ids):
+    """Look up the x, y coordinates of node_ids in the outputs of _node_table, NaN for IDs not in nodes
+
+    Returns:
+        array: x coordinates
+        array: y coordinates
+    """
+    ids, x, y = table
+    node_ids = np.asarray(node_ids)
+    pos = np.clip(np.searchsorted(ids, node_ids), 0, len(ids) - 1)
+    found = ids[pos] == node_ids
+    return np.where(found, x[pos], np.nan), np.where(found, y[pos], np.nan)
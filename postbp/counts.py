@@ -0,0 +1,210 @@
+'''Module for the raw count state behind the probability outputs.
+1. generate_burn_prob, generate_ign_prob, generate_fire_vectors, pij_from_vectors and generate_ssr return raw counts when return_counts=True.
+2. count tables of separate batches of iterations are merged by summing the counts and the number of iterations.
+3. probabilities are then calculated from the merged counts without reprocessing the fire perimeters of earlier batches.
+'''
+
+import pandas as pd
+from .finalfirevectors import _format_pij
+from .postbp import _ssr
+
+COUNT_COLUMNS = ['burnCount', 'ignCount', 'firecounts', 'asSource', 'asSink']
+
+def merge_counts(*counts, iterations=None):
+    """Merge the count tables of separate batches of iterations
+
+    Args:
+        *counts (DataFrame): count tables of the same kind, e.g. burn counts from generate_burn_prob of each batch
+        iterations (int, optional): total number of iterations of all batches. Defaults to the sum of the number of iterations stored in the count tables,
+                                    which is not known when a count table is empty (e.g. pij counts of a batch without fire vectors).
+
+    Returns:
+        DataFrame: return a dataframe with counts summed by hexagon (or by pair of i, j) and the total number of iterations
+    """
+    counts = [c for c in counts if c is not None]
+    merged = pd.concat(counts, ignore_index=True)
+    valueCols = [c for c in merged.columns if c in COUNT_COLUMNS]
+    keyCols = [c for c in merged.columns if c not in valueCols + ['iterations', 'geometry']]
+    merged = merged.groupby(keyCols)[valueCols].sum()
+    merged.reset_index(inplace=True)
+    if iterations is not None:
+        merged['iterations'] = iterations
+    elif any('iterations' in c.columns for c in counts):
+        if any(len(c) == 0 or 'iterations' not in c.columns for c in counts):
+            raise ValueError('Some count tables carry no number of iterations (e.g. empty tables), please pass the total number of iterations.')
+        merged['iterations'] = sum(int(c['iterations'].iloc[0]) for c in counts)
+    return merged
+
+def _iterations(counts, iterations):
+    if iterations is None:
+        iterations = int(counts['iterations'].iloc[0])
+    return iterations
+
+def burn_prob_from_counts(burnCounts, hexagons, iterations=None, **kwargs):
+    """Calculate burn probability of each hexagon from (merged) burn counts
+
+    Args:
+        burnCounts (DataFrame): burn counts from generate_burn_prob or merge_counts
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        iterations (int, optional): total number of iterations. Defaults to the value stored in burnCounts.
+
+    Returns:
+        GeoDataFrame: return a GeoDataFrame containing burn probability value at each hexagonal patches
+    """
+    iterations = _iterations(burnCounts, iterations)
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+
+    burnP = hexagon.merge(burnCounts[['Node_ID', 'burnCount']], on='Node_ID', how='left')
+    burnP.fillna(0, inplace=True)
+    burnP['burnProb'] = burnP['burnCount']/iterations*100
+    burnP = burnP[['Node_ID', 'burnProb', 'geometry']]
+    return burnP
+
+def ign_prob_from_counts(ignCounts, hexagons, iterations=None, **kwargs):
+    """Calculate ignition probability of each hexagon from (merged) ignition counts
+
+    Args:
+        ignCounts (DataFrame): ignition counts from generate_ign_prob or merge_counts
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        iterations (int, optional): total number of iterations. Defaults to the value stored in ignCounts.
+
+    Returns:
+        GeoDataFrame: return a GeoDataFrame containing ignition probability value at each hexagonal patches
+    """
+    iterations = _iterations(ignCounts, iterations)
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+
+    ignGr = hexagon.merge(ignCounts[['Node_ID', 'ignCount']], on='Node_ID', how='right')
+    ignGr.fillna(0, inplace=True)
+    ignGr['ignProb'] = ignGr['ignCount']/iterations*100
+    ignGr = ignGr[['Node_ID', 'ignProb', 'geometry']]
+    return ignGr
+
+def pij_from_counts(pijCounts, iterations=None):
+    """Calculate pij from (merged) counts of fires for each pair of i, j
+
+    Args:
+        pijCounts (DataFrame): pij counts from generate_fire_vectors, pij_from_vectors or merge_counts
+        iterations (int, optional): total number of iterations. Defaults to the value stored in pijCounts.
+
+    Returns:
+        DataFrame: return a dataframe with probability values for pairs of i, j on the landscape, same as pij_from_vectors
+    """
+    iterations = _iterations(pijCounts, iterations)
+    return _format_pij(pijCounts, iterations)
+
+def ssr_from_counts(counts, hexagons, **kwargs):
+    """Calculate Source-Sink Ratio from (merged) source and sink counts, or from (merged) pij counts
+
+    Args:
+        counts (DataFrame): source and sink counts from generate_ssr, or pij counts from generate_fire_vectors/pij_from_vectors
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+
+    Returns:
+        GeoDataFrame: return a GeoDataFrame containing the Source-Sink Ratio value at each hexagonal patches
+    """
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+
+    if 'firecounts' in counts.columns:
+        fire_orig = counts.groupby('column_i')[['firecounts']].sum()
+        fire_orig.reset_index(inplace=True)
+        fire_orig.rename(columns={'firecounts':'asSource'}, inplace=True)
+        fire_dest = counts.groupby('column_j')[['firecounts']].sum()
+        fire_dest.reset_index(inplace=True)
+        fire_dest.rename(columns={'firecounts':'asSink'}, inplace=True)
+    else:
+        fire_orig = counts.loc[counts['asSource'] > 0, ['Node_ID', 'asSource']].rename(columns={'Node_ID': 'column_i'})
+        fire_dest = counts.loc[counts['asSink'] > 0, ['Node_ID', 'asSink']].rename(columns={'Node_ID': 'column_j'})
+    return _ssr(hexagon, fire_orig, fire_dest)
+
+def _parents(lookup, level):
+    return pd.Series(lookup[level].to_numpy(), index=lookup['Node_ID'].to_numpy())
+
+def rollup_counts(counts, lookup, level='level_1'):
+    """Roll ignition counts up from the finest hexagons to a coarser level, without geometric overlay.
+       Ignition counts are summed over the finer hexagons of each parent, as each fire has a single ignition point.
+       Burn counts, source/sink counts and counts for pairs of i, j cannot be rolled up without the fire IDs, as a fire burning (or sending vectors to)
+       several finer hexagons of a parent is counted once for the parent, and vectors within a parent are dropped:
+       use rollup_burned for burn counts, and rollup_vectors followed by generate_ssr or pij_from_vectors for the others.
+
+    Args:
+        counts (DataFrame): ignition counts at the finest level, from generate_ign_prob with return_counts=True
+        lookup (DataFrame): outputs from create_hexagon_levels or parent_lookup function
+        level (str, optional): column of lookup with the parent Node_ID. Defaults to 'level_1'.
+
+    Returns:
+        DataFrame: return the ignition counts of the coarser hexagons
+    """
+    if 'firecounts' in counts.columns:
+        raise ValueError('Counts for pairs of i, j cannot be rolled up, please use rollup_vectors on the fire vectors.')
+    if 'burnCount' in counts.columns:
+        raise ValueError('Burn counts cannot be rolled up, please use rollup_burned on the hexagons burned by each fire.')
+    if 'asSource' in counts.columns or 'asSink' in counts.columns:
+        raise ValueError('Source and sink counts cannot be rolled up, please use rollup_vectors on the fire vectors and then generate_ssr.')
+    if level not in lookup.columns and 'parent_ID' in lookup.columns:
+        level = 'parent_ID'
+    parent = _parents(lookup, level)
+    rolled = counts.copy()
+    rolled['Node_ID'] = rolled['Node_ID'].map(parent)
+    valueCols = [c for c in rolled.columns if c in COUNT_COLUMNS]
+    how = {c: 'sum' for c in valueCols}
+    if 'iterations' in rolled.columns:
+        how['iterations'] = 'first'
+    rolled = rolled.groupby('Node_ID').agg(how)
+    rolled.reset_index(inplace=True)
+    return rolled
+
+def rollup_burned(burned, lookup, level='level_1', iterations=None):
+    """Roll the hexagons burned by each fire up from the finest hexagons to a coarser level, without geometric overlay, and count the fires burning each parent.
+       Each fire is counted once for each parent, as rollup_vectors does for pairs of i, j.
+       A parent is burned when any of its finer hexagons is, so the burn counts match generate_burn_prob on the coarser hexagons with threshold 0,
+       except along the edges of parents, as the hexagons do not nest exactly (e.g. parents on the boundary holding no finer hexagon get no counts).
+
+    Args:
+        burned (DataFrame): hexagons burned by each fire at the finest level, from generate_burn_prob with return_burned=True
+        lookup (DataFrame): outputs from create_hexagon_levels or parent_lookup function
+        level (str, optional): column of lookup with the parent Node_ID. Defaults to 'level_1'.
+        iterations (int, optional): number of iterations, stored with the counts. Defaults to None.
+
+    Returns:
+        DataFrame: return the burn counts of the coarser hexagons, to be used with burn_prob_from_counts
+    """
+    if level not in lookup.columns and 'parent_ID' in lookup.columns:
+        level = 'parent_ID'
+    parent = _parents(lookup, level)
+    rolled = burned.copy()
+    rolled['Node_ID'] = rolled['Node_ID'].map(parent)
+    rolled = rolled.drop_duplicates()
+    burnCounts = rolled.groupby('Node_ID').size().rename('burnCount').reset_index()
+    if iterations is not None:
+        burnCounts['iterations'] = iterations
+    return burnCounts
+
+def rollup_vectors(vectors, lookup, level='level_1'):
+    """Roll fire vectors up from the finest hexagons to a coarser level, without geometric overlay.
+       Each fire is counted once for each pair of parent hexagons, and pairs within the same parent are dropped, as in generate_fire_vectors.
+
+    Args:
+        vectors (DataFrame): outputs from generate_fire_vectors function at the finest level
+        lookup (DataFrame): outputs from create_hexagon_levels or parent_lookup function
+        level (str, optional): column of lookup with the parent Node_ID. Defaults to 'level_1'.
+
+    Returns:
+        DataFrame: return fire vectors of the coarser hexagons, to be used with pij_from_vectors or generate_ssr
+    """
+    if level not in lookup.columns and 'parent_ID' in lookup.columns:
+        level = 'parent_ID'
+    parent = _parents(lookup, level)
+    rolled = vectors.copy()
+    rolled['column_i'] = rolled['column_i'].map(parent)
+    rolled['column_j'] = rolled['column_j'].map(parent)
+    rolled = rolled.loc[rolled['column_i'] != rolled['column_j']]
+    rolled = rolled.drop_duplicates()
+    rolled.reset_index(drop=True, inplace=True)
+    return rolled
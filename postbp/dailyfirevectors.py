@@ -6,9 +6,9 @@ import numpy as np
 import pandas as pd
 import itertools
 from math import atan2, degrees
-from .common import prj2hex
-import warnings
-warnings.filterwarnings("ignore")
+from .catalog import FireCatalog, link_ignitions, _ignition_map, _warn_linkage
+from .common import prj2hex, _map_fires, _node_table, _node_coords
+from .tessellation import nodes_from_hexagons
 from tqdm import tqdm
 
 def angle(record):
@@ -31,6 +31,126 @@ def angle(record):
 
 
 
+def _xy_angle(xi, yi, xj, yj, xg, yg):
+    """angle function on the coordinates of the origin (i), destination (j) and ignition point (g)
+    """
+    deg1 = (360 + degrees(atan2(xg - xi, yg - yi))) % 360
+    deg2 = (360 + degrees(atan2(xj - xi, yj - yi))) % 360
+    return deg2 - deg1 if deg1 <= deg2 else 360 - (deg1 - deg2)
+
+def _beta_angles(xi, yi, xj, yj, xg, yg, bounds=()):
+    """Vectorized version of angle function, from coordinate arrays of the origin (i), destination (j) and ignition point (g).
+       numpy and math trigonometry may differ in the last digit, and vectors on the hexagon lattice often fall exactly on the bounds of the alpha sector
+       (or on 0, which flips to 360): angles within 1e-6 degree of the bounds or of 0 and 360 are calculated again as in angle function,
+       so the same vectors are selected as with calc_angles and select_angle
+    """
+    deg1 = (360 + np.degrees(np.arctan2(xg - xi, yg - yi))) % 360
+    deg2 = (360 + np.degrees(np.arctan2(xj - xi, yj - yi))) % 360
+    angles = np.where(deg1 <= deg2, deg2 - deg1, 360 - (deg1 - deg2))
+    near = (angles < 1e-6) | (angles > 360 - 1e-6)
+    for bound in bounds:
+        near |= np.abs(angles - bound) < 1e-6
+    if near.any():
+        coords = [np.broadcast_to(c, angles.shape)[near] for c in (xi, yi, xj, yj, xg, yg)]
+        angles[near] = [_xy_angle(*c) for c in zip(*coords)]
+    return angles
+
+def _daily_fire_blocks(catalog, i, hexagon, bufferFactor, threshold, SRID, ignPts):
+    """Project the daily perimeters of fire i of the catalog to the hexagons, and find the hexagons the fire spread from (leading edge) and to on each day.
+       The ignition hexagon and point of the fire are given by ignPts, see link_ignitions
+
+    Returns:
+        int: Node_ID of the ignition hexagon
+        list: (day, hexagons spread from, hexagons spread to) of each day; day 999 pairs the ignition hexagon with all hexagons in the final perimeter
+    """
+    ignPt, x, y = ignPts[i]
+    ##### ignition point to all hexes
+    dmax = max(catalog.days(i))
+    fire_idmax = catalog.day(i, dmax)
+    dfDmax = prj2hex(fire_idmax, hexagon, threshold)
+    # from ignition point to all other hexes in the fire perimeters (as regular fire vectors) are stored by day=999
+    blocks = [(999, [ignPt], list(dfDmax['Node_ID']))]
+    #### leading edge
+    leadEdge = [ignPt]
+    shpDB4 = gpd.GeoDataFrame(crs = SRID, geometry = gpd.points_from_xy([x], [y]).buffer(bufferFactor))
+    for d in range(1, dmax+1):
+        fire_id = catalog.day(i, d)
+        fire_idn = prj2hex(fire_id, hexagon, threshold)
+        ## hexagons in the fireshed of previous day
+        lstDB4 = prj2hex(shpDB4, hexagon, threshold)
+        lstDB4 = list(lstDB4['Node_ID'])
+        ## hexagons to be spread
+        listCur = list(fire_idn.loc[~fire_idn['Node_ID'].isin(lstDB4)]['Node_ID'])
+        #### consider when two days spread overlap in hexagon projections, hence listCur is empty
+        if listCur:
+            blocks.append((d, leadEdge, listCur))
+        #### update fireshed shape by merging fireshed of t with t-1
+        shpDB4 = fire_id.copy()
+        shpEx = gpd.GeoDataFrame(crs = SRID, geometry = shpDB4.exterior.buffer(1))
+        shpExHex = prj2hex(shpEx, hexagon, threshold = 0)
+        leadEdgeC = list(shpExHex['Node_ID'])
+        leadEdgeN = [x for x in leadEdgeC if x not in lstDB4]
+        if leadEdgeN:
+            leadEdge = leadEdgeN
+    return ignPt, blocks
+
+def _expand_block(day, src, dst):
+    """Expand a block of hexagons spread from and to into one row per pair of i, j
+    """
+    dfTemp = pd.DataFrame([e for e in itertools.product(src, dst)], columns = ['column_i', 'column_j'])
+    dfTemp['day'] = day
+    if day == 999:
+        dfTemp.drop(dfTemp.loc[dfTemp['column_i'] == dfTemp['column_j']].index, inplace = True)
+    return dfTemp
+
+def _select_block(day, src, dst, ignPt, table, alpha, chunksize=1000000):
+    """Calculate the beta angle of each pair of a block from the node coordinates, and expand only the pairs in the alpha sector.
+       The angles are calculated for chunks of rows (hexagons spread from) of about chunksize pairs, so the memory scales with the pairs kept
+    """
+    src, dst = np.asarray(src), np.asarray(dst)
+    minAngle, maxAngle = 180 - alpha/2, alpha/2 + 180
+    if day == 999 or day == 1:
+        # from ignition to all hexes in perimeter, or in day 1: origin is identical to ignition; the same angle for all pairs
+        angle = 361.0 if day == 999 else 181.0
+        if minAngle <= angle <= maxAngle:
+            ii, jj = np.repeat(np.arange(len(src)), len(dst)), np.tile(np.arange(len(dst)), len(src))
+        else:
+            ii = jj = np.array([], dtype=np.int64)
+        angles = np.full(len(ii), angle)
+    else:
+        xi, yi = _node_coords(table, src)
+        xj, yj = _node_coords(table, dst)
+        xg, yg = _node_coords(table, [ignPt])
+        rows = max(1, chunksize // max(len(dst), 1))
+        iiList, jjList, angleList = [np.array([], dtype=np.int64)], [np.array([], dtype=np.int64)], [np.array([])]
+        for start in range(0, len(src), rows):
+            block = slice(start, start + rows)
+            chunk = _beta_angles(xi[block, None], yi[block, None], xj[None, :], yj[None, :], xg[0], yg[0], (minAngle, maxAngle))
+            chunk = np.where(np.isnan(chunk), 181.0, chunk)  # as in calc_angles, when a node has no geometry
+            ci, cj = np.nonzero((chunk >= minAngle) & (chunk <= maxAngle))
+            iiList.append(ci + start)
+            jjList.append(cj)
+            angleList.append(chunk[ci, cj])
+        ii, jj, angles = np.concatenate(iiList), np.concatenate(jjList), np.concatenate(angleList)
+    dfTemp = pd.DataFrame({'column_i': src[ii], 'column_j': dst[jj], 'day': day, 'angle': angles})
+    if day == 999:
+        dfTemp.drop(dfTemp.loc[dfTemp['column_i'] == dfTemp['column_j']].index, inplace = True)
+    return dfTemp
+
+def _daily_vectors_of(i, catalog, hexagon, bufferFactor, threshold, SRID, ignPts, table, alpha):
+    """Daily fire vectors of fire i of the catalog, only those in the sector of alpha if given
+    """
+    ignPt, blocks = _daily_fire_blocks(catalog, i, hexagon, bufferFactor, threshold, SRID, ignPts)
+    if alpha is None:
+        dfMore = pd.concat([_expand_block(day, src, dst) for day, src, dst in blocks])
+    else:
+        dfMore = pd.concat([_select_block(day, src, dst, ignPt, table, alpha) for day, src, dst in blocks])
+    dfMore = dfMore.reset_index(drop = True)
+    dfMore.drop_duplicates(subset = ['column_i', 'column_j', 'day'], keep = 'first', inplace = True)
+    dfMore['fire'] = i
+    dfMore['ignPt'] = ignPt
+    return dfMore
+
 def generate_daily_vectors(fireshp, ignition, hexagons, bufferFactor=10, **kwargs):
     """Generate fire spreading vectors from the daily fire spread perimeters
 
@@ -40,69 +160,45 @@ def generate_daily_vectors(fireshp, ignition, hexagons, bufferFactor=10, **kwarg
         hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
         bufferFactor (int, optional): convert ignition point into a circle polygon of the diameter of bufferFactor
 it shall be small enough so as not to have ignition point locates in more than one hexagons it also defines threshold for the minimum area of fire perimeter to be in a hexagon to be regarded as burned. Defaults to 10.
+        alpha (degree, optional): fire spread sector angle, value from 0 to 360. If given, beta angles are calculated as the vectors are generated
+and only vectors in the sector are kept, same as calc_angles followed by select_angle. Defaults to None.
+        nodes (GeoDataFrame, optional): centroid points of the hexagonal patch network used for the beta angles. Defaults to the centroids of hexagons.
+        n_jobs (int, optional): number of threads processing fires in parallel. Defaults to 1.
+        policy (str, optional): for fires with more than one ignition point, see link_ignitions. Fires not linked to an ignition point are left out with a warning. Defaults to 'first'.
 
     Returns:
         DataFrame: a dataframe table containing fire starting hexagon ID (i), destination hexagon ID (j), 'day', fire ID, and ignition hexagon ID 
+                   (and beta angle if alpha is given)
     """    
     hexagon = hexagons.copy()
     if 'Node_ID' in kwargs:
         hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    alpha = kwargs.get('alpha')
+    table = None
+    if alpha is not None:
+        if 'nodes' in kwargs:
+            node = kwargs['nodes'].copy()
+            if 'Node_ID' in kwargs:
+                node = node.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+        else:
+            node = nodes_from_hexagons(hexagon)
+        table = _node_table(node)
     
     threshold = 3.1415926*bufferFactor**2 - 1 
     SRID = fireshp.crs
-    df = pd.DataFrame()
-    dfMore = pd.DataFrame()
-    
-    for i in tqdm(np.unique(fireshp['fire'])):
-        try: 
-            fire_i = fireshp.loc[fireshp['fire'] == i]
-            pts_i = ignition.loc[ignition['fire'] == i]
-            pts_ni = gpd.sjoin(pts_i, hexagon, how='inner', predicate='within')
-            ##### ignition point to all hexes
-            dmax = max(fire_i['day'])
-            fire_idmax = fire_i.loc[fire_i['day'] == dmax]
-            dfDmax = prj2hex(fire_idmax, hexagon, threshold)
-            dfMore = pd.DataFrame([e for e in itertools.product(pts_ni['Node_ID'], dfDmax['Node_ID'])], columns=['column_i', 'column_j'])
-            # from ignition point to all other hexes in the fire perimeters (as regular fire vectors) are stored by day=999
-            dfMore['day'] = 999       
-            dfMore.drop(dfMore.loc[dfMore['column_i'] == dfMore['column_j']].index, inplace = True)
-            #### leading edge
-            leadEdge = list(pts_ni['Node_ID'])
-            shpDB4 = gpd.GeoDataFrame(crs = SRID, geometry = pts_i.buffer(bufferFactor))
-            for d in range(1, max(fire_i['day'])+1):
-                fire_id = fire_i.loc[fire_i['day'] == d]
-                fire_idn = prj2hex(fire_id, hexagon, threshold)
-                ## hexagons in the fireshed of previous day
-                lstDB4 = prj2hex(shpDB4, hexagon, threshold)
-                lstDB4 = list(lstDB4['Node_ID'])
-                ## hexagons to be spread
-                listCur = list(fire_idn.loc[~fire_idn['Node_ID'].isin(lstDB4)]['Node_ID'])
-                #### consider when two days spread overlap in hexagon projections, hence listCur is empty
-                if listCur:
-                    dfTemp = pd.DataFrame([e for e in itertools.product(leadEdge, listCur)], columns = ['column_i', 'column_j'])
-                    dfTemp['day'] = d
-                else:
-                    dfTemp = pd.DataFrame()
-                dfMore = pd.concat([dfMore, dfTemp])  #, sort = False
-                dfMore.drop_duplicates(subset = ['column_i', 'column_j', 'day'], keep = 'first', inplace = True)
-                #### update fireshed shape by merging fireshed of t with t-1
-                shpDB4 = fire_id.copy()
-                shpEx = gpd.GeoDataFrame(crs = SRID, geometry = shpDB4.exterior.buffer(1))
-                shpExHex = prj2hex(shpEx, hexagon, threshold = 0)
-                leadEdgeC = list(shpExHex['Node_ID'])
-                leadEdgeN = [x for x in leadEdgeC if x not in lstDB4]
-                if leadEdgeN:
-                    leadEdge = leadEdgeN
-                else:
-                    pass
-            dfMore = dfMore.reset_index(drop = True)
-            dfMore.drop_duplicates(subset = ['column_i', 'column_j', 'day'], keep = 'first', inplace = True)
-            dfMore['fire'] = i
-            dfMore['ignPt'] = pts_ni['Node_ID'].item()
-            df = pd.concat([df, dfMore], sort = True)
-        except Exception as e:
-            with open("errorlog_dailyfire.txt", "w+") as f:
-                f.write(f'{e} occurs for fire ID # {i} \n')    
+    # build the spatial index once, shared by the threads
+    hexagon.sindex
+
+    linkage, report = link_ignitions(fireshp, ignition, hexagon, kwargs.get('policy', 'first'), keys=['fire'])
+    _warn_linkage(report)
+    ignPts = _ignition_map(linkage, ['fire'])
+    catalog = FireCatalog(fireshp, keys=['fire'])
+    args = (catalog, hexagon, bufferFactor, threshold, SRID, ignPts, table, alpha)
+    results = _map_fires(_daily_vectors_of, [i for i in catalog if i in ignPts], args, kwargs.get('n_jobs', 1))
+    df = pd.concat(results, sort = True) if results else pd.DataFrame()
+    if alpha is not None and not df.empty:
+        df.sort_values(by = ['fire','day'], kind = 'stable', inplace = True)
+        df.reset_index(drop = True, inplace = True)
     return df
 
 def calc_angles(vectors, nodes, **kwargs):
@@ -6,21 +6,26 @@
 '''
 
 import geopandas as gpd
-from shapely.geometry import  Point #, LineString, Polygon,
 import pandas as pd
-import warnings
-from shapely.errors import ShapelyDeprecationWarning
-warnings.filterwarnings("ignore", category=ShapelyDeprecationWarning)
 import numpy as np
-
-def read_fireshp(path_n_file_name, daily=False):
+import shapely
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import pyarrow  # noqa: F401
+    _CSV_ENGINE = 'pyarrow'
+except ImportError:
+    _CSV_ENGINE = 'c'
+
+def read_fireshp(path_n_file_name, daily=False, validate=False):
     """Load the files with the final and daily fire perimeters and prepares the data
 
     Args:
         path_n_file_name (string): path and file name of fire perimeter shapefile
+        validate (bool, optional): check and repair the geometry of the fire perimeters with check_fireshp. Defaults to False.
 
     Returns:
         GeoDataFrame: ignition point fire ID and geometry
+        DataFrame: report of repaired and dropped fires, only if validate is True
     """    
      # check whether it is a daily progression shapefile
 
@@ -36,18 +41,57 @@ def read_fireshp(path_n_file_name, daily=False):
     if not fire.crs:
         print('The fire perimeter shapefile does not have a valid projection, please set a valid SRID.')
     
+    if validate:
+        return check_fireshp(fire)
     return fire
       
-def read_pointcsv(path_n_file_name, SRID, **kwargs):
+def iter_fireshp(path_n_file_name, chunksize=10000, daily=False, validate=False):
+    """Read the fire perimeter shapefile in chunks of rows, so that large files need not be loaded at once
+
+    Args:
+        path_n_file_name (string): path and file name of fire perimeter shapefile
+        chunksize (int, optional): number of fire perimeters in each chunk. Defaults to 10000.
+        daily (bool, optional): whether it is a daily progression shapefile. Defaults to False.
+        validate (bool, optional): check and repair the geometry of each chunk with check_fireshp. Defaults to False.
+
+    Yields:
+        GeoDataFrame: fire perimeters of each chunk with fire ID, iteration ID (day) and geometry, indexed by row number in the file
+        DataFrame: report of repaired and dropped fires of the chunk, only if validate is True
+    """
+    start = 0
+    while True:
+        fire = gpd.read_file(path_n_file_name, rows=slice(start, start + chunksize))
+        if fire.empty:
+            break
+        fire.index = fire.index + start
+        if daily:
+            fire = fire[['fire', 'iteration', 'day', 'geometry']]
+        else:
+            fire = fire[['fire', 'iteration', 'geometry']]
+        if validate:
+            yield check_fireshp(fire)
+        else:
+            yield fire
+        start += chunksize
+
+def _read_csv(path_n_file_name, columns):
+    """Read only the needed columns, with the pyarrow engine if installed
+    """
+    return pd.read_csv(path_n_file_name, usecols=columns, engine=_CSV_ENGINE)
+
+def read_pointcsv(path_n_file_name, SRID, geometry=True, n_jobs=1, **kwargs):
     """Load the fire ignition points if this information is provided as a comma-delimited .csv file
 
     Args:
-        path_n_file_name (string): path and file name of fire ignition points shapefile
+        path_n_file_name (string or list): path and file name of fire ignition points csv file, or list of csv files of the same format (e.g. one per batch of iterations)
         SRID (CRS): spatial reference identifiers (SRID) 
+        geometry (bool, optional): build the point geometry. If False, the coordinates are returned as columns without geometry, e.g. for HexGrid.locate. Defaults to True.
+        n_jobs (int, optional): number of csv files read in parallel threads. Defaults to 1.
         x_col (str): column name of x coordinates, default to be 'x_coord'
         y_col (str): column name of x coordinates, default to be 'y_coord'
     Returns:
         GeoDataFrame: ignition point fire ID and geometry
+                      (DataFrame of fire ID, iteration ID and coordinates if geometry is False)
     """    
 
     if "x_col" in kwargs:
@@ -60,13 +104,20 @@ def read_pointcsv(path_n_file_name, SRID, **kwargs):
     else:
         y_col = 'y_coord'
 
-    #### read in BurnP-3 output ignition point csv file
-    points = pd.read_csv(path_n_file_name)
-    # points.columns=points.columns.str.strip()
-    points['geometry'] = [Point(xy) for xy in zip(points[x_col], points[y_col])]
+    #### read in BurnP-3 output ignition point csv file(s)
+    columns = ['fire', 'iteration', x_col, y_col]
+    if isinstance(path_n_file_name, (list, tuple)):
+        # the parser releases the GIL, so files are read in threads
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            points = pd.concat(list(executor.map(lambda f: _read_csv(f, columns), path_n_file_name)), ignore_index=True)
+    else:
+        points = _read_csv(path_n_file_name, columns)
+    points = points[columns]
+    if not geometry:
+        return points
     # note: make sure ignition points and fire shape are of the same projection, below it directly set by prj
-    points = gpd.GeoDataFrame(points, crs = SRID, geometry = points['geometry'] )
-    points = points[['fire', 'iteration', 'geometry']]
+    points = gpd.GeoDataFrame(points[['fire', 'iteration']], crs = SRID,
+                              geometry = gpd.points_from_xy(points[x_col], points[y_col]))
     return points
 
     
@@ -101,12 +152,9 @@ def read_pointshp(path_n_file_name, **kwargs):
         
     else:
         SRID = points.crs
-        points.drop(labels='geometry',axis=1,inplace=True)
-        points = points[['fire', 'iteration']]
-        points['geometry'] = [Point(xy) for xy in zip(points[x_col], points[y_col])]
         # note: make sure ignition points and fire shape are of the same projection, below it directly set by prj
-        points = gpd.GeoDataFrame(points, crs = SRID, geometry = points['geometry'] )
-        points = points[['fire', 'iteration', 'geometry']]
+        points = gpd.GeoDataFrame(points[['fire', 'iteration']], crs = SRID,
+                                  geometry = gpd.points_from_xy(points[x_col], points[y_col]))
 
     return points
 
@@ -117,11 +165,75 @@ def validify_fireshp(fireshp):
         fireshp (GeoDataFrame): fire perimeter dataset with fire ID (and iteration ID) and geometry
 
     Returns:
-        GeoDataFrame: return validified geodataframe
+        GeoDataFrame: return validified geodataframe, the input is not modified
     """    
-    from shapely.validation import make_valid
-    fireshp.geometry = fireshp.apply(lambda row: make_valid(row.geometry) if not row.geometry.is_valid else row.geometry, axis=1)
-    return fireshp
+    fire = fireshp.copy()
+    geoms = fire.geometry.to_numpy()
+    invalid = np.flatnonzero(~shapely.is_valid(geoms) & ~shapely.is_missing(geoms))
+    if len(invalid):
+        geoms = geoms.copy()
+        geoms[invalid] = shapely.make_valid(geoms[invalid])
+        fire[fire.geometry.name] = gpd.GeoSeries(geoms, index=fire.index, crs=fire.crs)
+    return fire
+
+def _polygonal(geoms):
+    """Keep the polygonal parts of repaired geometries; geometries without any polygonal part become None
+    """
+    geoms = geoms.copy()
+    types = shapely.get_type_id(geoms)
+    # 3: Polygon, 6: MultiPolygon, 7: GeometryCollection
+    for k in np.flatnonzero(types == 7):
+        parts = shapely.get_parts(shapely.get_parts(geoms[k]))
+        parts = parts[shapely.get_type_id(parts) == 3]
+        geoms[k] = shapely.unary_union(parts) if len(parts) else None
+    geoms[~np.isin(types, [3, 6, 7])] = None
+    geoms[shapely.is_empty(geoms)] = None
+    return geoms
+
+def check_fireshp(fireshp, n_jobs=1, chunksize=10000):
+    """Check the validity of fire perimeters in bulk, repair only the invalid ones, and report the fires repaired and dropped.
+       Perimeters are dropped if they are empty or have no polygonal part left after repair.
+
+    Args:
+        fireshp (GeoDataFrame): fire perimeter dataset with fire ID (and iteration ID) and geometry
+        n_jobs (int, optional): number of threads repairing chunks of invalid perimeters in parallel. Defaults to 1.
+        chunksize (int, optional): number of invalid perimeters repaired in each chunk. Defaults to 10000.
+
+    Returns:
+        GeoDataFrame: return the valid fire perimeters, the input is not modified
+        DataFrame: return the row index, fire ID (and iteration ID), reason and status ('repaired' or 'dropped') of each invalid perimeter.
+                   Note to give two variable names when using this function.
+    """
+    fire = fireshp.copy()
+    geoms = fire.geometry.to_numpy()
+    missing = shapely.is_missing(geoms) | shapely.is_empty(geoms)
+    invalid = np.flatnonzero(~shapely.is_valid(geoms) & ~missing)
+
+    reason = np.full(len(fire), None, dtype=object)
+    reason[missing] = 'Empty geometry'
+    status = np.full(len(fire), '', dtype=object)
+    status[missing] = 'dropped'
+    if len(invalid):
+        reason[invalid] = shapely.is_valid_reason(geoms[invalid])
+        chunks = [geoms[invalid[k:k + chunksize]] for k in range(0, len(invalid), chunksize)]
+        # shapely releases the GIL in make_valid, so chunks are repaired in threads without copying the data
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            repaired = np.concatenate(list(executor.map(shapely.make_valid, chunks)))
+        repaired = _polygonal(repaired)
+        geoms = geoms.copy()
+        geoms[invalid] = repaired
+        status[invalid] = np.where(shapely.is_missing(repaired), 'dropped', 'repaired')
+        fire[fire.geometry.name] = gpd.GeoSeries(geoms, index=fire.index, crs=fire.crs)
+
+    flagged = status != ''
+    report = pd.DataFrame({'index': fire.index[flagged]})
+    for column in ['fire', 'iteration', 'day']:
+        if column in fire.columns:
+            report[column] = fire[column].to_numpy()[flagged]
+    report['reason'] = reason[flagged]
+    report['status'] = status[flagged]
+    fire = fire.loc[status != 'dropped']
+    return fire, report
 
 
 def _loadCSVdata(file_path):
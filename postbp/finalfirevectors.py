@@ -8,15 +8,55 @@
     else, current module suffices
 '''
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from .common import prj2hex
-import warnings
-warnings.filterwarnings("ignore")
-from shapely.errors import ShapelyDeprecationWarning
-warnings.filterwarnings("ignore", category=ShapelyDeprecationWarning)
+from .common import prj2hex, _map_fires
+from .dataloader import iter_fireshp
+from .catalog import FireCatalog, link_ignitions, _ignition_map, _warn_linkage
 from tqdm import tqdm
 
-def _spatial_join(fireshp, ignition, hexagon, threshold=0, iteration=False):
+def _fire_keys(*frames):
+    """Columns identifying a fire: (iteration, fire) if all frames have an iteration column, otherwise fire only
+    """
+    if all('iteration' in frame.columns for frame in frames):
+        return ['iteration', 'fire']
+    return ['fire']
+
+def _ignition_nodes(fireshp, ignition, hexagon, policy='first'):
+    """Identify the ignition hexagon (i) of each fire with link_ignitions, warning for fires not linked one to one.
+       If fireshp is a path, only its attribute table is read.
+    """
+    fires = gpd.read_file(fireshp, ignore_geometry=True) if isinstance(fireshp, str) else fireshp
+    keys = _fire_keys(fires, ignition)
+    linkage, report = link_ignitions(fires, ignition, hexagon, policy, keys=keys)
+    _warn_linkage(report)
+    return linkage[keys + ['ignPt']].rename(columns={'ignPt': 'column_i'})
+
+def _burned_nodes(fires, hexagon, keys, threshold=0):
+    """Identify the hexagons burned (j) by each fire with one overlay
+    """
+    fire_n = prj2hex(fires[keys + ['geometry']], hexagon[['Node_ID', 'geometry']], threshold)
+    fire_n = pd.DataFrame(fire_n[keys + ['Node_ID']]).rename(columns={'Node_ID': 'column_j'})
+    return fire_n
+
+def _link_vectors(fire_n, pts_n, keys):
+    """Join burned hexagons with the ignition hexagon of the same fire, dropping the ignition hexagon itself
+    """
+    vectors = fire_n.merge(pts_n, on=keys, how='inner')
+    vectors = vectors.loc[vectors['column_j'] != vectors['column_i']]
+    vectors = vectors[['column_j', 'column_i'] + keys[::-1]]
+    return vectors
+
+def _fire_vectors_of(i, catalog, hexagon, threshold, ignPts):
+    """Project the perimeters of fire i of the catalog to the hexagonal network, with the ignition hexagon of the fire from ignPts
+    """
+    fire_ni = prj2hex(catalog.perimeters(i), hexagon, threshold)
+    dfTemp = pd.DataFrame(fire_ni.drop(columns='geometry')).rename(columns={'Node_ID': 'Node_ID_x'})
+    dfTemp['Node_ID_y'] = ignPts[i][0]
+    dfTemp = dfTemp.loc[dfTemp['Node_ID_x'] != dfTemp['Node_ID_y']]
+    return dfTemp
+
+def _spatial_join(fireshp, ignition, hexagon, threshold=0, iteration=False, n_jobs=1, policy='first'):
     """Project fire perimeter and ignition points to the hexagonal network
 
     Args:
@@ -25,6 +65,8 @@ def _spatial_join(fireshp, ignition, hexagon, threshold=0, iteration=False):
         hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
         threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as intersecting with shp0. Defaults to 0.
         iteration (bool, optional): Defaults to False. If multiple fires in each iteration, then set value to True
+        n_jobs (int, optional): number of threads projecting fires in parallel. Defaults to 1.
+        policy (str, optional): for fires with more than one ignition point, see link_ignitions. Fires not linked to an ignition point are left out with a warning. Defaults to 'first'.
 
     Returns:
         GeoDataFrame: igntion point, starting point and destination point of each fire being identified with hexagon ID
@@ -33,53 +75,20 @@ def _spatial_join(fireshp, ignition, hexagon, threshold=0, iteration=False):
     # make sure hexagons, fireShp and ignition point shapefile are in the same projection
     ignition = ignition.to_crs(fireshp.crs)
     hexagon = hexagon.to_crs(fireshp.crs)
+    # build the spatial index once, shared by the threads
+    hexagon.sindex
 
-    fire_vectors = pd.DataFrame()
-
-    if not iteration:
-        for i in tqdm(fireshp['fire']):
-            try:
-                fire_i = fireshp.loc[fireshp['fire'] == i]
-                fire_ni = prj2hex(fire_i, hexagon, threshold)                        
-                pts_i = ignition.loc[ignition['fire'] == i]
-                 # GeoPandas >= 0.10: use predicate= (op= raises TypeError in 1.x)
-                pts_ni = gpd.sjoin(pts_i, hexagon, how='inner', predicate='within')
-                pts_ni = pts_ni[['fire', 'Node_ID']]
-                
-                dfTemp = fire_ni.merge(pts_ni, on = 'fire', how = 'left')
-                dfTemp = dfTemp.drop(dfTemp[dfTemp['Node_ID_x'] == dfTemp['Node_ID_y']].index)
-                dfTemp.drop(labels = ['geometry'], axis = 1, inplace = True)
-                fire_vectors = pd.concat([fire_vectors, dfTemp], sort = True)
-                
-            except Exception as e:
-                with open("errorlog_finalfire.txt", "w+") as f:
-                    f.write(f'{e} occurs for fire ID # {i} \n')   
-        return fire_vectors
-
-
-    if iteration:
-        for j in tqdm(set(fireshp['iteration'])):
-            fire_j = fireshp.loc[fireshp['iteration'] == j]
-            pts_j = ignition.loc[ignition['iteration'] == j]
-            
-            for i in fireshp['fire']:
-                try:
-                    fire_i = fire_j.loc[fire_j['fire'] == i]
-                    fire_ni = prj2hex(fire_i, hexagon, threshold)                             
-                    pts_i = pts_j.loc[pts_j['fire'] == i]
-                    #Newer version op is replace by predicate
-                    pts_ni = gpd.sjoin(pts_i, hexagon, how='inner', predicate='within') 
-                    pts_ni = pts_ni[['fire', 'Node_ID']]
-                    
-                    dfTemp = fire_ni.merge(pts_ni, on = 'fire', how = 'left')
-                    dfTemp = dfTemp.drop(dfTemp[dfTemp['Node_ID_x'] == dfTemp['Node_ID_y']].index)
-                    dfTemp.drop(labels = ['geometry'], axis = 1, inplace = True)
-                    fire_vectors = pd.concat([fire_vectors, dfTemp], sort = True)
-                
-                except Exception as e:
-                    with open("errorlog_finalfire.txt", "w+") as f:
-                        f.write(f'{e} occurs for fire ID # {i} \n')                         
-        return fire_vectors
+    # fires are identified by fire ID, or by iteration and fire ID when looping by iteration
+    keys = ['iteration', 'fire'] if iteration else ['fire']
+    linkage, report = link_ignitions(fireshp, ignition, hexagon, policy, keys=keys)
+    _warn_linkage(report)
+    ignPts = _ignition_map(linkage, keys)
+    catalog = FireCatalog(fireshp, keys=keys)
+    results = _map_fires(_fire_vectors_of, [i for i in catalog if i in ignPts], (catalog, hexagon, threshold, ignPts), n_jobs)
+    if not results:
+        return pd.DataFrame()
+    fire_vectors = pd.concat(results, sort = True)
+    return fire_vectors
             
 def generate_fire_vectors(fireshp, ignition, hexagons, threshold = 0, loopBy = "fire", **kwargs):
     """Generate fire spreading vectors from final fire spread perimeters
@@ -90,20 +99,34 @@ def generate_fire_vectors(fireshp, ignition, hexagons, threshold = 0, loopBy = "
         hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
         threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as intersecting with shp0. Defaults to 0.
         loopBy (str, optional): loop by 'fire' of 'iteration'. Defaults to "fire".
+        return_counts (bool, optional): also return the raw counts of fires for each pair of i, j, see module counts. Defaults to False.
+        iterations (int, optional): number of iterations, required if return_counts is True
+        n_jobs (int, optional): number of threads projecting fires in parallel; shapely releases the GIL, so threads share the hexagons without copies. Defaults to 1.
+        policy (str, optional): for fires with more than one ignition point, keep the 'first' or 'last' point, 'drop' the fire or raise an 'error',
+                                see link_ignitions. Fires not linked to an ignition point are left out with a warning. Defaults to 'first'.
 
     Returns:
         DataFrame: a dataframe table containing fire starting hexagon ID (i), destination hexagon ID (j), fire ID, and ignition hexagon ID 
+        DataFrame: raw counts of fires for each pair of i, j and number of iterations, only if return_counts is True
     """    
+    if kwargs.get('return_counts', False) and 'iterations' not in kwargs:
+        raise ValueError('Please provide the number of iterations to return the raw counts of fire vectors.')
+
     hexagon = hexagons.copy()
     if 'Node_ID' in kwargs:
         hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
     
     if loopBy == "iteration":
-        fire_vectors = _spatial_join(fireshp, ignition, hexagon, threshold, iteration=True)
+        fire_vectors = _spatial_join(fireshp, ignition, hexagon, threshold, iteration=True, n_jobs=kwargs.get('n_jobs', 1),
+                                     policy=kwargs.get('policy', 'first'))
     
     if loopBy == "fire":
-        fire_vectors = _spatial_join(fireshp, ignition, hexagon, threshold, iteration=False)
+        fire_vectors = _spatial_join(fireshp, ignition, hexagon, threshold, iteration=False, n_jobs=kwargs.get('n_jobs', 1),
+                                     policy=kwargs.get('policy', 'first'))
      
+    if fire_vectors.empty:
+        # no fire linked to an ignition point
+        fire_vectors = pd.DataFrame(columns=['Node_ID_x', 'Node_ID_y', 'fire', 'iteration'], dtype=int)
     fire_vectors = fire_vectors.reset_index(drop = True)
     fire_vectors.drop(fire_vectors[fire_vectors['Node_ID_y'].isna()].index, inplace = True)                    
     
@@ -112,26 +135,121 @@ def generate_fire_vectors(fireshp, ignition, hexagons, threshold = 0, loopBy = "
     
     fire_vectors.columns = ['Node_ID_x', 'Node_ID_y', 'fire', 'iteration']
     fire_vectors.rename(columns={'Node_ID_x':'column_j', 'Node_ID_y':'column_i'}, inplace=True)
+    if kwargs.get('return_counts', False):
+        return fire_vectors, _pij_counts(fire_vectors, kwargs['iterations'])
     return fire_vectors
 
-def pij_from_vectors(vectors, iterations):
+def _pij_counts(vectors, iterations):
+    """Count the fires for each pair of i, j, leaving out fires that stay in their ignition hexagon
+    """
+    pijCounts = vectors.groupby(['column_j', 'column_i'])[['fire']].count()
+    pijCounts.reset_index(inplace = True)
+    pijCounts = pijCounts.drop(pijCounts[pijCounts['column_j'] == pijCounts['column_i']].index)
+    pijCounts.rename(columns={'fire':'firecounts'}, inplace=True)
+    pijCounts['iterations'] = iterations
+    return pijCounts
+
+def _add_pair_counts(codes, counts, pending):
+    """Add the pending (pair code, count) arrays into the running sparse counts
+    """
+    codes = np.concatenate([codes] + [p[0] for p in pending])
+    counts = np.concatenate([counts] + [p[1] for p in pending])
+    codes, inverse = np.unique(codes, return_inverse=True)
+    counts = np.bincount(inverse, weights=counts, minlength=len(codes)).astype(np.int64)
+    return codes, counts
+
+def pij_from_perimeters(fireshp, ignition, hexagons, iterations, threshold=0, chunksize=10000, **kwargs):
+    """Calculate pij from final fire perimeters and ignition points in one streaming pass, keeping only a running count for each pair of i, j.
+       Memory scales with the number of distinct pairs of i, j instead of the total number of hexagons burned by all fires.
+
+    Args:
+        fireshp (GeoDataFrame or str): fire perimeter dataset with fire ID (and iteration ID) and geometry, or path of the fire perimeter shapefile to read in chunks
+        ignition (GeoDataFrame): ignition point shapes with fire ID (and iteration ID) field in attributes
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        iterations (int): number of iterations
+        threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as intersecting with fire perimeter. Defaults to 0.
+        chunksize (int, optional): number of fire perimeters projected to the hexagons at a time. Defaults to 10000.
+        return_counts (bool, optional): also return the raw counts of fires for each pair of i, j, see module counts. Defaults to False.
+        return_vectors (bool, optional): also return the fire vectors, same as generate_fire_vectors. Defaults to False.
+        policy (str, optional): for fires with more than one ignition point, see link_ignitions. Fires not linked to an ignition point are left out with a warning. Defaults to 'first'.
+
+    Returns:
+        DataFrame: return a dataframe with probability values for pairs of i, j on the landscape, same as pij_from_vectors
+        DataFrame: raw counts of fires for each pair of i, j and number of iterations, only if return_counts is True
+        DataFrame: fire vectors, only if return_vectors is True
+    """
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+
+    if isinstance(fireshp, str):
+        chunks = iter_fireshp(fireshp, chunksize)
+    else:
+        chunks = (fireshp.iloc[start:start + chunksize] for start in range(0, len(fireshp), chunksize))
+
+    # pairs of i, j are encoded as i * base + j
+    base = np.int64(hexagon['Node_ID'].max()) + 1
+    codes, counts = np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    pending, pendingSize = [], 0
+    vectorList = []
+    pts_n = _ignition_nodes(fireshp, ignition, hexagon, kwargs.get('policy', 'first'))
+    keys = _fire_keys(pts_n)
+    for chunk in tqdm(chunks):
+        chunk = chunk.to_crs(hexagon.crs)
+        vectors = _link_vectors(_burned_nodes(chunk, hexagon, keys, threshold), pts_n, keys)
+        if kwargs.get('return_vectors', False):
+            vectorList.append(vectors)
+        chunkCodes, chunkCounts = np.unique(vectors['column_i'].to_numpy(np.int64) * base + vectors['column_j'].to_numpy(np.int64),
+                                            return_counts=True)
+        pending.append((chunkCodes, chunkCounts))
+        pendingSize += len(chunkCodes)
+        # merge only when the pending pairs outgrow the running counts, so the merging cost stays proportional to the distinct pairs
+        if pendingSize > len(codes):
+            codes, counts = _add_pair_counts(codes, counts, pending)
+            pending, pendingSize = [], 0
+    codes, counts = _add_pair_counts(codes, counts, pending)
+
+    pijCounts = pd.DataFrame({'column_j': codes % base, 'column_i': codes // base, 'firecounts': counts})
+    pijCounts['iterations'] = iterations
+    outputs = [_format_pij(pijCounts, iterations)]
+    if kwargs.get('return_counts', False):
+        outputs.append(pijCounts)
+    if kwargs.get('return_vectors', False):
+        if vectorList:
+            outputs.append(pd.concat(vectorList, ignore_index=True))
+        else:
+            # no perimeter: no fire vectors
+            outputs.append(pd.DataFrame(columns=['column_j', 'column_i'] + keys[::-1], dtype=int))
+    if len(outputs) == 1:
+        return outputs[0]
+    return tuple(outputs)
+
+def pij_from_vectors(vectors, iterations, return_counts=False):
     """Group vector pair by i, j and calculate probability by dividing number of occurrence by number of iterations
 
     Args:
         vectors (dataframe): outputs from generate_fire_vectors function
         iterations (int): number of iterations
+        return_counts (bool, optional): also return the raw counts of fires for each pair of i, j, see module counts. Defaults to False.
 
     Returns:
         GeoDataFrame: return a geodataframe with probability values for pairs of i, j on the landscape
+        DataFrame: raw counts of fires for each pair of i, j and number of iterations, only if return_counts is True
     """    
 
-    fire_pij = vectors.groupby(['column_j', 'column_i'])[['fire']].count()
-    fire_pij.reset_index(inplace = True)
-    fire_pij = fire_pij.drop(fire_pij[fire_pij['column_j'] == fire_pij['column_i']].index)
-    fire_pij['pij'] = fire_pij['fire'] / iterations
+    pijCounts = _pij_counts(vectors, iterations)
+    fire_pij = _format_pij(pijCounts, iterations)
+    if return_counts:
+        return fire_pij, pijCounts
+    return fire_pij
+
+def _format_pij(pijCounts, iterations):
+    """Divide the fire counts of each pair of i, j by the number of iterations and format the pij table
+    """
+    fire_pij = pijCounts[['column_j', 'column_i', 'firecounts']].copy()
+    fire_pij['pij'] = fire_pij['firecounts'] / iterations
     fire_pij['pij'] = fire_pij['pij'].round(7)
     fire_pij['pij'] = fire_pij['pij'].apply(lambda x: '%.7f' % x)
-    fire_pij.rename(columns={'fire':'firecounts'},inplace=True)
     fire_pij.sort_values(by = ['column_i', 'column_j'], inplace = True)
     fire_pij.reset_index(drop=True, inplace=True)
     return fire_pij
\ No newline at end of file
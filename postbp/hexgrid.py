@@ -0,0 +1,295 @@
+'''Module for a compact binary representation of the hexagonal network.
+1. the Node_ID, centre coordinates and (optionally) vertex coordinates of the hexagons are kept as flat arrays, with the size of the hexagons and the projection in a small header.
+2. the arrays are saved in one file aligned for memory mapping, loading is a zero-copy view of the file instead of reading a shapefile or creating the hexagons again.
+3. the arrays can be placed in shared memory; a grid backed by a file or by shared memory is pickled as its file path or block name, so the workers of a process pool attach to one copy of the arrays.
+4. hexagons and nodes GeoDataFrames are rebuilt from the arrays on demand.
+'''
+
+import json
+import math
+import threading
+import geopandas as gpd
+import numpy as np
+import shapely
+from multiprocessing import resource_tracker, shared_memory
+
+MAGIC = b'POSTBPHX'
+ALIGN = 64
+_FIELDS = ['Node_ID', 'x', 'y', 'vertices']
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+_attachLock = threading.Lock()
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # track was added in python 3.13, before that attaching registers the block with the resource tracker,
+        # which then reports it as leaked (or unlinks it) when the worker exits: skip the registration
+        with _attachLock:
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+class HexGrid:
+    """Hexagonal network stored as flat arrays
+
+    Attributes:
+        Node_ID (array): ID of each hexagon
+        x (array): x coordinate of the centre of each hexagon
+        y (array): y coordinate of the centre of each hexagon
+        side (float): side length of the hexagons
+        crs (str): projection of the coordinates as WKT, None if not defined
+        vertices (array): n x 7 x 2 coordinates of the (closed) exterior ring of each hexagon, None if not stored
+    """
+    def __init__(self, Node_ID, x, y, side, crs=None, vertices=None):
+        self.Node_ID = np.asarray(Node_ID)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.side = float(side)
+        self.crs = crs
+        self.vertices = None if vertices is None else np.asarray(vertices, dtype=np.float64)
+        # file path or shared memory block the arrays are views of
+        self._source = None
+        self._buffer = None
+        self._lattice = None
+
+    @classmethod
+    def from_hexagons(cls, hexagons, vertices=False, **kwargs):
+        """Build the grid from hexagons, e.g. outputs from create_hexagons function
+
+        Args:
+            hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+            vertices (bool, optional): also keep the vertex coordinates, so to_hexagons returns the exact geometry. Defaults to False.
+
+        Returns:
+            HexGrid: the grid of the hexagons
+        """
+        hexagon = hexagons
+        if 'Node_ID' in kwargs:
+            hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+        geoms = hexagon.geometry.to_numpy()
+        centre = shapely.centroid(geoms)
+        xmin, _, xmax, _ = geoms[0].bounds
+        crs = hexagon.crs.to_wkt() if hexagon.crs is not None else None
+        coords = None
+        if vertices:
+            coords = shapely.get_coordinates(shapely.get_exterior_ring(geoms))
+            if len(coords) != 7 * len(geoms):
+                raise ValueError('The hexagons must have six vertices each to keep the vertex coordinates.')
+            coords = coords.reshape(len(geoms), 7, 2)
+        return cls(hexagon['Node_ID'].to_numpy(), shapely.get_x(centre), shapely.get_y(centre), (xmax - xmin) / 2, crs, coords)
+
+    def __len__(self):
+        return len(self.Node_ID)
+
+    @property
+    def area(self):
+        """Area of each hexagon
+        """
+        return 3 * math.sqrt(3) / 2 * self.side**2
+
+    def _build_lattice(self):
+        """Index the hexagons by column and row of the lattice of create_hexagons (flat-topped hexagons, every other column shifted by half a row)
+        """
+        h_step = 1.5 * self.side
+        v_step = math.sqrt(3) * self.side
+        x0 = self.x.min()
+        col = np.rint((self.x - x0) / h_step).astype(np.int64)
+        y0 = self.y[col % 2 == 0].min()
+        shift = (col % 2) * v_step / 2
+        row = np.rint((self.y - y0 - shift) / v_step).astype(np.int64)
+        if (np.abs(x0 + col * h_step - self.x).max(initial=0) > 1e-6 * self.side
+                or np.abs(y0 + shift + row * v_step - self.y).max(initial=0) > 1e-6 * self.side):
+            raise ValueError('The hexagons are not on a regular lattice, e.g. as created by create_hexagons.')
+        row0 = row.min()
+        table = np.full((col.max() + 1, row.max() - row0 + 1), -1, dtype=np.int64)
+        table[col, row - row0] = np.arange(len(self))
+        self._lattice = (x0, y0, h_step, v_step, row0, table)
+        return self._lattice
+
+    def locate(self, x, y):
+        """Find the hexagon containing each point from the lattice arithmetic, without spatial join
+
+        Args:
+            x (array): x coordinates of the points, in the projection of the grid
+            y (array): y coordinates of the points, in the projection of the grid
+
+        Returns:
+            array: return the Node_ID of the hexagon containing each point, -1 for points outside the hexagons
+        """
+        x0, y0, h_step, v_step, row0, table = self._lattice or self._build_lattice()
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        # the nearest centre is in one of the two nearest columns, and in the nearest row of that column
+        col = np.floor((x - x0) / h_step).astype(np.int64)[:, None] + np.array([0, 1])
+        shift = (col % 2) * v_step / 2
+        row = np.rint((y[:, None] - y0 - shift) / v_step).astype(np.int64)
+        dist = (x0 + col * h_step - x[:, None])**2 + (y0 + shift + row * v_step - y[:, None])**2
+        best = np.argmin(dist, axis=1)[:, None]
+        col = np.take_along_axis(col, best, axis=1).ravel()
+        row = np.take_along_axis(row, best, axis=1).ravel() - row0
+        inside = (col >= 0) & (col < table.shape[0]) & (row >= 0) & (row < table.shape[1])
+        pos = np.full(len(x), -1, dtype=np.int64)
+        pos[inside] = table[col[inside], row[inside]]
+        node = np.full(len(x), -1, dtype=np.int64)
+        node[pos >= 0] = self.Node_ID[pos[pos >= 0]]
+        return node
+
+    def to_hexagons(self):
+        """Rebuild the hexagons, same as the outputs of create_hexagons
+
+        Returns:
+            GeoDataFrame: return a geodataframe of hexagonal patches with Node_ID
+        """
+        coords = self.vertices
+        if coords is None:
+            angle = np.radians(np.arange(0, 360, 60))
+            coords = np.stack([self.x[:, None] + np.cos(angle) * self.side,
+                               self.y[:, None] + np.sin(angle) * self.side], axis=-1)
+            coords = np.concatenate([coords, coords[:, :1]], axis=1)
+        hexagons = gpd.GeoDataFrame({'geometry': shapely.polygons(coords), 'Node_ID': np.array(self.Node_ID)}, crs=self.crs)
+        return hexagons
+
+    def to_nodes(self):
+        """Rebuild the nodes (centroids) of the hexagons, same as nodes_from_hexagons
+
+        Returns:
+            GeoDataFrame: return nodes geometry with Node_ID
+        """
+        nodes = gpd.GeoDataFrame({'geometry': gpd.points_from_xy(self.x, self.y), 'Node_ID': np.array(self.Node_ID)}, crs=self.crs)
+        return nodes
+
+    def _layout(self):
+        arrays = {'Node_ID': self.Node_ID, 'x': self.x, 'y': self.y}
+        if self.vertices is not None:
+            arrays['vertices'] = self.vertices
+        header = {'side': self.side, 'crs': self.crs, 'arrays': {}}
+        # header length is not known before the offsets, reserve room for it
+        offset = _aligned(16 + len(json.dumps({**header, 'arrays': {k: {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': 10**15}
+                                                                     for k, a in arrays.items()}}).encode()))
+        for k, a in arrays.items():
+            header['arrays'][k] = {'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset}
+            offset = _aligned(offset + a.nbytes)
+        return arrays, header, offset
+
+    def _write(self, buffer, arrays, header):
+        raw = json.dumps(header).encode()
+        buffer[:8] = np.frombuffer(MAGIC, dtype=np.uint8)
+        buffer[8:16] = np.frombuffer(np.uint64(len(raw)).tobytes(), dtype=np.uint8)
+        buffer[16:16 + len(raw)] = np.frombuffer(raw, dtype=np.uint8)
+        for k, a in arrays.items():
+            spec = header['arrays'][k]
+            buffer[spec['offset']:spec['offset'] + a.nbytes] = np.frombuffer(np.ascontiguousarray(a).tobytes(), dtype=np.uint8)
+
+    @classmethod
+    def _from_buffer(cls, buffer):
+        buffer = np.frombuffer(buffer, dtype=np.uint8)
+        if bytes(buffer[:8]) != MAGIC:
+            raise ValueError('Not a HexGrid file.')
+        size = int(np.frombuffer(bytes(buffer[8:16]), dtype=np.uint64)[0])
+        header = json.loads(bytes(buffer[16:16 + size]))
+        arrays = {}
+        for k in _FIELDS:
+            if k in header['arrays']:
+                spec = header['arrays'][k]
+                dtype = np.dtype(spec['dtype'])
+                count = int(np.prod(spec['shape']))
+                arrays[k] = np.frombuffer(buffer, dtype=dtype, count=count, offset=spec['offset']).reshape(spec['shape'])
+                arrays[k].flags.writeable = False
+        return cls(arrays['Node_ID'], arrays['x'], arrays['y'], header['side'], header['crs'], arrays.get('vertices'))
+
+    def save(self, path_n_file_name):
+        """Save the grid to one binary file, the arrays aligned for memory mapping
+        """
+        arrays, header, size = self._layout()
+        buffer = np.zeros(size, dtype=np.uint8)
+        self._write(buffer, arrays, header)
+        buffer.tofile(path_n_file_name)
+
+    @classmethod
+    def load(cls, path_n_file_name, mmap=True):
+        """Load a grid saved with HexGrid.save
+
+        Args:
+            path_n_file_name (str): path of the file
+            mmap (bool, optional): map the file to memory, the arrays are read-only views of the file and pages are read on first access. Defaults to True.
+
+        Returns:
+            HexGrid: the grid of the hexagons
+        """
+        if mmap:
+            buffer = np.memmap(path_n_file_name, dtype=np.uint8, mode='r')
+        else:
+            buffer = np.fromfile(path_n_file_name, dtype=np.uint8)
+        grid = cls._from_buffer(buffer)
+        grid._buffer = buffer
+        if mmap:
+            grid._source = ('file', str(path_n_file_name))
+        return grid
+
+    def close(self):
+        """Release the arrays and close the file or shared memory block they are views of, the grid cannot be used afterwards.
+           Arrays taken from the grid (e.g. grid.x) must be released before, as a shared memory block cannot be closed while views of it exist.
+        """
+        self.Node_ID = self.x = self.y = self.vertices = None
+        self._lattice = None
+        buffer, self._buffer, self._source = self._buffer, None, None
+        if isinstance(buffer, shared_memory.SharedMemory):
+            buffer.close()
+
+    def __del__(self):
+        # release the views before the shared memory block closes itself
+        if isinstance(self._buffer, shared_memory.SharedMemory):
+            self.close()
+
+    def to_shared_memory(self, name=None):
+        """Copy the grid to a shared memory block. The grid returned is pickled as the name of the block only,
+           pass it to the workers of a process pool instead of the hexagons.
+           Once the workers are done, call close() on the grid returned, then unlink() on the shared memory block.
+
+        Args:
+            name (str, optional): name of the shared memory block. Defaults to a random name.
+
+        Returns:
+            HexGrid: the grid with arrays in shared memory
+            SharedMemory: return the shared memory block.
+                          Note to give two variable names when using this function.
+        """
+        arrays, header, size = self._layout()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        buffer = np.ndarray(size, dtype=np.uint8, buffer=shm.buf)
+        self._write(buffer, arrays, header)
+        grid = self._from_buffer(shm.buf)
+        grid._buffer = shm
+        grid._source = ('shm', shm.name)
+        return grid, shm
+
+    @classmethod
+    def from_shared_memory(cls, name):
+        """Attach to a grid in shared memory created with HexGrid.to_shared_memory, without copying the arrays
+
+        Args:
+            name (str): name of the shared memory block
+
+        Returns:
+            HexGrid: the grid of the hexagons
+        """
+        shm = _attach(name)
+        grid = cls._from_buffer(shm.buf)
+        grid._buffer = shm
+        grid._source = ('shm', name)
+        return grid
+
+    def __reduce__(self):
+        if self._source is not None and self._source[0] == 'shm':
+            return (HexGrid.from_shared_memory, (self._source[1],))
+        if self._source is not None and self._source[0] == 'file':
+            return (HexGrid.load, (self._source[1],))
+        return (HexGrid, (np.array(self.Node_ID), np.array(self.x), np.array(self.y), self.side, self.crs,
+                          None if self.vertices is None else np.array(self.vertices)))
@@ -0,0 +1,197 @@
+'''Module for network analysis of fire transmission on the hexagonal network.
+1. load pij and arcs into scipy.sparse CSR matrices, rows and columns indexed by Node_ID.
+2. strength, multi-hop exposure and reachability, top contributing sources and transmission clusters as vectorized sparse operations.
+'''
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+
+def _node_ids(hexagons, *columns):
+    if hexagons is not None:
+        return np.unique(hexagons['Node_ID'].to_numpy())
+    return np.unique(np.concatenate([np.asarray(c) for c in columns]))
+
+def _positions(node_ids, values):
+    pos = np.searchsorted(node_ids, values)
+    if (pos >= len(node_ids)).any() or (node_ids[np.minimum(pos, len(node_ids) - 1)] != values).any():
+        raise ValueError('Some Node_IDs are not in the hexagons.')
+    return pos
+
+def pij_to_matrix(pij, hexagons=None, weight='pij', **kwargs):
+    """Load pij into a sparse matrix, row i to column j
+
+    Args:
+        pij (DataFrame): outputs from pij_from_vectors function
+        hexagons (GeoDataFrame, optional): geometry of hexagonal patches with ID field. If given, the matrix covers all hexagons, otherwise only the nodes in pij.
+        weight (str, optional): column used as weight of the transmission from i to j, e.g. 'pij' or 'firecounts'. Defaults to 'pij'.
+
+    Returns:
+        csr_matrix: return the weighted transmission matrix
+        array: return the Node_ID of each row and column of the matrix.
+               Note to give two variable names when using this function.
+    """
+    fire_pij = pij.copy()
+    if 'column_i' in kwargs:
+        fire_pij.rename(columns={kwargs["column_i"]: 'column_i'}, inplace=True)
+    if 'column_j' in kwargs:
+        fire_pij.rename(columns={kwargs["column_j"]: 'column_j'}, inplace=True)
+    if hexagons is not None and 'Node_ID' in kwargs:
+        hexagons = hexagons.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+
+    node_ids = _node_ids(hexagons, fire_pij['column_i'], fire_pij['column_j'])
+    rows = _positions(node_ids, fire_pij['column_i'].to_numpy())
+    cols = _positions(node_ids, fire_pij['column_j'].to_numpy())
+    values = fire_pij[weight].astype(float).to_numpy()
+    matrix = sparse.csr_matrix((values, (rows, cols)), shape=(len(node_ids), len(node_ids)))
+    return matrix, node_ids
+
+def arcs_to_matrix(arcs, hexagons=None, **kwargs):
+    """Load the arcs connecting neighbouring hexagons into a sparse adjacency matrix
+
+    Args:
+        arcs (GeoDataFrame): outputs from create_arcs function
+        hexagons (GeoDataFrame, optional): geometry of hexagonal patches with ID field. If given, the matrix covers all hexagons, otherwise only the nodes in arcs.
+
+    Returns:
+        csr_matrix: return the adjacency matrix, 1 for neighbouring hexagons
+        array: return the Node_ID of each row and column of the matrix.
+               Note to give two variable names when using this function.
+    """
+    if hexagons is not None and 'Node_ID' in kwargs:
+        hexagons = hexagons.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    node_ids = _node_ids(hexagons, arcs['Node_1'], arcs['Node_2'])
+    rows = _positions(node_ids, arcs['Node_1'].to_numpy())
+    cols = _positions(node_ids, arcs['Node_2'].to_numpy())
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(node_ids), len(node_ids)))
+    # arcs are listed in both directions, make sure each pair counts once
+    matrix.data[:] = 1
+    return matrix, node_ids
+
+def node_strength(matrix, node_ids):
+    """Calculate the out- and in-strength (sum of weights) and degree (number of links) of every node
+
+    Args:
+        matrix (csr_matrix): outputs from pij_to_matrix or arcs_to_matrix function
+        node_ids (array): Node_ID of each row and column of the matrix
+
+    Returns:
+        DataFrame: return Node_ID, outStrength, inStrength, outDegree and inDegree of each node
+    """
+    binary = matrix.copy()
+    binary.data = (binary.data != 0).astype(float)
+    strength = pd.DataFrame({'Node_ID': node_ids,
+                             'outStrength': np.asarray(matrix.sum(axis=1)).ravel(),
+                             'inStrength': np.asarray(matrix.sum(axis=0)).ravel(),
+                             'outDegree': np.asarray(binary.sum(axis=1)).ravel().astype(int),
+                             'inDegree': np.asarray(binary.sum(axis=0)).ravel().astype(int)})
+    return strength
+
+def multi_hop_exposure(matrix, node_ids, k=2):
+    """Calculate the exposure of every node to fire transmitted over up to k hops, i.e. the column sums of P + P^2 + ... + P^k
+
+    Args:
+        matrix (csr_matrix): outputs from pij_to_matrix function
+        node_ids (array): Node_ID of each row and column of the matrix
+        k (int, optional): maximum number of hops. Defaults to 2.
+
+    Returns:
+        DataFrame: return Node_ID and the exposure of each hop count (exposure_1 ... exposure_k) and in total
+    """
+    exposure = pd.DataFrame({'Node_ID': node_ids})
+    hop = np.ones(matrix.shape[0])
+    total = np.zeros(matrix.shape[0])
+    matrixT = matrix.T.tocsr()
+    for h in range(1, k + 1):
+        hop = matrixT @ hop
+        exposure[f'exposure_{h}'] = hop
+        total += hop
+    exposure['exposure'] = total
+    return exposure
+
+def k_hop_reach(matrix, node_ids, sources, k=2):
+    """Find the nodes reachable from the source nodes within k hops
+
+    Args:
+        matrix (csr_matrix): outputs from pij_to_matrix or arcs_to_matrix function
+        node_ids (array): Node_ID of each row and column of the matrix
+        sources (list): Node_IDs the fire spread from
+        k (int, optional): maximum number of hops. Defaults to 2.
+
+    Returns:
+        DataFrame: return the source Node_ID (column_i), the reachable Node_ID (column_j) and the minimum number of hops
+    """
+    sources = np.unique(np.asarray(sources))
+    pos = _positions(node_ids, sources)
+    adjacency = matrix.copy()
+    adjacency.data = (adjacency.data != 0).astype(np.int32)
+    adjacency.eliminate_zeros()
+
+    # frontier and visited as sources x nodes 0/1 sparse matrices, expanded one hop at a time;
+    # int32 so that the number of frontier predecessors of a node does not wrap around to 0
+    visited = sparse.csr_matrix((np.ones(len(pos), dtype=np.int32), (np.arange(len(pos)), pos)), shape=(len(pos), len(node_ids)))
+    frontier = visited
+    reached = []
+    for h in range(1, k + 1):
+        frontier = frontier @ adjacency
+        frontier.data = (frontier.data != 0).astype(np.int32)
+        frontier = frontier - frontier.multiply(visited)
+        frontier.eliminate_zeros()
+        if frontier.nnz == 0:
+            break
+        coo = frontier.tocoo()
+        reached.append(pd.DataFrame({'column_i': sources[coo.row], 'column_j': node_ids[coo.col], 'hops': h}))
+        visited = visited + frontier
+    if not reached:
+        return pd.DataFrame(columns=['column_i', 'column_j', 'hops'])
+    reach = pd.concat(reached, ignore_index=True)
+    reach.sort_values(by=['column_i', 'hops', 'column_j'], inplace=True)
+    reach.reset_index(drop=True, inplace=True)
+    return reach
+
+def top_k_sources(matrix, node_ids, k=5):
+    """Find the k nodes contributing the most fire transmission to every node
+
+    Args:
+        matrix (csr_matrix): outputs from pij_to_matrix function
+        node_ids (array): Node_ID of each row and column of the matrix
+        k (int, optional): number of sources kept for each node. Defaults to 5.
+
+    Returns:
+        DataFrame: return the receiving Node_ID (column_j), the source Node_ID (column_i), the weight and the rank of the source
+    """
+    coo = matrix.tocoo()
+    sources = pd.DataFrame({'column_j': node_ids[coo.col], 'column_i': node_ids[coo.row], 'weight': coo.data})
+    sources.sort_values(by=['column_j', 'weight', 'column_i'], ascending=[True, False, True], inplace=True)
+    sources['rank'] = sources.groupby('column_j').cumcount() + 1
+    sources = sources.loc[sources['rank'] <= k]
+    sources.reset_index(drop=True, inplace=True)
+    return sources
+
+def transmission_clusters(matrix, node_ids, min_weight=0, connection='weak'):
+    """Detect clusters of nodes connected by fire transmission, as connected components of the links with weight above min_weight
+
+    Args:
+        matrix (csr_matrix): outputs from pij_to_matrix or arcs_to_matrix function
+        node_ids (array): Node_ID of each row and column of the matrix
+        min_weight (float, optional): links with weight less than or equal to min_weight are left out. Defaults to 0.
+        connection (str, optional): 'weak' ignores the direction of transmission, 'strong' requires transmission both ways. Defaults to 'weak'.
+
+    Returns:
+        DataFrame: return Node_ID, cluster ID and the number of nodes in the cluster; nodes without links above min_weight are left out
+    """
+    links = matrix.copy()
+    links.data = np.where(links.data > min_weight, 1, 0).astype(np.int32)
+    links.eliminate_zeros()
+    _, labels = csgraph.connected_components(links, directed=True, connection=connection)
+    linked = (np.asarray(links.sum(axis=1)).ravel() + np.asarray(links.sum(axis=0)).ravel()) > 0
+    clusters = pd.DataFrame({'Node_ID': node_ids[linked], 'cluster': labels[linked]})
+    # number clusters from 1 by decreasing size
+    size = clusters['cluster'].map(clusters['cluster'].value_counts())
+    clusters['clusterSize'] = size
+    order = clusters.groupby('cluster')['clusterSize'].first().sort_values(ascending=False, kind='stable')
+    clusters['cluster'] = clusters['cluster'].map(pd.Series(np.arange(1, len(order) + 1), index=order.index))
+    clusters.sort_values(by=['cluster', 'Node_ID'], inplace=True)
+    clusters.reset_index(drop=True, inplace=True)
+    return clusters
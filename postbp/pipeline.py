@@ -0,0 +1,202 @@
+'''Module for running the postbp workflow end to end from a config file.
+1. the workflow is a set of stages (read fires, read ignitions, hexagons, fire vectors, pij, burn probability, ...), each depending on the outputs of upstream stages.
+2. each stage output is saved in the output folder with a fingerprint of its parameters, input files and upstream fingerprints.
+3. on a rerun, only the stages whose fingerprint changed are recomputed, the others are loaded from the output folder (or not at all if nothing downstream needs them).
+4. stages not depending on each other (e.g. burn probability and fire vectors) run concurrently in threads.
+'''
+
+import glob
+import hashlib
+import json
+import os
+import geopandas as gpd
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import __version__
+from .dataloader import read_fireshp, read_pointcsv, read_pointshp, validify_fireshp
+from .finalfirevectors import generate_fire_vectors, pij_from_vectors
+from .postbp import generate_burn_prob, generate_ign_prob, generate_ssr
+from .spreadrose import generate_fire_rose
+from .tessellation import create_hexagons_nodes, nodes_from_hexagons
+
+def _fires(config, params, inputs):
+    fire = read_fireshp(config['fireshp'])
+    if params.get('validify', True):
+        fire = validify_fireshp(fire)
+    return fire
+
+def _ignition(config, params, inputs):
+    if config['ignition'].lower().endswith('.csv'):
+        return read_pointcsv(config['ignition'], config.get('SRID'), **params)
+    return read_pointshp(config['ignition'], **params)
+
+def _hexagons(config, params, inputs):
+    if isinstance(config['hexagons'], str):
+        hexagons = gpd.read_file(config['hexagons'])
+        return hexagons, nodes_from_hexagons(hexagons)
+    return create_hexagons_nodes(inputs['fires'], **config['hexagons'])
+
+def _fire_vectors(config, params, inputs):
+    return generate_fire_vectors(inputs['fires'], inputs['ignition'], inputs['hexagons'][0], **params)
+
+def _pij(config, params, inputs):
+    return pij_from_vectors(inputs['fire_vectors'], config['iterations'], **params)
+
+def _burn_prob(config, params, inputs):
+    return generate_burn_prob(inputs['fires'], inputs['hexagons'][0], config['iterations'], **params)
+
+def _ign_prob(config, params, inputs):
+    return generate_ign_prob(inputs['ignition'], inputs['hexagons'][0], config['iterations'], **params)
+
+def _ssr(config, params, inputs):
+    return generate_ssr(inputs['fire_vectors'], inputs['hexagons'][0], **params)
+
+def _fire_rose(config, params, inputs):
+    return generate_fire_rose(inputs['pij'], inputs['hexagons'][1], **params)
+
+# stage name: function, upstream stages, config entries naming input files, other config entries the stage depends on
+STAGES = {
+    'fires': (_fires, [], ['fireshp'], []),
+    'ignition': (_ignition, [], ['ignition'], ['SRID']),
+    'hexagons': (_hexagons, ['fires'], ['hexagons'], ['hexagons']),
+    'fire_vectors': (_fire_vectors, ['fires', 'ignition', 'hexagons'], [], []),
+    'pij': (_pij, ['fire_vectors'], [], ['iterations']),
+    'burn_prob': (_burn_prob, ['fires', 'hexagons'], [], ['iterations']),
+    'ign_prob': (_ign_prob, ['ignition', 'hexagons'], [], ['iterations']),
+    'ssr': (_ssr, ['fire_vectors', 'hexagons'], [], []),
+    'fire_rose': (_fire_rose, ['pij', 'hexagons'], [], []),
+}
+PRODUCTS = ['pij', 'burn_prob', 'ign_prob', 'ssr', 'fire_rose']
+
+def _upstream(name, config):
+    deps = STAGES[name][1]
+    if name == 'hexagons' and isinstance(config.get('hexagons'), str):
+        # hexagons read from file do not depend on the fire perimeters
+        deps = []
+    return deps
+
+def _file_state(path):
+    """Path, size and modification time of a file and its sidecar files (e.g. .dbf, .shx and .prj of a shapefile)
+    """
+    if not isinstance(path, str):
+        return None
+    files = sorted(set(glob.glob(os.path.splitext(path)[0] + '.*')) | {path})
+    return [(os.path.basename(f), os.path.getsize(f), os.stat(f).st_mtime_ns) for f in files if os.path.exists(f)]
+
+def _fingerprint(name, config, upstream):
+    _, _, fileKeys, keys = STAGES[name]
+    state = {'stage': name, 'version': __version__,
+             'params': config.get('params', {}).get(name, {}),
+             'config': {k: config.get(k) for k in keys},
+             'files': {k: _file_state(config.get(k)) for k in fileKeys},
+             'upstream': {d: upstream[d] for d in _upstream(name, config)}}
+    return hashlib.sha256(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+def load_config(path_n_file_name):
+    """Read the pipeline config from a JSON file, paths in the config are relative to the config file
+
+    Args:
+        path_n_file_name (str): path and file name of the JSON config file
+
+    Returns:
+        dict: the pipeline config
+    """
+    with open(path_n_file_name) as f:
+        config = json.load(f)
+    root = os.path.dirname(os.path.abspath(path_n_file_name))
+    for k in ['fireshp', 'ignition', 'hexagons', 'output_dir']:
+        if isinstance(config.get(k), str):
+            config[k] = os.path.join(root, config[k])
+    return config
+
+def _needed(targets, config):
+    order = []
+    def visit(name):
+        if name not in order:
+            for d in _upstream(name, config):
+                visit(d)
+            order.append(name)
+    for name in targets:
+        visit(name)
+    return order
+
+def _export(name, output, output_dir):
+    if isinstance(output, gpd.GeoDataFrame):
+        output.to_file(os.path.join(output_dir, f'{name}.shp'))
+    elif isinstance(output, pd.DataFrame):
+        output.to_csv(os.path.join(output_dir, f'{name}.csv'), index=False)
+
+def run_pipeline(config, targets=None, n_jobs=None, force=False):
+    """Run the stages needed for the targets, recomputing only the stages whose parameters, input files or upstream stages changed.
+
+       The config (a dict or a JSON file) defines fireshp, ignition (.csv or .shp, with SRID for .csv), hexagons (path of a hexagon shapefile,
+       or arguments of create_hexagons_nodes, e.g. {"area": 1000000}), iterations, output_dir, and optionally targets, n_jobs and
+       params: {stage name: keyword arguments of the stage function}, e.g. {"burn_prob": {"threshold": 0.1}}.
+
+    Args:
+        config (dict or str): the pipeline config, or path of the JSON config file
+        targets (list, optional): stages to run, out of pij, burn_prob, ign_prob, ssr, fire_rose (or any stage in STAGES).
+                                  Defaults to the targets in config, or all of pij, burn_prob and ssr.
+        n_jobs (int, optional): number of stages run concurrently. Defaults to n_jobs in config, or 2.
+        force (bool, optional): recompute all the stages needed for the targets. Defaults to False.
+
+    Returns:
+        dict: return the output of each target stage
+    """
+    if isinstance(config, str):
+        config = load_config(config)
+    targets = targets or config.get('targets', ['pij', 'burn_prob', 'ssr'])
+    n_jobs = n_jobs or config.get('n_jobs', 2)
+    output_dir = config.get('output_dir', 'postbp_output')
+    os.makedirs(output_dir, exist_ok=True)
+    for name in targets:
+        if name not in STAGES:
+            raise ValueError(f'Unknown stage {name}, please use one of {list(STAGES)}.')
+
+    order = _needed(targets, config)
+    fingerprints = {}
+    for name in order:
+        fingerprints[name] = _fingerprint(name, config, fingerprints)
+
+    def cached(name):
+        stamp = os.path.join(output_dir, f'{name}.json')
+        if force or not os.path.exists(stamp) or not os.path.exists(os.path.join(output_dir, f'{name}.pkl')):
+            return False
+        with open(stamp) as f:
+            return json.load(f).get('fingerprint') == fingerprints[name]
+
+    stale = [name for name in order if not cached(name)]
+    # cached stages are loaded only if a target or an input of a stale stage
+    load = set(targets) | {d for name in stale for d in _upstream(name, config)}
+    pending = [name for name in order if name in stale or name in load]
+    results = {}
+
+    def task(name):
+        pkl = os.path.join(output_dir, f'{name}.pkl')
+        if name not in stale:
+            print(f'{name}: up to date, loaded from {pkl}')
+            return pd.read_pickle(pkl)
+        print(f'{name}: running')
+        func = STAGES[name][0]
+        inputs = {d: results[d] for d in _upstream(name, config)}
+        output = func(config, dict(config.get('params', {}).get(name, {})), inputs)
+        pd.to_pickle(output, pkl)
+        if name in PRODUCTS:
+            _export(name, output, output_dir)
+        # the fingerprint is written last, so an interrupted stage is rerun
+        with open(os.path.join(output_dir, f'{name}.json'), 'w') as f:
+            json.dump({'stage': name, 'fingerprint': fingerprints[name]}, f)
+        return output
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        while pending or running:
+            for name in list(pending):
+                if name in stale and any(d not in results for d in _upstream(name, config)):
+                    continue
+                pending.remove(name)
+                running[executor.submit(task, name)] = name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return {name: results[name] for name in targets}
@@ -1,8 +1,12 @@
 """Main module."""
 
 import numpy as np
-from .common import prj2hex
+import pandas as pd
+from scipy import sparse
+from .common import prj2hex, _map_parallel
+from .rasterize import cell_to_hex, check_raster, rasterize_burn_counts
 import geopandas as gpd
+import warnings
 
 def generate_burn_prob(fireshp, hexagons, iterations, **kwargs):
     """Generate shapefile of hexagonal network with values of burn likelihood
@@ -12,9 +16,28 @@ def generate_burn_prob(fireshp, hexagons, iterations, **kwargs):
         fireshp (GeoDataFrame): fire perimeter dataset with fire ID (and iteration ID) and geometry
         hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
         iterations (int): number of iterations
+        return_counts (bool, optional): also return the raw burn counts of each hexagon, see module counts. Defaults to False.
+        engine (str, optional): 'overlay' for the exact polygon overlay, or 'raster' to rasterize the perimeters on a fine grid (see module rasterize),
+                                much faster for large numbers of perimeters at the cost of sub-cell precision. Defaults to 'overlay'.
+        cell_size (float, optional): side length of the cells of the raster engine. Defaults to a quarter of the hexagon side.
+        check_sample (int, optional): number of perimeters the raster engine is compared with the overlay on, hexagon by hexagon, see check_raster.
+                                      A warning summarises the hexagons counted differently. 0 skips the comparison,
+                                      or compares all the perimeters with return_error. Defaults to 100.
+        return_error (bool, optional): with the raster engine, also return the comparison of each hexagon from check_raster. Defaults to False.
+        n_jobs (int, optional): number of threads overlaying chunks of perimeters in parallel with the overlay engine. Defaults to 1.
+        weights (DataFrame, optional): iteration ID and weight of each iteration (and stratum), e.g. of weather streams or seasons.
+                                       If given, burn probability is the weighted mean over iterations of the number of fires burning each hexagon
+                                       (x100, as without weights several fires of one iteration are all counted), and iterations is not used. Defaults to None.
+        stratum (str, optional): column of weights with the stratum of each iteration. If given, burn probability of each stratum (burnProb_<stratum>)
+                                 is also returned, from the same overlay. Defaults to None.
+        return_burned (bool, optional): also return the hexagons burned by each fire, to be rolled up to coarser hexagons with rollup_burned.
+                                        Defaults to False.
 
     Returns:
         GeoDataFrame: return a GeoDataFrame containing burn probability value at each hexagonal patches
+        DataFrame: raw burn counts and number of iterations, only if return_counts is True
+        DataFrame: fire ID (and iteration ID) and Node_ID of each hexagon burned by each fire, only if return_burned is True
+        DataFrame: burn counts of the sample by the overlay and by the raster of each hexagon, only if return_error is True with the raster engine
     """    
     if 'threshold' in kwargs:
         threshold = kwargs['threshold']
@@ -23,18 +46,68 @@ def generate_burn_prob(fireshp, hexagons, iterations, **kwargs):
     hexagon = hexagons.copy()
     if 'Node_ID' in kwargs:
         hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    weights = kwargs.get('weights')
+    if weights is not None and kwargs.get('engine', 'overlay') == 'raster':
+        raise ValueError('The raster engine does not keep the iteration of each fire, please use the overlay engine with weights.')
+    if weights is not None and (kwargs.get('return_counts', False) or kwargs.get('return_burned', False)):
+        raise ValueError('Raw counts are not available with weights, please call without return_counts and return_burned.')
+    if kwargs.get('return_burned', False) and kwargs.get('engine', 'overlay') == 'raster':
+        raise ValueError('The raster engine does not keep the fire IDs, please use the overlay engine with return_burned.')
 
-    fireOL = prj2hex(fireshp, hexagon, threshold=threshold)
-    if 'fire_column' in kwargs:
-        fireOL.rename(columns={kwargs["fire_column"]: 'fire'}, inplace=True) 
-       
-    burned = fireOL.groupby('Node_ID')[['fire']].count()
-    burned.reset_index(inplace=True)
+    if kwargs.get('engine', 'overlay') == 'raster':
+        grid = cell_to_hex(hexagon, kwargs.get('cell_size'))
+        burned, rasterError = rasterize_burn_counts(fireshp, hexagon, threshold=threshold, grid=grid)
+        burned.rename(columns={'burnCount': 'fire'}, inplace=True)
+        sample = kwargs.get('check_sample', 100)
+        hexError = None
+        if sample or kwargs.get('return_error', False):
+            hexError = check_raster(fireshp, hexagon, threshold=threshold, grid=grid, sample=sample or None)
+            nSample = min(sample, len(fireshp)) if sample else len(fireshp)
+            wrong = hexError.loc[hexError['diff'] != 0]
+            if len(wrong):
+                # the largest difference of the sample, scaled to all the perimeters
+                maxPoints = wrong['diff'].abs().max() * len(fireshp) / nSample / iterations * 100
+                warnings.warn(f"Raster engine: {len(wrong)} of {len(hexError)} hexagons burned by a sample of {nSample} perimeters are counted "
+                              f"differently than by the overlay, by up to {wrong['diff'].abs().max()} fires (about {maxPoints:.1f} points of burn probability "
+                              f"over all perimeters); relative error of burned area {rasterError['relError'].abs().mean():.2%} on average, "
+                              f"{rasterError['relError'].abs().max():.2%} at most. See check_raster.")
+    else:
+        n_jobs = kwargs.get('n_jobs', 1)
+        if n_jobs > 1:
+            # perimeters overlaid in chunks by a pool of threads sharing the hexagons and their spatial index
+            hexagon.sindex
+            chunks = [c for c in np.array_split(np.arange(len(fireshp)), n_jobs * 4) if len(c)]
+            fireOL = pd.concat(_map_parallel(prj2hex, [(fireshp.iloc[c], hexagon, threshold) for c in chunks], n_jobs, executor='thread'),
+                               ignore_index=True)
+        else:
+            fireOL = prj2hex(fireshp, hexagon, threshold=threshold)
+        if 'fire_column' in kwargs:
+            fireOL.rename(columns={kwargs["fire_column"]: 'fire'}, inplace=True) 
+        if weights is not None:
+            burnP = _weighted_prob(fireOL, hexagon, weights, kwargs.get('stratum'), 'burnProb')
+            return burnP
+           
+        if kwargs.get('return_burned', False):
+            keys = ['iteration', 'fire'] if 'iteration' in fireOL.columns else ['fire']
+            fireBurned = pd.DataFrame(fireOL[keys + ['Node_ID']]).drop_duplicates().reset_index(drop=True)
+        burned = fireOL.groupby('Node_ID')[['fire']].count()
+        burned.reset_index(inplace=True)
     burnP = hexagon.merge(burned, on='Node_ID', how='left')
     burnP.fillna(0, inplace=True)
     burnP['burnProb'] = burnP['fire']/iterations*100
-    burnP = burnP[['Node_ID', 'burnProb', 'geometry']]
-    return burnP
+    outputs = [burnP[['Node_ID', 'burnProb', 'geometry']]]
+    if kwargs.get('return_counts', False):
+        burnCounts = burnP[['Node_ID', 'fire']].rename(columns={'fire': 'burnCount'})
+        burnCounts['burnCount'] = burnCounts['burnCount'].astype(int)
+        burnCounts['iterations'] = iterations
+        outputs.append(burnCounts)
+    if kwargs.get('return_burned', False):
+        outputs.append(fireBurned)
+    if kwargs.get('return_error', False) and kwargs.get('engine', 'overlay') == 'raster':
+        outputs.append(hexError)
+    if len(outputs) == 1:
+        return outputs[0]
+    return tuple(outputs)
 
 def generate_ign_prob(ignition, hexagons, iterations, **kwargs):
     """Generate shapefile of hexagonal network with values of ignition likelihood
@@ -44,8 +117,12 @@ def generate_ign_prob(ignition, hexagons, iterations, **kwargs):
         ignition (_type_): _description_
         hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
         iterations (int): number of iterations
+        return_counts (bool, optional): also return the raw ignition counts of each hexagon, see module counts. Defaults to False.
+        weights (DataFrame, optional): iteration ID and weight of each iteration (and stratum), as in generate_burn_prob. Defaults to None.
+        stratum (str, optional): column of weights with the stratum of each iteration, as in generate_burn_prob. Defaults to None.
     Returns:
         GeoDataFrame: return a GeoDataFrame containing ignition probability value at each hexagonal patches
+        DataFrame: raw ignition counts and number of iterations, only if return_counts is True
 
     """    
 
@@ -57,13 +134,53 @@ def generate_ign_prob(ignition, hexagons, iterations, **kwargs):
         ign.rename(columns={kwargs["fire_column"]: 'fire'}, inplace=True)    
 
     ignSJ = gpd.sjoin(ign, hexagon, how='inner', predicate='within')
+    if kwargs.get('weights') is not None:
+        if kwargs.get('return_counts', False):
+            raise ValueError('Raw counts are not available with weights, please call without return_counts.')
+        ignGr = _weighted_prob(ignSJ, hexagon, kwargs['weights'], kwargs.get('stratum'), 'ignProb')
+        return ignGr.loc[ignGr['ignProb'] > 0].reset_index(drop=True)
     ignGr = ignSJ.groupby(['Node_ID'])[['fire']].count()
     ignGr = hexagon.merge(ignGr, on='Node_ID', how='right')
     ignGr.fillna(0, inplace=True)
     ignGr['ignProb'] = ignGr['fire']/iterations*100
+    if kwargs.get('return_counts', False):
+        ignCounts = ignGr[['Node_ID', 'fire']].rename(columns={'fire': 'ignCount'})
+        ignCounts['ignCount'] = ignCounts['ignCount'].astype(int)
+        ignCounts['iterations'] = iterations
+        return ignGr[['Node_ID', 'ignProb', 'geometry']], ignCounts
     ignGr = ignGr[['Node_ID', 'ignProb', 'geometry']]
     return ignGr
 
+def _weighted_prob(events, hexagon, weights, stratum, column):
+    """Weighted expected number of fires (or ignitions) per iteration x100 of each hexagon (and stratum), with one weighted bincount
+       over the hexagon x stratum codes: each fire adds the weight of its iteration, and the sums are divided by the total weight of the stratum.
+       Events of iterations not in weights are left out.
+    """
+    weights = weights.drop_duplicates(subset='iteration').set_index('iteration')
+    w = weights['weight'] if 'weight' in weights.columns else pd.Series(1.0, index=weights.index)
+    strata, code = [], np.zeros(len(weights), dtype=np.int64)
+    if stratum is not None:
+        code, strata = pd.factorize(weights[stratum], sort=True)
+    nStrata = max(len(strata), 1)
+    node_ids = hexagon['Node_ID'].to_numpy()
+    hexPos = pd.Series(np.arange(len(node_ids)), index=node_ids)
+
+    if 'iteration' not in events.columns:
+        raise ValueError('The fires must have an iteration column to be weighted.')
+    row = weights.index.get_indexer(events['iteration'].to_numpy())
+    keep = row >= 0
+    row = row[keep]
+    pos = hexPos.reindex(events['Node_ID'].to_numpy()[keep]).to_numpy().astype(np.int64)
+    sums = np.bincount(pos * nStrata + code[row], weights=w.to_numpy()[row], minlength=len(node_ids) * nStrata)
+    sums = sums.reshape(len(node_ids), nStrata)
+    totals = np.bincount(code, weights=w.to_numpy(), minlength=nStrata)
+
+    probs = pd.DataFrame({'Node_ID': node_ids, column: sums.sum(axis=1) / w.sum() * 100})
+    for k, s in enumerate(strata):
+        probs[f'{column}_{s}'] = sums[:, k] / totals[k] * 100
+    probs = hexagon[['Node_ID', 'geometry']].merge(probs, on='Node_ID', how='left')
+    return probs[['Node_ID'] + [c for c in probs.columns if c.startswith(column)] + ['geometry']]
+
 def generate_fireshed(fire_vectors, AOCshp, fireshp, hexagons, **kwargs):
     """Generate the fireshed in regard to an area of concern (AOC) based on the fire vectors 
 
@@ -126,15 +243,100 @@ def generate_fireplain(fire_vectors, AOCshp, fireshp, hexagons, **kwargs):
     fireAOCshp['area_ha'] = fireAOCshp.area/10000
     return fireAOCshp
 
+def generate_fireshed_sizes(fire_vectors, hexagons, iterations=None, chunksize=10000, **kwargs):
+    """Generate the fireshed and fireplain size of every hexagon, i.e. the fireshed and fireplain of each hexagon taken as the area of concern,
+       from the fire vectors in one pass of sparse products of the fire x hexagon incidence matrices:
+       the fireshed of a hexagon is the ignition hexagons of the fires burning into it (as in generate_fireshed, fires ignited in the hexagon are not counted
+       unless they burn into it from another hexagon), the fireplain is the hexagons burned by the fires ignited in it (the ignition hexagon included).
+       Fires staying in their ignition hexagon have no fire vectors and are not counted.
+
+    Args:
+        fire_vectors (DataFrame): outputs from generate_fire_vectors function
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        iterations (int, optional): number of iterations. If given, also return the sum of pij over the fireshed (fireshedExp = sum of pij(i, h) over i),
+                                    i.e. the expected number of fires per iteration burning into each hexagon from another hexagon, and over the fireplain
+                                    (fireplainExp = sum of pij(h, j) over j), i.e. the expected number of other hexagons burned per iteration by fires
+                                    ignited in each hexagon. Defaults to None.
+        chunksize (int, optional): number of hexagons per block of the fire x hexagon product, to bound the memory. Defaults to 10000.
+
+    Returns:
+        GeoDataFrame: return Node_ID, number of hexagons (fireshedSize, fireplainSize) and area in hectares (fireshedHa, fireplainHa)
+                      of the fireshed and fireplain of each hexagon, and geometry
+    """
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    fv = fire_vectors.copy()
+    if 'column_i' in kwargs:
+        fv.rename(columns={kwargs["column_i"]: 'column_i'}, inplace=True)
+    if 'column_j' in kwargs:
+        fv.rename(columns={kwargs["column_j"]: 'column_j'}, inplace=True)
+    if 'fire_column' in kwargs:
+        fv.rename(columns={kwargs['fire_column']: 'fire'}, inplace=True)
+
+    node_ids = hexagon['Node_ID'].to_numpy()
+    order = np.argsort(node_ids)
+    hexPos = pd.Series(order, index=node_ids[order])
+    keys = ['iteration', 'fire'] if 'iteration' in fv.columns else ['fire']
+    fireRow = fv.groupby(keys, sort=False).ngroup().to_numpy()
+    nFires, nHex = fireRow.max() + 1 if len(fv) else 0, len(hexagon)
+    col_i = hexPos.reindex(fv['column_i'].to_numpy()).to_numpy()
+    col_j = hexPos.reindex(fv['column_j'].to_numpy()).to_numpy()
+    if np.isnan(col_i).any() or np.isnan(col_j).any():
+        raise ValueError('Some Node_IDs of the fire vectors are not in the hexagons.')
+
+    # G: fire x ignition hexagon, B: fire x hexagons burned into (column_j), F: B with the ignition hexagon
+    ones = np.ones(len(fv), dtype=np.int32)
+    G = sparse.csr_matrix((ones, (fireRow, col_i.astype(np.int64))), shape=(nFires, nHex))
+    B = sparse.csr_matrix((ones, (fireRow, col_j.astype(np.int64))), shape=(nFires, nHex))
+    F = sparse.csr_matrix((np.concatenate([ones, ones]), (np.concatenate([fireRow, fireRow]),
+                                                         np.concatenate([col_i, col_j]).astype(np.int64))), shape=(nFires, nHex))
+    G.data[:] = 1
+    B.data[:] = 1
+    F.data[:] = 1
+    area = hexagon.geometry.area.to_numpy() / 10000
+    GT = G.T.tocsr()
+    B, F = B.tocsc(), F.tocsc()
+
+    shedSize, shedHa = np.zeros(nHex, dtype=np.int64), np.zeros(nHex)
+    plainSize, plainHa = np.zeros(nHex, dtype=np.int64), np.zeros(nHex)
+    for start in range(0, nHex, chunksize):
+        block = slice(start, min(start + chunksize, nHex))
+        # ignition hexagons of the fires burning into each hexagon of the block: column h of G^T B
+        shed = (GT @ B[:, block]).tocsc()
+        shedSize[block] = np.diff(shed.indptr)
+        shed.data[:] = 1
+        shedHa[block] = shed.T @ area
+        # hexagons burned by fires ignited in each hexagon of the block: row h of G^T F
+        plain = (GT[block] @ F).tocsr()
+        plainSize[block] = np.diff(plain.indptr)
+        plain.data[:] = 1
+        plainHa[block] = plain @ area
+
+    sizes = pd.DataFrame({'Node_ID': node_ids, 'fireshedSize': shedSize, 'fireshedHa': shedHa,
+                          'fireplainSize': plainSize, 'fireplainHa': plainHa})
+    if iterations is not None:
+        # sums of pij need not the products, as pij leaves out j = i, count the pairs of the fire vectors with j != i:
+        # each fire burning into h from another hexagon counts once, each fire ignited in h counts its number of other burned hexagons
+        off = col_i != col_j
+        P = sparse.csr_matrix((ones[off], (fireRow[off], col_j[off].astype(np.int64))), shape=(nFires, nHex))
+        P.data[:] = 1
+        sizes['fireshedExp'] = np.asarray(P.sum(axis=0)).ravel() / iterations
+        sizes['fireplainExp'] = GT @ np.asarray(P.sum(axis=1)).ravel() / iterations
+    fireSizes = hexagon[['Node_ID', 'geometry']].merge(sizes, on='Node_ID', how='left')
+    return fireSizes
+
 def generate_ssr(fire_vectors, hexagons, **kwargs):
     """Generate a shapefile with values of Source-Sink-Ratio based on the fire vectors 
 
     Args:
         fire_vectors (DataFrame): outputs from generate_fire_vectors function
         hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        return_counts (bool, optional): also return the raw source and sink counts of each hexagon, see module counts. Defaults to False.
 
     Returns:
         GeoDataFrame: return a GeoDataFrame containing the Source-Sink Ratio value at each hexagonal patches
+        DataFrame: raw source and sink counts, only if return_counts is True
     """    
     hexagon = hexagons.copy()
     if 'Node_ID' in kwargs:
@@ -153,11 +355,20 @@ def generate_ssr(fire_vectors, hexagons, **kwargs):
     fire_dest = fire_vectors.groupby('column_j')[['fire']].count()
     fire_dest.reset_index(inplace=True)
     fire_dest.rename(columns={'fire':'asSink'}, inplace=True)
+    fireSSR = _ssr(hexagon, fire_orig, fire_dest)
+    if kwargs.get('return_counts', False):
+        ssrCounts = fire_orig.rename(columns={'column_i': 'Node_ID'}).merge(
+            fire_dest.rename(columns={'column_j': 'Node_ID'}), on='Node_ID', how='outer')
+        ssrCounts.fillna(0, inplace=True)
+        ssrCounts[['asSource', 'asSink']] = ssrCounts[['asSource', 'asSink']].astype(int)
+        return fireSSR, ssrCounts
+    return fireSSR
+
+def _ssr(hexagon, fire_orig, fire_dest):
+    """Join the number of fires leaving (asSource) and entering (asSink) each hexagon and take the log ratio
+    """
     fireSSR = hexagon.merge(fire_orig, left_on='Node_ID', right_on='column_i', how='left')
     fireSSR = fireSSR.merge(fire_dest, left_on='Node_ID', right_on='column_j', how='left')
     fireSSR['SSR'] = np.log10(fireSSR['asSource'] / fireSSR['asSink'])
     fireSSR.dropna(inplace=True)
     return fireSSR
-
-
-
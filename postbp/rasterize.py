@@ -0,0 +1,152 @@
+'''Module for a raster-based burn probability engine, a fast alternative to the polygon overlay of prj2hex.
+1. lay a fine grid of square cells over the hexagons, aligned with the bounds of the hexagonal network.
+2. precompute the hexagon containing each cell centre (cell to hex map).
+3. rasterize each fire perimeter on its bounding window of the grid, and accumulate burn counts in integer arrays.
+4. apply the threshold coverage rule approximately by counting the burned cells of each hexagon, and report the approximation error of the burned area.
+5. compare the burn counts of each hexagon with the exact overlay on a sample of the perimeters (check_raster).
+'''
+
+import math
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+from tqdm import tqdm
+from .common import prj2hex
+
+def _hex_radius(hexagons):
+    """Circumradius of the (regular) hexagons
+    """
+    xmin, _, xmax, _ = hexagons.geometry.iloc[0].bounds
+    return (xmax - xmin) / 2
+
+def cell_to_hex(hexagons, cell_size=None, **kwargs):
+    """Build the grid of cells and the map from each cell to the hexagon containing the cell centre
+
+    Args:
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field, e.g. outputs from create_hexagons function
+        cell_size (float, optional): side length of the cells. Defaults to a quarter of the hexagon side, i.e. about 40 cells per hexagon.
+
+    Returns:
+        dict: return the grid origin (xmin, ymin), cell_size, number of rows and columns, the hexagon position of each cell (-1 outside the hexagons)
+              as a rows x columns array, and the Node_ID of each hexagon position
+    """
+    hexagon = hexagons
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    radius = _hex_radius(hexagon)
+    if cell_size is None:
+        cell_size = radius / 4
+    xmin, ymin, xmax, ymax = hexagon.total_bounds
+    ncols = int(math.ceil((xmax - xmin) / cell_size))
+    nrows = int(math.ceil((ymax - ymin) / cell_size))
+
+    centres = hexagon.geometry.centroid
+    tree = cKDTree(np.column_stack([centres.x.to_numpy(), centres.y.to_numpy()]))
+    geoms = hexagon.geometry.to_numpy()
+    inradius = radius * math.sqrt(3) / 2
+    cellHex = np.empty((nrows, ncols), dtype=np.int32)
+    xs = xmin + (np.arange(ncols) + 0.5) * cell_size
+    # row by row, so the temporary coordinate arrays stay small
+    for r in range(nrows):
+        ys = np.full(ncols, ymin + (r + 0.5) * cell_size)
+        dist, pos = tree.query(np.column_stack([xs, ys]))
+        # nearest centre is the containing hexagon of a regular tessellation; check cells near the edge of the network against the polygon
+        edge = np.flatnonzero(dist > inradius)
+        if len(edge):
+            inside = shapely.contains_xy(geoms[pos[edge]], xs[edge], ys[edge])
+            pos[edge[~inside]] = -1
+        cellHex[r] = pos
+    return {'xmin': xmin, 'ymin': ymin, 'cell_size': cell_size, 'nrows': nrows, 'ncols': ncols,
+            'cellHex': cellHex, 'Node_ID': hexagon['Node_ID'].to_numpy(), 'hexArea': geoms[0].area}
+
+def rasterize_burn_counts(fireshp, hexagons, threshold=0, cell_size=None, grid=None, return_cells=False, **kwargs):
+    """Count the fires burning each hexagon by rasterizing the fire perimeters, an approximation of the overlay used by generate_burn_prob
+
+    Args:
+        fireshp (GeoDataFrame): fire perimeter dataset with fire ID (and iteration ID) and geometry
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as burned, applied to the burned cells of each hexagon. Defaults to 0.
+        cell_size (float, optional): side length of the cells. Defaults to a quarter of the hexagon side.
+        grid (dict, optional): outputs from cell_to_hex function, to reuse the cell to hex map over several runs. Defaults to None.
+        return_cells (bool, optional): also return the burn counts of each cell as a rows x columns array. Defaults to False.
+
+    Returns:
+        DataFrame: return the burn counts of each hexagon (Node_ID, burnCount)
+        DataFrame: return the area, rasterized area and relative error of the burned area of each fire perimeter.
+                   Note to give two variable names when using this function.
+        array: burn counts of each cell, only if return_cells is True
+    """
+    if grid is None:
+        grid = cell_to_hex(hexagons, cell_size, **kwargs)
+    cs = grid['cell_size']
+    cellHex = grid['cellHex']
+    nrows, ncols = grid['nrows'], grid['ncols']
+    # overlay keeps a hexagon if the burned area is larger than the threshold area
+    minCells = threshold * grid['hexArea'] / cs**2
+
+    geoms = fireshp.to_crs(hexagons.crs).geometry.to_numpy()
+    shapely.prepare(geoms)
+    bounds = shapely.bounds(geoms)
+    c0 = np.clip(np.ceil((bounds[:, 0] - grid['xmin']) / cs - 0.5).astype(int), 0, ncols)
+    c1 = np.clip(np.floor((bounds[:, 2] - grid['xmin']) / cs - 0.5).astype(int) + 1, 0, ncols)
+    r0 = np.clip(np.ceil((bounds[:, 1] - grid['ymin']) / cs - 0.5).astype(int), 0, nrows)
+    r1 = np.clip(np.floor((bounds[:, 3] - grid['ymin']) / cs - 0.5).astype(int) + 1, 0, nrows)
+
+    hexCounts = np.zeros(len(grid['Node_ID']), dtype=np.int64)
+    cellCounts = np.zeros((nrows, ncols), dtype=np.int32) if return_cells else None
+    rasterArea = np.zeros(len(geoms))
+    for k in tqdm(range(len(geoms))):
+        if c1[k] <= c0[k] or r1[k] <= r0[k]:
+            continue
+        # cell centres in the bounding window of the perimeter
+        xs = grid['xmin'] + (np.arange(c0[k], c1[k]) + 0.5) * cs
+        ys = grid['ymin'] + (np.arange(r0[k], r1[k]) + 0.5) * cs
+        inside = shapely.contains_xy(geoms[k], xs[None, :], ys[:, None])
+        rasterArea[k] = inside.sum() * cs**2
+        if cellCounts is not None:
+            cellCounts[r0[k]:r1[k], c0[k]:c1[k]] += inside
+        hexPos = cellHex[r0[k]:r1[k], c0[k]:c1[k]][inside]
+        hexPos, cells = np.unique(hexPos[hexPos >= 0], return_counts=True)
+        hexCounts[hexPos[cells > minCells]] += 1
+
+    burnCounts = pd.DataFrame({'Node_ID': grid['Node_ID'], 'burnCount': hexCounts})
+    area = shapely.area(geoms)
+    rasterError = pd.DataFrame({'area': area, 'rasterArea': rasterArea,
+                                'relError': np.where(area > 0, (rasterArea - area) / np.where(area > 0, area, 1), 0)})
+    for column in ['iteration', 'fire']:
+        if column in fireshp.columns:
+            rasterError.insert(0, column, fireshp[column].to_numpy())
+    if return_cells:
+        return burnCounts, rasterError, cellCounts
+    return burnCounts, rasterError
+
+def check_raster(fireshp, hexagons, threshold=0, cell_size=None, grid=None, sample=None, seed=0, **kwargs):
+    """Compare the raster burn counts with the overlay used by generate_burn_prob, hexagon by hexagon, on all the perimeters or a random sample of them
+
+    Args:
+        fireshp (GeoDataFrame): fire perimeter dataset with fire ID (and iteration ID) and geometry
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as burned. Defaults to 0.
+        cell_size (float, optional): side length of the cells. Defaults to a quarter of the hexagon side.
+        grid (dict, optional): outputs from cell_to_hex function. Defaults to None.
+        sample (int, optional): number of perimeters drawn at random for the comparison. Defaults to None, all the perimeters.
+        seed (int, optional): seed of the random sample. Defaults to 0.
+
+    Returns:
+        DataFrame: return the burn counts of the sample by the overlay (burnCount) and by the raster (rasterCount) of each hexagon
+                   burned by either, and the difference (diff, raster minus overlay)
+    """
+    hexagon = hexagons
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    if sample is not None and sample < len(fireshp):
+        fireshp = fireshp.sample(n=sample, random_state=seed)
+    rasterCounts, _ = rasterize_burn_counts(fireshp, hexagon, threshold=threshold, cell_size=cell_size, grid=grid)
+    fireOL = prj2hex(fireshp.to_crs(hexagon.crs), hexagon[['Node_ID', 'geometry']], threshold)
+    overlayCounts = fireOL.groupby('Node_ID').size().rename('burnCount').reset_index()
+    hexError = overlayCounts.merge(rasterCounts.rename(columns={'burnCount': 'rasterCount'}), on='Node_ID', how='outer')
+    hexError = hexError.fillna(0).astype({'burnCount': int, 'rasterCount': int})
+    hexError = hexError.loc[(hexError['burnCount'] > 0) | (hexError['rasterCount'] > 0)].reset_index(drop=True)
+    hexError['diff'] = hexError['rasterCount'] - hexError['burnCount']
+    return hexError
@@ -11,9 +11,9 @@
 import geopandas as gpd
 import pandas as pd
 from shapely.geometry import Polygon, Point, LineString
-import warnings
-warnings.filterwarnings("ignore")
 import math
+import numpy as np
+from scipy.spatial import cKDTree
 from tqdm import tqdm
 
 def _create_hexnodes(area, xmin, ymin, xmax, ymax, offset_x, offset_y):
@@ -64,6 +64,59 @@ def _create_hexgrids(area, x, y):
     l = 3**0.25 * math.sqrt(2 * area / 9)
     c = [[x + math.cos(math.radians(angle)) * l, y + math.sin(math.radians(angle)) * l] for angle in range(0, 360, 60)]
     return Polygon(c)
+def _curve_key(x, y, curve='hilbert', bits=16):
+    """Position of each point along a Hilbert or Morton (z-order) curve over the bounds of the points
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    n = 1 << bits
+    span = max(x.max() - x.min(), y.max() - y.min(), 1e-9)
+    xi = np.minimum(((x - x.min()) / span * n).astype(np.int64), n - 1)
+    yi = np.minimum(((y - y.min()) / span * n).astype(np.int64), n - 1)
+    key = np.zeros(len(x), dtype=np.int64)
+    if curve == 'morton':
+        for b in range(bits):
+            key |= ((xi >> b) & 1) << (2 * b) | ((yi >> b) & 1) << (2 * b + 1)
+        return key
+    if curve != 'hilbert':
+        raise ValueError("curve must be 'hilbert' or 'morton'.")
+    s = n >> 1
+    while s > 0:
+        rx = (xi & s) > 0
+        ry = (yi & s) > 0
+        key += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve is continuous
+        flip = ~ry & rx
+        xi = np.where(flip, n - 1 - xi, xi)
+        yi = np.where(flip, n - 1 - yi, yi)
+        xi, yi = np.where(~ry, yi, xi), np.where(~ry, xi, yi)
+        s >>= 1
+    return key
+
+def _curve_order(hexagons, curve):
+    centre = hexagons.geometry.centroid
+    return np.argsort(_curve_key(centre.x.to_numpy(), centre.y.to_numpy(), curve), kind='stable')
+
+def renumber_hexagons(hexagons, curve='hilbert', **kwargs):
+    """Renumber the hexagons along a space-filling curve, so hexagons close in space have close Node_IDs and
+       tables sorted by Node_ID (e.g. pij, sparse matrices, files written with write_sorted) keep neighbouring hexagons together.
+
+    Args:
+        hexagons (GeoDataFrame): geometry and ID of hexagonal patches
+        curve (str, optional): 'hilbert' or 'morton'. Defaults to 'hilbert'.
+
+    Returns:
+        GeoDataFrame: return the hexagons sorted along the curve, with Node_ID from 1 in the order of the curve
+        DataFrame: return the previous (old_ID) and new Node_ID of each hexagon, e.g. to renumber fire vectors or counts.
+                   Note to give two variable names when using this function.
+    """
+    hexagon = hexagons
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    hexagon = hexagon.iloc[_curve_order(hexagon, curve)].reset_index(drop=True)
+    lookup = pd.DataFrame({'old_ID': hexagon['Node_ID'].to_numpy(), 'Node_ID': np.arange(1, len(hexagon) + 1)})
+    hexagon['Node_ID'] = lookup['Node_ID'].to_numpy()
+    return hexagon, lookup
+
 # =============================================================================
 # ## 50ha size hexagons shifting one quarter and two quarters of shorter diagonal distance on eight directions
 # =============================================================================
@@ -78,6 +131,7 @@ def create_hexagons(boundaryShp, offset_x=0, offset_y=0, **kwargs):
         diameter (float, OPTIONAL): define the size of each hexagon by long diameter in meter
         offset_x (fraction, OPTIONAL): defines the horizontal offset for hexagons as a fraction of the length of the hexagon's long diagonal. Can be positive or negative.
         offset_y (fraction, OPTIONAL): defines the vertical offset for hexagons as a fraction of the length of the hexagon's long diagonal. Can be positive or negative.
+        order (str, OPTIONAL): 'hilbert' or 'morton' to number the hexagons along a space-filling curve instead of column by column, see renumber_hexagons.
 
     Returns:
         GeoDataFrame: return a geodataframe of hexagonal network of the defined size and covering the defined range.
@@ -106,6 +160,8 @@ def create_hexagons(boundaryShp, offset_x=0, offset_y=0, **kwargs):
     hexagons = gpd.GeoDataFrame({'geometry':hexagons})
     hexagons['Node_ID'] = hexagons.index + 1
     hexagons.crs = myCRS
+    if kwargs.get('order') is not None:
+        hexagons, _ = renumber_hexagons(hexagons, kwargs['order'])
 
     return hexagons
 
@@ -119,6 +175,7 @@ def create_hexagons_nodes(boundaryShp, offset_x=0, offset_y=0, **kwargs):
         diameter (float, OPTIONAL): define the size of each hexagon by long diameter in meter
         offset_x (fraction, OPTIONAL): defines the horizontal offset for hexagons as a fraction of the length of the hexagon's long diagonal. Can be positive or negative.
         offset_y (fraction, OPTIONAL): defines the vertical offset for hexagons as a fraction of the length of the hexagon's long diagonal. Can be positive or negative.
+        order (str, OPTIONAL): 'hilbert' or 'morton' to number the hexagons along a space-filling curve instead of column by column, see renumber_hexagons.
     Returns:
         GeoDataFrame: return geodataframes of hexagons and nodes of the defined size and covering the defined range.
                       Note to give two variable names when using this function.
@@ -147,9 +204,61 @@ def create_hexagons_nodes(boundaryShp, offset_x=0, offset_y=0, **kwargs):
     hexagons = gpd.GeoDataFrame({'geometry':hexagons})
     hexagons['Node_ID'] = hexagons.index + 1
     hexagons.crs = myCRS
+    if kwargs.get('order') is not None:
+        order = _curve_order(hexagons, kwargs['order'])
+        hexagons = hexagons.iloc[order].reset_index(drop=True)
+        nodes = nodes.iloc[order].reset_index(drop=True)
+        hexagons['Node_ID'] = hexagons.index + 1
+        nodes['Node_ID'] = nodes.index + 1
 
     return hexagons, nodes
 
+def parent_lookup(hexagons, coarse_hexagons, **kwargs):
+    """Find the coarser hexagon (parent) containing the centroid of each finer hexagon, without geometric overlay
+
+    Args:
+        hexagons (GeoDataFrame): geometry and ID of the finer hexagonal patches
+        coarse_hexagons (GeoDataFrame): geometry and ID of the coarser hexagonal patches
+
+    Returns:
+        DataFrame: return the Node_ID of each finer hexagon and the Node_ID of its parent (parent_ID)
+    """
+    hexagon = hexagons
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+        coarse_hexagons = coarse_hexagons.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    fine = hexagon.geometry.centroid
+    coarse = coarse_hexagons.geometry.centroid
+    # nearest centre of a regular hexagonal network is the hexagon containing the point
+    tree = cKDTree(np.column_stack([coarse.x.to_numpy(), coarse.y.to_numpy()]))
+    _, pos = tree.query(np.column_stack([fine.x.to_numpy(), fine.y.to_numpy()]))
+    lookup = pd.DataFrame({'Node_ID': hexagon['Node_ID'].to_numpy(),
+                           'parent_ID': coarse_hexagons['Node_ID'].to_numpy()[pos]})
+    return lookup
+
+def create_hexagon_levels(boundaryShp, areas, offset_x=0, offset_y=0):
+    """Creat hexagonal patches at several resolutions, and the lookup from the finest hexagons to their parents at each coarser resolution.
+       Counts computed once at the finest resolution can then be rolled up with rollup_counts, rollup_burned and rollup_vectors.
+       With areas in a constant ratio, e.g. aperture 7: [10e4, 70e4, 490e4], each parent holds about the same number of finer hexagons.
+       Hexagons do not nest exactly, a finer hexagon belongs to the coarser hexagon containing its centroid.
+    Args:
+        boundaryShp (GeoDataFrame): the geodataframe defines the range covered by the hexagonal patches
+        areas (list): area of the hexagons of each resolution in square meters
+        offset_x (fraction, OPTIONAL): defines the horizontal offset for hexagons as a fraction of the length of the hexagon's long diagonal. Can be positive or negative.
+        offset_y (fraction, OPTIONAL): defines the vertical offset for hexagons as a fraction of the length of the hexagon's long diagonal. Can be positive or negative.
+
+    Returns:
+        list: return a geodataframe of hexagonal patches for each resolution, from the finest to the coarsest
+        DataFrame: return the Node_ID of the finest hexagons and the Node_ID of their parent at each coarser level (level_1, level_2, ...).
+                   Note to give two variable names when using this function.
+    """
+    areas = sorted(areas)
+    levels = [create_hexagons(boundaryShp, offset_x, offset_y, area=area) for area in areas]
+    lookup = pd.DataFrame({'Node_ID': levels[0]['Node_ID'].to_numpy()})
+    for k, coarse in enumerate(levels[1:], start=1):
+        lookup[f'level_{k}'] = parent_lookup(levels[0], coarse)['parent_ID'].to_numpy()
+    return levels, lookup
+
 def nodes_from_hexagons(hexagons):
     """Generate nodes geometry from hexagons
 
@@ -0,0 +1,211 @@
+'''Module for tiled processing of landscapes too large for one process.
+1. partition the hexagons into square spatial tiles, each hexagon belonging to the one tile containing its centroid.
+2. route the fire perimeters to every tile they touch, the tile extended by a halo so hexagons on the tile boundary are covered in full.
+3. process each tile independently (optionally in parallel), counting only the hexagons owned by the tile.
+4. merge the per-tile burn counts and pij counts; since every hexagon is owned by exactly one tile, fires crossing tile boundaries are not double counted.
+'''
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import box
+from .common import _map_parallel
+from .counts import merge_counts, burn_prob_from_counts, pij_from_counts
+from .finalfirevectors import _fire_keys, _ignition_nodes, _burned_nodes, _link_vectors, _pij_counts
+
+def create_tiles(hexagons, tile_size, halo=None, **kwargs):
+    """Partition the hexagonal network into square tiles
+
+    Args:
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        tile_size (float): side length of the tiles in the unit of the projection, e.g. meter
+        halo (float, optional): distance the tiles are extended by when routing fire perimeters. Defaults to the circumradius of the hexagons.
+
+    Returns:
+        GeoDataFrame: return tiles with tile ID, halo distance and geometry of the tile
+        DataFrame: return the tile ID of each hexagon.
+                   Note to give two variable names when using this function.
+    """
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    if halo is None:
+        xmin, _, xmax, _ = hexagon.geometry.iloc[0].bounds
+        halo = (xmax - xmin) / 2
+
+    centroid = hexagon.geometry.centroid
+    xmin, ymin, xmax, _ = hexagon.total_bounds
+    nx = int(np.floor((xmax - xmin) / tile_size)) + 1
+    ix = np.floor((centroid.x.to_numpy() - xmin) / tile_size).astype(int)
+    iy = np.floor((centroid.y.to_numpy() - ymin) / tile_size).astype(int)
+    hexTiles = pd.DataFrame({'Node_ID': hexagon['Node_ID'].to_numpy(), 'tile': iy * nx + ix + 1})
+
+    tileIDs = np.unique(hexTiles['tile'])
+    tx = (tileIDs - 1) % nx
+    ty = (tileIDs - 1) // nx
+    geometry = [box(xmin + x * tile_size, ymin + y * tile_size, xmin + (x + 1) * tile_size, ymin + (y + 1) * tile_size)
+                for x, y in zip(tx, ty)]
+    tiles = gpd.GeoDataFrame({'tile': tileIDs, 'halo': halo}, crs=hexagon.crs, geometry=geometry)
+    return tiles, hexTiles
+
+def route_fires(fireshp, tiles):
+    """Route each fire perimeter to all the tiles it touches, tiles extended by their halo
+
+    Args:
+        fireshp (GeoDataFrame): fire perimeter dataset with fire ID (and iteration ID) and geometry
+        tiles (GeoDataFrame): outputs from create_tiles function
+
+    Returns:
+        DataFrame: return the row index of fireshp and the tile ID, one row for each tile a perimeter touches
+    """
+    tileHalo = gpd.GeoDataFrame({'tile': tiles['tile']}, crs=tiles.crs,
+                                geometry=tiles.geometry.buffer(tiles['halo'], join_style='mitre'))
+    routed = gpd.sjoin(fireshp[['geometry']].to_crs(tiles.crs), tileHalo, how='inner', predicate='intersects')
+    routed = pd.DataFrame({'fireRow': routed.index, 'tile': routed['tile'].to_numpy()})
+    return routed
+
+def _tile_tasks(fireshp, tiles, hexagon, hexTiles):
+    """Pair the perimeters (or the bounding box to read them from file) with the owned hexagons of each tile
+    """
+    if isinstance(fireshp, str):
+        tileHalo = tiles.geometry.buffer(tiles['halo'], join_style='mitre')
+        fireSel = {t: tuple(g.bounds) for t, g in zip(tiles['tile'], tileHalo)}
+    else:
+        fireshp = fireshp.reset_index(drop=True)
+        routed = route_fires(fireshp, tiles)
+        fireSel = {t: fireshp.loc[rows] for t, rows in routed.groupby('tile')['fireRow']}
+
+    hexOwned = hexagon.merge(hexTiles, on='Node_ID')
+    tasks = []
+    for t, owned in hexOwned.groupby('tile'):
+        if t in fireSel:
+            tasks.append((fireSel[t], owned.drop(columns='tile').reset_index(drop=True)))
+    return tasks
+
+def _read_tile(fires, crs):
+    """Read the perimeters of a tile from file if fires is a bounding box
+    """
+    if isinstance(fires, tuple):
+        path, bbox = fires
+        fires = gpd.read_file(path, bbox=bbox)
+    if fires.crs is not None and fires.crs != crs:
+        fires = fires.to_crs(crs)
+    return fires
+
+def _tile_burn_counts(fires, hexagon, threshold):
+    fires = _read_tile(fires, hexagon.crs)
+    keys = _fire_keys(fires)
+    fire_n = _burned_nodes(fires, hexagon, keys, threshold)
+    burnCounts = fire_n.groupby('column_j')[['fire']].count()
+    burnCounts.reset_index(inplace=True)
+    burnCounts.rename(columns={'column_j': 'Node_ID', 'fire': 'burnCount'}, inplace=True)
+    return burnCounts
+
+def _tile_vectors(fires, hexagon, pts_n, threshold):
+    fires = _read_tile(fires, hexagon.crs)
+    keys = _fire_keys(fires, pts_n)
+    fire_n = _burned_nodes(fires, hexagon, keys, threshold)
+    return _link_vectors(fire_n, pts_n, keys)
+
+def _tile_pij_counts(fires, hexagon, pts_n, threshold, iterations):
+    return _pij_counts(_tile_vectors(fires, hexagon, pts_n, threshold), iterations)
+
+def _prepare(fireshp, hexagons, tile_size, halo, kwargs):
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    hexagon = hexagon[['Node_ID', 'geometry']]
+    tiles, hexTiles = create_tiles(hexagon, tile_size, halo)
+    tasks = _tile_tasks(fireshp, tiles, hexagon, hexTiles)
+    if isinstance(fireshp, str):
+        tasks = [((fireshp, bbox), owned) for bbox, owned in tasks]
+    return hexagon, tasks
+
+def tiled_burn_prob(fireshp, hexagons, iterations, tile_size, halo=None, threshold=0, n_jobs=1, **kwargs):
+    """Generate burn probability tile by tile, same outputs as generate_burn_prob
+
+    Args:
+        fireshp (GeoDataFrame or str): fire perimeter dataset with fire ID (and iteration ID) and geometry, or path of the fire perimeter shapefile to read the perimeters of each tile from
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        iterations (int): number of iterations
+        tile_size (float): side length of the tiles in the unit of the projection, e.g. meter
+        halo (float, optional): distance the tiles are extended by when routing fire perimeters. Defaults to the circumradius of the hexagons.
+        threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as intersecting with fire perimeter. Defaults to 0.
+        n_jobs (int, optional): number of tiles processed in parallel. Defaults to 1.
+        executor (str, optional): 'process' or 'thread', the kind of pool processing the tiles. Defaults to 'process'.
+        return_counts (bool, optional): also return the raw burn counts of each hexagon, see module counts. Defaults to False.
+
+    Returns:
+        GeoDataFrame: return a GeoDataFrame containing burn probability value at each hexagonal patches
+        DataFrame: raw burn counts and number of iterations, only if return_counts is True
+    """
+    hexagon, tasks = _prepare(fireshp, hexagons, tile_size, halo, kwargs)
+    results = _map_parallel(_tile_burn_counts, [(fires, owned, threshold) for fires, owned in tasks], n_jobs, kwargs.get('executor', 'process'))
+    # no tile receives a perimeter: zero counts
+    burned = merge_counts(*results) if results else pd.DataFrame({'Node_ID': pd.Series(dtype=int), 'burnCount': pd.Series(dtype=int)})
+    burnCounts = hexagon[['Node_ID']].merge(burned, on='Node_ID', how='left')
+    burnCounts.fillna(0, inplace=True)
+    burnCounts['burnCount'] = burnCounts['burnCount'].astype(int)
+    burnCounts['iterations'] = iterations
+    burnP = burn_prob_from_counts(burnCounts, hexagon)
+    if kwargs.get('return_counts', False):
+        return burnP, burnCounts
+    return burnP
+
+def tiled_fire_vectors(fireshp, ignition, hexagons, tile_size, halo=None, threshold=0, n_jobs=1, **kwargs):
+    """Generate fire vectors from final fire perimeters tile by tile, same outputs as generate_fire_vectors
+
+    Args:
+        fireshp (GeoDataFrame or str): fire perimeter dataset with fire ID (and iteration ID) and geometry, or path of the fire perimeter shapefile to read the perimeters of each tile from
+        ignition (GeoDataFrame): ignition point shapes with fire ID (and iteration ID) field in attributes
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        tile_size (float): side length of the tiles in the unit of the projection, e.g. meter
+        halo (float, optional): distance the tiles are extended by when routing fire perimeters. Defaults to the circumradius of the hexagons.
+        threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as intersecting with fire perimeter. Defaults to 0.
+        n_jobs (int, optional): number of tiles processed in parallel. Defaults to 1.
+        executor (str, optional): 'process' or 'thread', the kind of pool processing the tiles. Defaults to 'process'.
+        policy (str, optional): for fires with more than one ignition point, see link_ignitions. Fires not linked to an ignition point are left out with a warning. Defaults to 'first'.
+
+    Returns:
+        DataFrame: a dataframe table containing fire starting hexagon ID (i), destination hexagon ID (j), fire ID (and iteration ID)
+    """
+    hexagon, tasks = _prepare(fireshp, hexagons, tile_size, halo, kwargs)
+    pts_n = _ignition_nodes(fireshp, ignition, hexagon, kwargs.get('policy', 'first'))
+    results = _map_parallel(_tile_vectors, [(fires, owned, pts_n, threshold) for fires, owned in tasks], n_jobs, kwargs.get('executor', 'process'))
+    if not results:
+        return pd.DataFrame(columns=['column_j', 'column_i'] + _fire_keys(pts_n)[::-1], dtype=int)
+    fire_vectors = pd.concat(results, ignore_index=True)
+    return fire_vectors
+
+def tiled_pij(fireshp, ignition, hexagons, iterations, tile_size, halo=None, threshold=0, n_jobs=1, **kwargs):
+    """Generate pij from final fire perimeters tile by tile, keeping only the per-tile counts of fires for each pair of i, j
+
+    Args:
+        fireshp (GeoDataFrame or str): fire perimeter dataset with fire ID (and iteration ID) and geometry, or path of the fire perimeter shapefile to read the perimeters of each tile from
+        ignition (GeoDataFrame): ignition point shapes with fire ID (and iteration ID) field in attributes
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        iterations (int): number of iterations
+        tile_size (float): side length of the tiles in the unit of the projection, e.g. meter
+        halo (float, optional): distance the tiles are extended by when routing fire perimeters. Defaults to the circumradius of the hexagons.
+        threshold (float, optional): Value between 0 and 1. The proportion for classifying hexagon as intersecting with fire perimeter. Defaults to 0.
+        n_jobs (int, optional): number of tiles processed in parallel. Defaults to 1.
+        executor (str, optional): 'process' or 'thread', the kind of pool processing the tiles. Defaults to 'process'.
+        policy (str, optional): for fires with more than one ignition point, see link_ignitions. Fires not linked to an ignition point are left out with a warning. Defaults to 'first'.
+        return_counts (bool, optional): also return the raw counts of fires for each pair of i, j, see module counts. Defaults to False.
+
+    Returns:
+        DataFrame: return a dataframe with probability values for pairs of i, j on the landscape, same as pij_from_vectors
+        DataFrame: raw counts of fires for each pair of i, j and number of iterations, only if return_counts is True
+    """
+    hexagon, tasks = _prepare(fireshp, hexagons, tile_size, halo, kwargs)
+    pts_n = _ignition_nodes(fireshp, ignition, hexagon, kwargs.get('policy', 'first'))
+    results = _map_parallel(_tile_pij_counts, [(fires, owned, pts_n, threshold, iterations) for fires, owned in tasks], n_jobs, kwargs.get('executor', 'process'))
+    if results:
+        pijCounts = merge_counts(*results, iterations=iterations)
+    else:
+        pijCounts = pd.DataFrame(columns=['column_j', 'column_i', 'firecounts'], dtype=int)
+        pijCounts['iterations'] = iterations
+    fire_pij = pij_from_counts(pijCounts, iterations)
+    if kwargs.get('return_counts', False):
+        return fire_pij, pijCounts
+    return fire_pij
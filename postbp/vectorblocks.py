@@ -0,0 +1,258 @@
+'''Module for a compressed representation of daily fire vectors.
+1. each fire-day is stored as one block of the hexagons the fire spread from and the hexagons it spread to, in compact integer arrays.
+2. the blocks are expanded lazily to the same rows as generate_daily_vectors.
+3. counts, pij and beta angles are aggregated from the blocks directly, without one row per pair of i, j.
+'''
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .catalog import FireCatalog, link_ignitions, _ignition_map, _warn_linkage
+from .common import _map_fires, _node_table, _node_coords
+from .dailyfirevectors import _beta_angles, _daily_fire_blocks
+from .finalfirevectors import _format_pij
+
+class VectorBlocks:
+    """Daily fire vectors stored as blocks of (hexagons spread from) x (hexagons spread to), one block per fire and day.
+    Block k pairs src[src_ptr[k]:src_ptr[k+1]] with dst[dst_ptr[k]:dst_ptr[k+1]].
+
+    Attributes:
+        fire (array): fire ID of each block
+        day (array): day of spread of each block, 999 for the ignition hexagon to all hexagons in the final perimeter
+        ignPt (array): ignition hexagon ID of each block
+        src_ptr (array): offsets of each block in src
+        src (array): IDs of the hexagons the fire spread from
+        dst_ptr (array): offsets of each block in dst
+        dst (array): IDs of the hexagons the fire spread to
+    """
+    def __init__(self, fire, day, ignPt, src_ptr, src, dst_ptr, dst):
+        self.fire = np.asarray(fire)
+        self.day = np.asarray(day, dtype=np.int16)
+        self.ignPt = np.asarray(ignPt)
+        self.src_ptr = np.asarray(src_ptr, dtype=np.int64)
+        self.src = np.asarray(src)
+        self.dst_ptr = np.asarray(dst_ptr, dtype=np.int64)
+        self.dst = np.asarray(dst)
+
+    @classmethod
+    def from_records(cls, records):
+        """Build blocks from a list of (fire, day, ignPt, hexagons spread from, hexagons spread to)
+        """
+        fire, day, ignPt, src, dst = [], [], [], [], []
+        for f, d, g, s, t in records:
+            fire.append(f)
+            day.append(d)
+            ignPt.append(g)
+            # keep the first occurrence order, so expanded rows are in the same order as generate_daily_vectors
+            src.append(pd.unique(np.asarray(s)))
+            dst.append(pd.unique(np.asarray(t)))
+        src_ptr = np.concatenate([[0], np.cumsum([len(s) for s in src])])
+        dst_ptr = np.concatenate([[0], np.cumsum([len(t) for t in dst])])
+        src = np.concatenate(src) if src else np.array([], dtype=np.int32)
+        dst = np.concatenate(dst) if dst else np.array([], dtype=np.int32)
+        idType = np.int32 if max(src.max(initial=0), dst.max(initial=0)) < 2**31 else np.int64
+        return cls(fire, day, np.asarray(ignPt, dtype=idType), src_ptr, src.astype(idType), dst_ptr, dst.astype(idType))
+
+    def __len__(self):
+        return len(self.day)
+
+    def block(self, k):
+        """Return fire ID, day, ignition hexagon, hexagons spread from and hexagons spread to of block k
+        """
+        return (self.fire[k], self.day[k], self.ignPt[k],
+                self.src[self.src_ptr[k]:self.src_ptr[k+1]], self.dst[self.dst_ptr[k]:self.dst_ptr[k+1]])
+
+    def iter_vectors(self, nodes=None):
+        """Lazily expand the blocks into one dataframe per block, with the same columns as generate_daily_vectors
+
+        Args:
+            nodes (GeoDataFrame, optional): centroid points of the hexagonal patch network. If given, the beta angle of each vector is added as in calc_angles.
+
+        Yields:
+            DataFrame: fire vectors of one fire-day
+        """
+        coords = _block_coords(self, nodes) if nodes is not None else None
+        for k in range(len(self)):
+            fire, day, ignPt, src, dst = self.block(k)
+            src, dst = src.astype(np.int64), dst.astype(np.int64)
+            vectors = pd.DataFrame({'column_i': np.repeat(src, len(dst)), 'column_j': np.tile(dst, len(src))})
+            if coords is not None:
+                vectors['angle'] = _block_angles(self, k, coords).ravel()
+            if day == 999:
+                vectors = vectors.loc[vectors['column_i'] != vectors['column_j']]
+            vectors.insert(2, 'day', int(day))
+            vectors.insert(3, 'fire', fire)
+            vectors.insert(4, 'ignPt', int(ignPt))
+            yield vectors
+
+    def to_vectors(self, nodes=None):
+        """Expand all blocks into one dataframe, same as the outputs of generate_daily_vectors
+
+        Args:
+            nodes (GeoDataFrame, optional): centroid points of the hexagonal patch network. If given, the beta angle of each vector is added as in calc_angles.
+
+        Returns:
+            DataFrame: a dataframe table containing fire starting hexagon ID (i), destination hexagon ID (j), 'day', fire ID, and ignition hexagon ID
+        """
+        return pd.concat(self.iter_vectors(nodes), ignore_index=True)
+
+    def save(self, path_n_file_name):
+        """Save the blocks to a .npz file
+        """
+        np.savez(path_n_file_name, fire=self.fire, day=self.day, ignPt=self.ignPt,
+                 src_ptr=self.src_ptr, src=self.src, dst_ptr=self.dst_ptr, dst=self.dst)
+
+    @classmethod
+    def load(cls, path_n_file_name):
+        """Load blocks saved with VectorBlocks.save
+        """
+        with np.load(path_n_file_name) as data:
+            return cls(data['fire'], data['day'], data['ignPt'], data['src_ptr'], data['src'], data['dst_ptr'], data['dst'])
+
+def generate_daily_blocks(fireshp, ignition, hexagons, bufferFactor=10, **kwargs):
+    """Generate fire spreading vectors from the daily fire spread perimeters, stored as compressed blocks instead of one row per pair of i, j
+
+    Args:
+        fireshp (GeoDataFrame): the daily fire perimeter geometry with fire ID and day of spread as attributes
+        ignition (GeoDataFrame): ignition point shapes with fire ID field in attributes
+        hexagons (GeoDataFrame): geometry of hexagonal patches with ID field
+        bufferFactor (int, optional): same as in generate_daily_vectors. Defaults to 10.
+        n_jobs (int, optional): number of threads processing fires in parallel. Defaults to 1.
+        policy (str, optional): for fires with more than one ignition point, see link_ignitions. Defaults to 'first'.
+
+    Returns:
+        VectorBlocks: one block of hexagons spread from and to for each fire and day
+    """
+    hexagon = hexagons.copy()
+    if 'Node_ID' in kwargs:
+        hexagon = hexagon.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+
+    threshold = 3.1415926*bufferFactor**2 - 1
+    SRID = fireshp.crs
+    hexagon.sindex
+
+    linkage, report = link_ignitions(fireshp, ignition, hexagon, kwargs.get('policy', 'first'), keys=['fire'])
+    _warn_linkage(report)
+    ignPts = _ignition_map(linkage, ['fire'])
+    catalog = FireCatalog(fireshp, keys=['fire'])
+    results = _map_fires(_fire_records, [i for i in catalog if i in ignPts], (catalog, hexagon, bufferFactor, threshold, SRID, ignPts),
+                         kwargs.get('n_jobs', 1))
+    return VectorBlocks.from_records([r for records in results for r in records])
+
+def _fire_records(i, catalog, hexagon, bufferFactor, threshold, SRID, ignPts):
+    ignPt, blocks = _daily_fire_blocks(catalog, i, hexagon, bufferFactor, threshold, SRID, ignPts)
+    return [(i, day, ignPt, src, dst) for day, src, dst in blocks]
+
+def _block_coords(blocks, nodes, **kwargs):
+    """Look up coordinates of the src, dst and ignition hexagons once for all blocks
+    """
+    node = nodes.copy()
+    if 'Node_ID' in kwargs:
+        node = node.rename(columns={kwargs["Node_ID"]: 'Node_ID'})
+    table = _node_table(node)
+    return _node_coords(table, blocks.src), _node_coords(table, blocks.dst), _node_coords(table, blocks.ignPt)
+
+def _block_angles(blocks, k, coords, bounds=()):
+    """Beta angle of every pair in block k as a src x dst array, with the same special values as calc_angles; see _beta_angles for the bounds
+    """
+    (sx, sy), (dx, dy), (gx, gy) = coords
+    s = slice(blocks.src_ptr[k], blocks.src_ptr[k+1])
+    t = slice(blocks.dst_ptr[k], blocks.dst_ptr[k+1])
+    shape = (s.stop - s.start, t.stop - t.start)
+    if blocks.day[k] == 999:
+        return np.full(shape, 361.0)  # from ignition to all hexes in perimeter
+    if blocks.day[k] == 1:
+        return np.full(shape, 181.0)  # in day 1: origin is identical to ignition
+    angles = _beta_angles(sx[s, None], sy[s, None], dx[None, t], dy[None, t], gx[k], gy[k], bounds)
+    return np.where(np.isnan(angles), 181.0, angles)
+
+def _node_positions(blocks):
+    ids, inv = np.unique(np.concatenate([blocks.src, blocks.dst]).astype(np.int64), return_inverse=True)
+    return ids, inv[:len(blocks.src)], inv[len(blocks.src):]
+
+def _counts_frame(ids, counts):
+    counts = sparse.coo_matrix(counts)
+    keep = counts.row != counts.col
+    pijCounts = pd.DataFrame({'column_j': ids[counts.col[keep]], 'column_i': ids[counts.row[keep]],
+                              'firecounts': counts.data[keep].astype(int)})
+    pijCounts.sort_values(by = ['column_j', 'column_i'], inplace = True)
+    pijCounts.reset_index(drop=True, inplace=True)
+    return pijCounts
+
+def counts_from_blocks(blocks, alpha=None, nodes=None, **kwargs):
+    """Count the fire vectors for each pair of i, j directly from the blocks
+
+    Args:
+        blocks (VectorBlocks): outputs from generate_daily_blocks function
+        alpha (degree, optional): fire spread sector angle, value from 0 to 360. Only vectors in the sector are counted, as with select_angle. Defaults to None.
+        nodes (GeoDataFrame, optional): centroid points of the hexagonal patch network, required if alpha is given
+
+    Returns:
+        DataFrame: return a dataframe with the number of vectors for each pair of i, j
+    """
+    ids, srcPos, dstPos = _node_positions(blocks)
+    n = len(ids)
+    if alpha is None:
+        # sources and destinations as block x hexagon incidence matrices, then counts = S'D
+        S = sparse.csr_matrix((np.ones(len(srcPos)), srcPos, blocks.src_ptr), shape=(len(blocks), n))
+        D = sparse.csr_matrix((np.ones(len(dstPos)), dstPos, blocks.dst_ptr), shape=(len(blocks), n))
+        return _counts_frame(ids, S.T @ D)
+
+    coords = _block_coords(blocks, nodes, **kwargs)
+    maxAngle = alpha/2+180
+    minAngle = 180-alpha/2
+    counts = sparse.csr_matrix((n, n))
+    rows, cols, pending = [], [], 0
+    for k in range(len(blocks)):
+        angles = _block_angles(blocks, k, coords, (minAngle, maxAngle))
+        ii, jj = np.nonzero((angles >= minAngle) & (angles <= maxAngle))
+        rows.append(srcPos[blocks.src_ptr[k] + ii])
+        cols.append(dstPos[blocks.dst_ptr[k] + jj])
+        pending += len(ii)
+        if pending > 10**7 or k == len(blocks) - 1:
+            rows, cols = np.concatenate(rows), np.concatenate(cols)
+            counts = counts + sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+            rows, cols, pending = [], [], 0
+    return _counts_frame(ids, counts)
+
+def pij_from_blocks(blocks, iterations, alpha=None, nodes=None, return_counts=False, **kwargs):
+    """Calculate pij directly from the blocks, same as pij_from_vectors on the (angle-selected) daily vectors
+
+    Args:
+        blocks (VectorBlocks): outputs from generate_daily_blocks function
+        iterations (int): number of iterations
+        alpha (degree, optional): fire spread sector angle, value from 0 to 360. Defaults to None, all vectors are counted.
+        nodes (GeoDataFrame, optional): centroid points of the hexagonal patch network, required if alpha is given
+        return_counts (bool, optional): also return the raw counts for each pair of i, j, see module counts. Defaults to False.
+
+    Returns:
+        DataFrame: return a dataframe with probability values for pairs of i, j on the landscape
+        DataFrame: raw counts for each pair of i, j and number of iterations, only if return_counts is True
+    """
+    pijCounts = counts_from_blocks(blocks, alpha, nodes, **kwargs)
+    pijCounts['iterations'] = iterations
+    fire_pij = _format_pij(pijCounts, iterations)
+    if return_counts:
+        return fire_pij, pijCounts
+    return fire_pij
+
+def angle_counts(blocks, nodes, bin_width=10, **kwargs):
+    """Count the daily fire vectors by beta angle directly from the blocks, e.g. to choose the alpha angle
+
+    Args:
+        blocks (VectorBlocks): outputs from generate_daily_blocks function
+        nodes (GeoDataFrame): centroid points of the hexagonal patch network
+        bin_width (degree, optional): width of the angle bins. Defaults to 10.
+
+    Returns:
+        DataFrame: return the lower bound of each angle bin and the number of vectors in it; vectors of day 999 are left out
+    """
+    coords = _block_coords(blocks, nodes, **kwargs)
+    nbins = int(np.ceil(360 / bin_width))
+    counts = np.zeros(nbins, dtype=np.int64)
+    for k in range(len(blocks)):
+        if blocks.day[k] == 999:
+            continue
+        angles = _block_angles(blocks, k, coords, np.arange(1, nbins) * bin_width).ravel()
+        counts += np.bincount(np.minimum((angles // bin_width).astype(int), nbins - 1), minlength=nbins)
+    return pd.DataFrame({'angle': np.arange(nbins) * bin_width, 'vectors': counts})
@@ -3,14 +3,65 @@
 """Tests for `postbp` package."""
 
 
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
 import unittest
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 
-from postbp import postbp
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, Polygon, box
+
+import postbp
+from postbp import cli
+
+CRS = "EPSG:3978"
+
+
+def _fixture(nfires=12, iterations=4, seed=0):
+    """Circular fire perimeters, their ignition points and daily perimeters, on hexagons of 1 ha over a 1 km square
+    """
+    rng = np.random.default_rng(seed)
+    fires, points, daily = [], [], []
+    fid = 0
+    for it in range(1, iterations + 1):
+        for _ in range(nfires // iterations):
+            fid += 1
+            x, y = rng.uniform(150, 850, 2)
+            r = rng.uniform(40, 200)
+            fires.append({'fire': fid, 'iteration': it, 'geometry': Point(x, y).buffer(r)})
+            points.append({'fire': fid, 'iteration': it, 'geometry': Point(x, y)})
+            for d in range(1, 4):
+                daily.append({'fire': fid, 'iteration': it, 'day': d, 'geometry': Point(x + 20 * d, y).buffer(r * d / 3)})
+    boundary = gpd.GeoDataFrame(geometry=[box(0, 0, 1000, 1000)], crs=CRS)
+    hexagons, nodes = postbp.create_hexagons_nodes(boundary, area=10000)
+    return (gpd.GeoDataFrame(fires, crs=CRS), gpd.GeoDataFrame(points, crs=CRS), gpd.GeoDataFrame(daily, crs=CRS),
+            hexagons, nodes)
+
+
+def _sorted(frame, columns):
+    return frame[columns].sort_values(columns).reset_index(drop=True)
+
+
+def _locate(grid, x, y):
+    """Locate points on a grid passed to a worker process"""
+    return grid.locate(x, y), len(grid)
 
 
 class TestPostbp(unittest.TestCase):
     """Tests for `postbp` package."""
 
+    @classmethod
+    def setUpClass(cls):
+        cls.fireshp, cls.ignition, cls.dailyshp, cls.hexagons, cls.nodes = _fixture()
+        cls.iterations = 4
+
     def setUp(self):
         """Set up test fixtures, if any."""
 
@@ -19,3 +70,531 @@ class TestPostbp(unittest.TestCase):
 
     def test_000_something(self):
         """Test something."""
+
+    def test_001_merge_counts(self):
+        """Counts of two batches of iterations merged equal a single run"""
+        batch1 = self.fireshp.loc[self.fireshp['iteration'] <= 2]
+        batch2 = self.fireshp.loc[self.fireshp['iteration'] > 2]
+        _, counts1 = postbp.generate_burn_prob(batch1, self.hexagons, 2, return_counts=True)
+        _, counts2 = postbp.generate_burn_prob(batch2, self.hexagons, 2, return_counts=True)
+        merged = postbp.merge_counts(counts1, counts2)
+        self.assertEqual(merged['iterations'].iloc[0], self.iterations)
+        burnP = postbp.burn_prob_from_counts(merged, self.hexagons)
+        single = postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations)
+        np.testing.assert_allclose(burnP['burnProb'], single['burnProb'])
+
+        ignition1 = self.ignition.loc[self.ignition['iteration'] <= 2]
+        ignition2 = self.ignition.loc[self.ignition['iteration'] > 2]
+        _, pij1 = postbp.generate_fire_vectors(batch1, ignition1, self.hexagons, return_counts=True, iterations=2)
+        _, pij2 = postbp.generate_fire_vectors(batch2, ignition2, self.hexagons, return_counts=True, iterations=2)
+        vectors = postbp.generate_fire_vectors(self.fireshp, self.ignition, self.hexagons)
+        columns = ['column_j', 'column_i', 'pij']
+        pd.testing.assert_frame_equal(_sorted(postbp.pij_from_counts(postbp.merge_counts(pij1, pij2)), columns),
+                                      _sorted(postbp.pij_from_vectors(vectors, self.iterations), columns))
+        # an empty batch carries no number of iterations, it must be given
+        empty = pij2.iloc[0:0]
+        with self.assertRaises(ValueError):
+            postbp.merge_counts(pij1, empty)
+        merged = postbp.merge_counts(pij1, empty, iterations=4)
+        self.assertEqual(merged['iterations'].iloc[0], 4)
+        pd.testing.assert_frame_equal(_sorted(postbp.pij_from_counts(merged), columns),
+                                      _sorted(postbp.pij_from_counts(pij1, iterations=4), columns))
+
+    def test_002_tiled(self):
+        """Tiled burn probability and pij equal the untiled results"""
+        tiled = postbp.tiled_burn_prob(self.fireshp, self.hexagons, self.iterations, tile_size=400)
+        single = postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations)
+        np.testing.assert_allclose(tiled.set_index('Node_ID')['burnProb'].sort_index(),
+                                   single.set_index('Node_ID')['burnProb'].sort_index())
+
+        vectors = postbp.generate_fire_vectors(self.fireshp, self.ignition, self.hexagons)
+        columns = ['column_j', 'column_i', 'pij']
+        pd.testing.assert_frame_equal(_sorted(postbp.tiled_pij(self.fireshp, self.ignition, self.hexagons, self.iterations, tile_size=400), columns),
+                                      _sorted(postbp.pij_from_vectors(vectors, self.iterations), columns))
+        pd.testing.assert_frame_equal(_sorted(postbp.tiled_fire_vectors(self.fireshp, self.ignition, self.hexagons, tile_size=400), list(vectors.columns)),
+                                      _sorted(vectors, list(vectors.columns)))
+        # no perimeter: zero counts
+        empty = postbp.tiled_burn_prob(self.fireshp.iloc[0:0], self.hexagons, self.iterations, tile_size=400)
+        self.assertEqual(len(empty), len(self.hexagons))
+        self.assertEqual(empty['burnProb'].sum(), 0)
+        with self.assertWarns(UserWarning):
+            self.assertEqual(len(postbp.tiled_pij(self.fireshp.iloc[0:0], self.ignition, self.hexagons, self.iterations, tile_size=400)), 0)
+
+    def test_003_pij_from_perimeters(self):
+        """Streaming pij from the perimeters equals pij from the fire vectors"""
+        vectors = postbp.generate_fire_vectors(self.fireshp, self.ignition, self.hexagons)
+        streamed = postbp.pij_from_perimeters(self.fireshp, self.ignition, self.hexagons, self.iterations, chunksize=5)
+        columns = ['column_j', 'column_i', 'pij']
+        pd.testing.assert_frame_equal(_sorted(streamed, columns), _sorted(postbp.pij_from_vectors(vectors, self.iterations), columns))
+        _, streamedVectors = postbp.pij_from_perimeters(self.fireshp, self.ignition, self.hexagons, self.iterations, chunksize=5, return_vectors=True)
+        pd.testing.assert_frame_equal(_sorted(streamedVectors, list(vectors.columns)), _sorted(vectors, list(vectors.columns)))
+        with self.assertWarns(UserWarning):
+            pij, empty = postbp.pij_from_perimeters(self.fireshp.iloc[0:0], self.ignition, self.hexagons, self.iterations, return_vectors=True)
+        self.assertEqual(len(pij), 0)
+        self.assertEqual(list(empty.columns), list(vectors.columns))
+        self.assertEqual(len(empty), 0)
+
+    def test_004_blocks(self):
+        """Daily vector blocks expand to the daily fire vectors"""
+        vectors = postbp.generate_daily_vectors(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6)
+        blocks = postbp.generate_daily_blocks(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6)
+        columns = ['column_i', 'column_j', 'day', 'fire', 'ignPt']
+        expanded = blocks.to_vectors().drop_duplicates(subset=['column_i', 'column_j', 'day', 'fire'])
+        pd.testing.assert_frame_equal(_sorted(expanded, columns), _sorted(vectors, columns), check_dtype=False)
+
+    def test_005_alpha(self):
+        """Vectors selected by alpha as they are generated equal calc_angles followed by select_angle"""
+        vectors = postbp.generate_daily_vectors(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6)
+        selected = postbp.select_angle(postbp.calc_angles(vectors, self.nodes), 120)
+        fused = postbp.generate_daily_vectors(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6, alpha=120, nodes=self.nodes)
+        columns = ['column_i', 'column_j', 'day', 'fire']
+        pd.testing.assert_frame_equal(_sorted(fused, columns), _sorted(selected, columns), check_dtype=False)
+        np.testing.assert_allclose(_sorted(fused, columns + ['angle'])['angle'],
+                                   _sorted(selected, columns + ['angle'])['angle'].astype(float))
+
+    def test_006_n_jobs(self):
+        """Fires processed in threads give the same outputs as serially"""
+        columns = ['column_j', 'column_i', 'fire', 'iteration']
+        pd.testing.assert_frame_equal(_sorted(postbp.generate_fire_vectors(self.fireshp, self.ignition, self.hexagons, n_jobs=3), columns),
+                                      _sorted(postbp.generate_fire_vectors(self.fireshp, self.ignition, self.hexagons), columns))
+        columns = ['column_i', 'column_j', 'day', 'fire', 'ignPt']
+        pd.testing.assert_frame_equal(_sorted(postbp.generate_daily_vectors(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6, n_jobs=3), columns),
+                                      _sorted(postbp.generate_daily_vectors(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6), columns))
+        np.testing.assert_allclose(postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations, n_jobs=3)['burnProb'],
+                                   postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations)['burnProb'])
+
+    def test_007_hexgrid(self):
+        """HexGrid saved and loaded rebuilds the hexagons, and locates points as the spatial join"""
+        grid = postbp.HexGrid.from_hexagons(self.hexagons, vertices=True)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'grid.hex')
+            grid.save(path)
+            loaded = postbp.HexGrid.load(path, mmap=False)
+        np.testing.assert_array_equal(loaded.Node_ID, self.hexagons['Node_ID'].to_numpy())
+        rebuilt = loaded.to_hexagons()
+        self.assertTrue(rebuilt.geometry.geom_equals_exact(self.hexagons.geometry, tolerance=1e-6).all())
+
+        rng = np.random.default_rng(1)
+        points = gpd.GeoDataFrame(geometry=gpd.points_from_xy(rng.uniform(0, 1000, 500), rng.uniform(0, 1000, 500)), crs=CRS)
+        joined = gpd.sjoin(points, self.hexagons[['Node_ID', 'geometry']], how='left', predicate='within')
+        expected = joined['Node_ID'].fillna(-1).astype(int).to_numpy()
+        np.testing.assert_array_equal(grid.locate(points.geometry.x, points.geometry.y), expected)
+        self.assertEqual(grid.locate([-1e6], [-1e6])[0], -1)
+
+    def test_008_link_ignitions(self):
+        """Fires without ignition point, ignition points without fire, outside the hexagons and duplicates are reported"""
+        ignition = self.ignition.copy()
+        orphan = ignition.iloc[[0]]
+        ignition = ignition.iloc[1:]
+        extra = ignition.iloc[[0]].assign(fire=999)
+        outside = ignition.iloc[[1]].copy()
+        outside['geometry'] = [Point(-1e6, -1e6)]
+        duplicate = ignition.iloc[[2]].copy()
+        duplicate['geometry'] = ignition.iloc[[3]].geometry.to_numpy()
+        ignition = pd.concat([outside, ignition, extra, duplicate])
+
+        with self.assertWarns(UserWarning):
+            postbp.generate_fire_vectors(self.fireshp, ignition, self.hexagons)
+        linkage, report = postbp.link_ignitions(self.fireshp, ignition, self.hexagons)
+        issues = dict(zip(zip(report['iteration'], report['fire'], report['issue']), report['ignitions']))
+        key = lambda frame: (frame['iteration'].iloc[0], frame['fire'].iloc[0])
+        self.assertEqual(issues[key(orphan) + ('no_ignition',)], 0)
+        self.assertEqual(issues[key(extra) + ('no_fire',)], 1)
+        self.assertEqual(issues[key(outside) + ('outside',)], 2)
+        self.assertEqual(issues[key(duplicate) + ('duplicate',)], 2)
+        self.assertEqual(len(report), 4)
+        # the fire with a point outside is linked to its point inside
+        self.assertEqual(len(linkage), len(self.fireshp) - 1)
+        linked = linkage.set_index(['iteration', 'fire'])['ignPt']
+        first = gpd.sjoin(self.ignition.iloc[[3]], self.hexagons, predicate='within')['Node_ID'].item()
+        last = gpd.sjoin(self.ignition.iloc[[4]], self.hexagons, predicate='within')['Node_ID'].item()
+        self.assertEqual(linked[key(duplicate)], first)
+        linkage, _ = postbp.link_ignitions(self.fireshp, ignition, self.hexagons, policy='last')
+        self.assertEqual(linkage.set_index(['iteration', 'fire'])['ignPt'][key(duplicate)], last)
+        linkage, _ = postbp.link_ignitions(self.fireshp, ignition, self.hexagons, policy='drop')
+        self.assertEqual(len(linkage), len(self.fireshp) - 2)
+        with self.assertRaises(ValueError):
+            postbp.link_ignitions(self.fireshp, ignition, self.hexagons, policy='error')
+        # duplicated points of a fire without perimeter are not duplicates
+        stray = pd.concat([self.ignition, extra, extra])
+        linkage, report = postbp.link_ignitions(self.fireshp, stray, self.hexagons, policy='error')
+        self.assertEqual(len(linkage), len(self.fireshp))
+        self.assertEqual(list(zip(report['fire'], report['issue'], report['ignitions'])), [(999, 'no_fire', 2)])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            vectors = postbp.generate_fire_vectors(self.fireshp, ignition, self.hexagons, policy='drop')
+            empty = postbp.generate_fire_vectors(self.fireshp, self.ignition.assign(fire=self.ignition['fire'] + 1000), self.hexagons)
+        self.assertFalse(vectors.set_index(['iteration', 'fire']).index.isin([key(orphan), key(duplicate)]).any())
+        self.assertEqual(list(empty.columns), ['column_j', 'column_i', 'fire', 'iteration'])
+        self.assertEqual(len(empty), 0)
+
+    def test_009_check_fireshp(self):
+        """Invalid perimeters are repaired and empty ones dropped"""
+        bowtie = Polygon([(0, 0), (100, 100), (100, 0), (0, 100), (0, 0)])
+        fireshp = gpd.GeoDataFrame({'fire': [1, 2, 3], 'iteration': [1, 1, 1]},
+                                   geometry=[bowtie, Polygon(), Point(500, 500).buffer(50)], crs=CRS)
+        valid, report = postbp.check_fireshp(fireshp)
+        self.assertEqual(list(valid['fire']), [1, 3])
+        self.assertTrue(valid.geometry.is_valid.all())
+        self.assertAlmostEqual(valid.geometry.iloc[0].area, 5000)
+        self.assertEqual(dict(zip(report['fire'], report['status'])), {1: 'repaired', 2: 'dropped'})
+        self.assertTrue(fireshp.geometry.iloc[1].is_empty)
+
+    def test_010_fireshed_sizes(self):
+        """Fireshed size is the number of ignition hexagons of the fires burning into each hexagon"""
+        vectors = postbp.generate_fire_vectors(self.fireshp, self.ignition, self.hexagons)
+        sizes = postbp.generate_fireshed_sizes(vectors, self.hexagons, chunksize=7).set_index('Node_ID')
+        expected = vectors.groupby('column_j')['column_i'].nunique()
+        np.testing.assert_array_equal(sizes['fireshedSize'].reindex(expected.index), expected)
+        self.assertEqual(sizes['fireshedSize'].drop(expected.index).sum(), 0)
+
+        sizes = postbp.generate_fireshed_sizes(vectors, self.hexagons, iterations=self.iterations, chunksize=7).set_index('Node_ID')
+        pij = postbp.pij_from_vectors(vectors, self.iterations).astype({'pij': float})
+        np.testing.assert_allclose(sizes['fireshedExp'], pij.groupby('column_j')['pij'].sum().reindex(sizes.index, fill_value=0), atol=1e-6)
+        np.testing.assert_allclose(sizes['fireplainExp'], pij.groupby('column_i')['pij'].sum().reindex(sizes.index, fill_value=0), atol=1e-6)
+
+    def test_011_weights(self):
+        """Equal weights give the unweighted burn probability, and each stratum is weighted by its own iterations"""
+        single = postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations)
+        weights = pd.DataFrame({'iteration': [1, 2, 3, 4], 'weight': [1.0, 3.0, 2.0, 2.0], 'season': ['a', 'a', 'b', 'b']})
+        weighted = postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations, weights=weights.assign(weight=1.0))
+        np.testing.assert_allclose(weighted['burnProb'], single['burnProb'])
+
+        weighted = postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations, weights=weights, stratum='season')
+        expected = 0
+        for it, w in zip(weights['iteration'], weights['weight']):
+            burnP = postbp.generate_burn_prob(self.fireshp.loc[self.fireshp['iteration'] == it], self.hexagons, 1)
+            if it <= 2:
+                expected = expected + burnP['burnProb'].to_numpy() * w / 4
+        np.testing.assert_allclose(weighted['burnProb_a'], expected)
+
+    def test_012_network(self):
+        """Strength, exposure, reach, top sources and clusters of a small hand-built transmission graph"""
+        pij = pd.DataFrame({'column_i': [1, 2, 1, 3, 4, 5], 'column_j': [2, 3, 3, 1, 5, 4],
+                            'pij': [0.5, 0.4, 0.1, 0.2, 0.3, 0.05]})
+        matrix, node_ids = postbp.pij_to_matrix(pij)
+        np.testing.assert_array_equal(node_ids, [1, 2, 3, 4, 5])
+
+        strength = postbp.node_strength(matrix, node_ids).set_index('Node_ID')
+        np.testing.assert_allclose(strength['outStrength'], [0.6, 0.4, 0.2, 0.3, 0.05])
+        np.testing.assert_allclose(strength['inStrength'], [0.2, 0.5, 0.5, 0.05, 0.3])
+        np.testing.assert_array_equal(strength['outDegree'], [2, 1, 1, 1, 1])
+        np.testing.assert_array_equal(strength['inDegree'], [1, 1, 2, 1, 1])
+
+        exposure = postbp.multi_hop_exposure(matrix, node_ids, k=2)
+        np.testing.assert_allclose(exposure['exposure_1'], [0.2, 0.5, 0.5, 0.05, 0.3])
+        np.testing.assert_allclose(exposure['exposure_2'], [0.1, 0.1, 0.22, 0.015, 0.015])
+        np.testing.assert_allclose(exposure['exposure'], exposure['exposure_1'] + exposure['exposure_2'])
+
+        reach = postbp.k_hop_reach(matrix, node_ids, [1, 4], k=2)
+        self.assertEqual(list(reach.itertuples(index=False, name=None)), [(1, 2, 1), (1, 3, 1), (4, 5, 1)])
+        reach = postbp.k_hop_reach(matrix, node_ids, [2], k=2)
+        self.assertEqual(list(reach.itertuples(index=False, name=None)), [(2, 3, 1), (2, 1, 2)])
+        # a node with more than 255 predecessors on the frontier is still reached
+        fan = pd.DataFrame({'column_i': [0] * 256 + list(range(1, 257)), 'column_j': list(range(1, 257)) + [999] * 256, 'pij': 1.0})
+        reach = postbp.k_hop_reach(*postbp.pij_to_matrix(fan), [0], k=2)
+        self.assertEqual(reach.loc[reach['column_j'] == 999, 'hops'].tolist(), [2])
+
+        top = postbp.top_k_sources(matrix, node_ids, k=1)
+        self.assertEqual(dict(zip(top['column_j'], top['column_i'])), {1: 3, 2: 1, 3: 2, 4: 5, 5: 4})
+        self.assertTrue((top['rank'] == 1).all())
+        self.assertEqual(len(postbp.top_k_sources(matrix, node_ids, k=2)), 6)
+
+        clusters = postbp.transmission_clusters(matrix, node_ids)
+        self.assertEqual(dict(zip(clusters['Node_ID'], clusters['cluster'])), {1: 1, 2: 1, 3: 1, 4: 2, 5: 2})
+        self.assertEqual(dict(zip(clusters['Node_ID'], clusters['clusterSize'])), {1: 3, 2: 3, 3: 3, 4: 2, 5: 2})
+        clusters = postbp.transmission_clusters(matrix, node_ids, min_weight=0.1, connection='strong')
+        self.assertEqual(dict(zip(clusters['Node_ID'], clusters['clusterSize'])), {1: 3, 2: 3, 3: 3, 4: 1, 5: 1})
+        clusters = postbp.transmission_clusters(matrix, node_ids, min_weight=0.35)
+        self.assertEqual(dict(zip(clusters['Node_ID'], clusters['clusterSize'])), {1: 3, 2: 3, 3: 3})
+
+    def test_013_rollup(self):
+        """Counts rolled up from the finest hexagons count each fire once for each parent, and match the coarser hexagons away from the boundary"""
+        boundary = gpd.GeoDataFrame(geometry=[box(0, 0, 1000, 1000)], crs=CRS)
+        levels, lookup = postbp.create_hexagon_levels(boundary, areas=[7e4, 1e4])
+        self.assertEqual([len(level) for level in levels], [len(self.hexagons), 42])
+        self.assertEqual(list(lookup.columns), ['Node_ID', 'level_1'])
+        parents = levels[1].set_index('Node_ID').geometry.reindex(lookup['level_1'])
+        self.assertLess(parents.distance(levels[0].geometry.centroid.set_axis(parents.index)).max(), 1e-6)
+        pd.testing.assert_frame_equal(postbp.parent_lookup(levels[0], levels[1]).rename(columns={'parent_ID': 'level_1'}), lookup)
+
+        _, burned = postbp.generate_burn_prob(self.fireshp, levels[0], self.iterations, return_burned=True)
+        burnCounts = postbp.rollup_burned(burned, lookup, 'level_1', iterations=self.iterations).set_index('Node_ID')
+        expected = burned.merge(lookup, on='Node_ID').groupby('level_1')['fire'].nunique()
+        np.testing.assert_array_equal(burnCounts['burnCount'].reindex(expected.index), expected)
+
+        rolled = postbp.burn_prob_from_counts(burnCounts.reset_index(), levels[1]).set_index('Node_ID')['burnProb']
+        coarse = postbp.generate_burn_prob(self.fireshp, levels[1], self.iterations).set_index('Node_ID')
+        centroid = coarse.geometry.centroid
+        inner = coarse.index[centroid.x.between(250, 750) & centroid.y.between(250, 750)]
+        diff = (rolled[inner] - coarse.loc[inner, 'burnProb']).abs()
+        # hexagons do not nest exactly, a fire touching the edge of a parent may burn no finer hexagon of it
+        self.assertLessEqual(diff.max(), 100 / self.iterations)
+        self.assertGreaterEqual((diff == 0).mean(), 0.5)
+
+        _, ignCounts = postbp.generate_ign_prob(self.ignition, levels[0], self.iterations, return_counts=True)
+        rolledIgn = postbp.rollup_counts(ignCounts, lookup, 'level_1')
+        _, coarseIgn = postbp.generate_ign_prob(self.ignition, levels[1], self.iterations, return_counts=True)
+        self.assertEqual(rolledIgn['ignCount'].sum(), coarseIgn['ignCount'].sum())
+
+        vectors = postbp.generate_fire_vectors(self.fireshp, self.ignition, levels[0])
+        rolledVectors = postbp.rollup_vectors(vectors, lookup, 'level_1')
+        self.assertFalse((rolledVectors['column_i'] == rolledVectors['column_j']).any())
+        self.assertFalse(rolledVectors.duplicated().any())
+        _, ssrCounts = postbp.generate_ssr(vectors, levels[0], return_counts=True)
+        for counts in [ssrCounts, burnCounts.reset_index(), postbp.pij_from_vectors(vectors, self.iterations)]:
+            with self.assertRaises(ValueError):
+                postbp.rollup_counts(counts, lookup, 'level_1')
+
+    def test_014_shared_memory(self):
+        """HexGrid in shared memory is passed to the workers of a process pool by name, then closed and unlinked"""
+        grid = postbp.HexGrid.from_hexagons(self.hexagons)
+        sharedGrid, shm = grid.to_shared_memory()
+        rng = np.random.default_rng(2)
+        x, y = rng.uniform(0, 1000, 100), rng.uniform(0, 1000, 100)
+        with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(_locate, [sharedGrid] * 3, [x] * 3, [y] * 3))
+        for located, size in results:
+            np.testing.assert_array_equal(located, grid.locate(x, y))
+            self.assertEqual(size, len(grid))
+        np.testing.assert_array_equal(sharedGrid.Node_ID, grid.Node_ID)
+        sharedGrid.close()
+        shm.unlink()
+        with self.assertRaises(FileNotFoundError):
+            postbp.HexGrid.from_shared_memory(shm.name)
+
+    def test_015_catalog(self):
+        """FireCatalog slices the perimeters, days and ignition point of each fire as boolean masks do"""
+        shuffled = self.dailyshp.sample(frac=1, random_state=0)
+        catalog = postbp.FireCatalog(shuffled, self.ignition.iloc[::-1])
+        self.assertEqual(catalog.keys, ['iteration', 'fire'])
+        self.assertEqual(len(catalog), len(self.fireshp))
+        fires = catalog.fires()
+        self.assertTrue((fires['perimeters'] == 3).all())
+        self.assertTrue((fires['ignitions'] == 1).all())
+        for fire in catalog:
+            mask = (shuffled['iteration'] == fire[0]) & (shuffled['fire'] == fire[1])
+            perimeters = catalog.perimeters(fire)
+            self.assertEqual(sorted(perimeters.index), sorted(shuffled.index[mask]))
+            self.assertEqual(list(perimeters['day']), [1, 2, 3])
+            np.testing.assert_array_equal(catalog.days(fire), [1, 2, 3])
+            self.assertEqual(list(catalog.day(fire, 2).index), list(shuffled.index[mask & (shuffled['day'] == 2)]))
+            self.assertEqual(len(catalog.day(fire, 4)), 0)
+            self.assertEqual(list(catalog.ignition(fire)['fire']), [fire[1]])
+        self.assertIn((1, 1), catalog)
+        self.assertNotIn((1, 999), catalog)
+        self.assertEqual(len(catalog.ignition((1, 999))), 0)
+
+        catalog = postbp.FireCatalog(self.fireshp)
+        self.assertEqual(len(catalog.perimeters((2, 4))), 1)
+        with self.assertRaises(ValueError):
+            catalog.ignition((2, 4))
+        catalog = postbp.FireCatalog(self.fireshp.drop(columns='iteration'))
+        self.assertEqual(catalog.keys, ['fire'])
+        self.assertEqual(list(catalog.perimeters(5)['fire']), [5])
+
+    def test_016_alpha_boundary(self):
+        """Vectors of the hexagon lattice on the bounds of the alpha sector are selected as by calc_angles and select_angle"""
+        from postbp.common import _node_table
+        from postbp.dailyfirevectors import _select_block
+        ids = self.nodes['Node_ID'].to_numpy()
+        vectors = pd.DataFrame({'column_i': np.repeat(ids, len(ids)), 'column_j': np.tile(ids, len(ids)), 'day': 2, 'fire': 1, 'ignPt': ids[0]})
+        withAngle = postbp.calc_angles(vectors, self.nodes)
+        angles = withAngle['angle'].astype(float)
+        self.assertGreater(((angles == 120) | (angles == 240)).sum(), 0)
+        columns = ['column_i', 'column_j']
+        selected = postbp.select_angle(withAngle, 120)
+        fused = _select_block(2, ids, ids, ids[0], _node_table(self.nodes), 120)
+        pd.testing.assert_frame_equal(_sorted(fused, columns), _sorted(selected, columns))
+
+    def test_017_block_counts(self):
+        """Counts, pij and angle counts from the blocks equal those from the daily fire vectors"""
+        vectors = postbp.generate_daily_vectors(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6)
+        blocks = postbp.generate_daily_blocks(self.dailyshp, self.ignition, self.hexagons, bufferFactor=0.6)
+        _, pijCounts = postbp.pij_from_vectors(vectors, self.iterations, return_counts=True)
+        columns = ['column_j', 'column_i', 'firecounts']
+        pd.testing.assert_frame_equal(_sorted(postbp.counts_from_blocks(blocks), columns), _sorted(pijCounts, columns), check_dtype=False)
+        columns = ['column_j', 'column_i', 'pij']
+        pd.testing.assert_frame_equal(_sorted(postbp.pij_from_blocks(blocks, self.iterations), columns),
+                                      _sorted(postbp.pij_from_vectors(vectors, self.iterations), columns))
+
+        withAngle = postbp.calc_angles(vectors, self.nodes)
+        selected = postbp.select_angle(withAngle, 120)
+        pd.testing.assert_frame_equal(_sorted(postbp.pij_from_blocks(blocks, self.iterations, alpha=120, nodes=self.nodes), columns),
+                                      _sorted(postbp.pij_from_vectors(selected, self.iterations), columns))
+
+        counts = postbp.angle_counts(blocks, self.nodes, bin_width=30)
+        angles = withAngle.loc[withAngle['day'] != 999, 'angle'].astype(float)
+        np.testing.assert_array_equal(counts['angle'], np.arange(0, 360, 30))
+        np.testing.assert_array_equal(counts['vectors'], np.bincount(np.minimum((angles // 30).astype(int), 11), minlength=12))
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'blocks.npz')
+            blocks.save(path)
+            loaded = postbp.VectorBlocks.load(path)
+        pd.testing.assert_frame_equal(loaded.to_vectors(), blocks.to_vectors())
+
+    def test_018_raster(self):
+        """Raster burn counts equal the overlay on perimeters covering whole hexagons, and their disagreement is reported per hexagon"""
+        grid = postbp.cell_to_hex(self.hexagons)
+        rng = np.random.default_rng(3)
+        rows, cols = rng.integers(0, grid['nrows'], 200), rng.integers(0, grid['ncols'], 200)
+        xs = grid['xmin'] + (cols + 0.5) * grid['cell_size']
+        ys = grid['ymin'] + (rows + 0.5) * grid['cell_size']
+        located = postbp.HexGrid.from_hexagons(self.hexagons).locate(xs, ys)
+        pos = grid['cellHex'][rows, cols]
+        np.testing.assert_array_equal(np.where(pos >= 0, grid['Node_ID'][pos], -1), located)
+
+        # perimeters slightly within hexagons: both engines burn exactly those hexagons
+        picked = self.hexagons.iloc[rng.choice(len(self.hexagons), 20)]
+        fires = gpd.GeoDataFrame({'fire': np.arange(1, 21), 'iteration': np.arange(20) % 4 + 1},
+                                 geometry=picked.geometry.buffer(-1).to_numpy(), crs=CRS)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            raster = postbp.generate_burn_prob(fires, self.hexagons, self.iterations, engine='raster', grid=grid)
+        overlay = postbp.generate_burn_prob(fires, self.hexagons, self.iterations)
+        np.testing.assert_allclose(raster['burnProb'], overlay['burnProb'])
+        hexError = postbp.check_raster(fires, self.hexagons, grid=grid)
+        self.assertTrue((hexError['diff'] == 0).all())
+        self.assertEqual(sorted(hexError['Node_ID']), sorted(picked['Node_ID'].unique()))
+
+        # circular perimeters: the raster misses hexagons barely touched, reported as the difference to the overlay
+        with self.assertWarns(UserWarning):
+            raster, hexError = postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations, engine='raster', grid=grid,
+                                                         check_sample=0, return_error=True)
+        _, overlayCounts = postbp.generate_burn_prob(self.fireshp, self.hexagons, self.iterations, return_counts=True)
+        rasterCounts, rasterError = postbp.rasterize_burn_counts(self.fireshp, self.hexagons, grid=grid)
+        expected = rasterCounts.set_index('Node_ID')['burnCount'] - overlayCounts.set_index('Node_ID')['burnCount']
+        np.testing.assert_array_equal(hexError.set_index('Node_ID')['diff'], expected.reindex(hexError['Node_ID']))
+        self.assertEqual(expected.drop(hexError['Node_ID']).abs().sum(), 0)
+        np.testing.assert_allclose(raster['burnProb'], rasterCounts['burnCount'] / self.iterations * 100)
+        self.assertLess(rasterError['relError'].abs().max(), 0.1)
+
+    def test_019_read_points(self):
+        """Ignition points are read from csv files and shapefiles with only the needed columns"""
+        table = pd.DataFrame({'note': ['a', 'b', 'c', 'd'], 'y_coord': [10.0, 20.0, 30.0, 40.0], 'fire': [1, 2, 3, 4],
+                              'x_coord': [1.0, 2.0, 3.0, 4.0], 'iteration': [1, 1, 2, 2], 'east': [5.0, 6.0, 7.0, 8.0]})
+        with tempfile.TemporaryDirectory() as folder:
+            paths = [os.path.join(folder, 'ign1.csv'), os.path.join(folder, 'ign2.csv')]
+            table.iloc[:2].to_csv(paths[0], index=False)
+            table.iloc[2:].to_csv(paths[1], index=False)
+            points = postbp.read_pointcsv(paths[0], CRS)
+            both = postbp.read_pointcsv(paths, CRS, n_jobs=2)
+            coords = postbp.read_pointcsv(paths, CRS, geometry=False)
+            other = postbp.read_pointcsv(paths[1], CRS, x_col='east')
+
+            shp = os.path.join(folder, 'ign.shp')
+            gpd.GeoDataFrame(table[['fire', 'iteration']], geometry=gpd.points_from_xy(table['x_coord'], table['y_coord']), crs=CRS).to_file(shp)
+            poly = os.path.join(folder, 'fires.shp')
+            gpd.GeoDataFrame(table[['fire', 'iteration', 'x_coord', 'y_coord']], geometry=gpd.points_from_xy(table['x_coord'], table['y_coord']).buffer(5),
+                             crs=CRS).to_file(poly)
+            with warnings.catch_warnings():
+                # pyogrio warns about the driver argument of read_pointshp
+                warnings.simplefilter('ignore', RuntimeWarning)
+                shpPoints = postbp.read_pointshp(shp)
+                polyPoints = postbp.read_pointshp(poly)
+
+        self.assertEqual(list(points.columns), ['fire', 'iteration', 'geometry'])
+        self.assertEqual(points.crs, CRS)
+        self.assertEqual(list(zip(points.geometry.x, points.geometry.y)), [(1.0, 10.0), (2.0, 20.0)])
+        self.assertEqual(list(both['fire']), [1, 2, 3, 4])
+        self.assertEqual(list(both.geometry.x), [1.0, 2.0, 3.0, 4.0])
+        pd.testing.assert_frame_equal(coords, table[['fire', 'iteration', 'x_coord', 'y_coord']])
+        self.assertEqual(list(other.geometry.x), [7.0, 8.0])
+        for read in [shpPoints, polyPoints]:
+            self.assertEqual(list(read.columns), ['fire', 'iteration', 'geometry'])
+            self.assertEqual(list(read.geometry.x), [1.0, 2.0, 3.0, 4.0])
+            self.assertEqual(list(read.geometry.y), [10.0, 20.0, 30.0, 40.0])
+
+    def test_020_pipeline(self):
+        """A rerun of the pipeline loads the stages from the output folder, and recomputes only the stages whose parameters changed"""
+        with tempfile.TemporaryDirectory() as folder:
+            self.fireshp.to_file(os.path.join(folder, 'fires.shp'))
+            points = pd.DataFrame({'fire': self.ignition['fire'], 'iteration': self.ignition['iteration'],
+                                   'x_coord': self.ignition.geometry.x, 'y_coord': self.ignition.geometry.y})
+            points.to_csv(os.path.join(folder, 'ignition.csv'), index=False)
+            config = {'fireshp': 'fires.shp', 'ignition': 'ignition.csv', 'SRID': CRS, 'hexagons': {'area': 10000},
+                      'iterations': self.iterations, 'output_dir': 'output', 'targets': ['burn_prob', 'pij']}
+            path = os.path.join(folder, 'config.json')
+            with open(path, 'w') as f:
+                json.dump(config, f)
+
+            def run(*args, **kwargs):
+                log = io.StringIO()
+                with contextlib.redirect_stdout(log), warnings.catch_warnings():
+                    # pyogrio warns about the driver argument of read_fireshp
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    outputs = postbp.run_pipeline(*args, **kwargs)
+                # status of each stage run or loaded, e.g. {'pij': 'running', 'fires': 'up to date'}
+                status = dict(line.split(',')[0].split(': ') for line in log.getvalue().splitlines())
+                return outputs, status
+
+            first, log = run(path)
+            self.assertEqual(set(log.values()), {'running'})
+            self.assertEqual(set(log), {'fires', 'ignition', 'hexagons', 'fire_vectors', 'pij', 'burn_prob'})
+            self.assertTrue(os.path.exists(os.path.join(folder, 'output', 'burn_prob.shp')))
+            self.assertTrue(os.path.exists(os.path.join(folder, 'output', 'pij.csv')))
+
+            second, log = run(path)
+            self.assertEqual(log, {'pij': 'up to date', 'burn_prob': 'up to date'})
+            pd.testing.assert_frame_equal(second['pij'], first['pij'])
+
+            config['params'] = {'burn_prob': {'threshold': 0.5}}
+            with open(path, 'w') as f:
+                json.dump(config, f)
+            third, log = run(path)
+            self.assertEqual(log, {'fires': 'up to date', 'hexagons': 'up to date', 'burn_prob': 'running', 'pij': 'up to date'})
+            self.assertLess(third['burn_prob']['burnProb'].sum(), first['burn_prob']['burnProb'].sum())
+
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log), warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                self.assertEqual(cli.main([path, '--targets', 'ign_prob', '--force']), 0)
+            self.assertIn('ign_prob: running', log.getvalue())
+            self.assertIn('ignition: running', log.getvalue())
+
+    def test_021_renumber(self):
+        """Hexagons numbered along a Hilbert curve keep neighbours together, and tables are written sorted by Node_ID in row groups"""
+        from postbp.tessellation import _curve_key
+        xs, ys = np.meshgrid(np.arange(8), np.arange(8))
+        key = _curve_key(xs.ravel(), ys.ravel(), bits=3)
+        np.testing.assert_array_equal(np.sort(key), np.arange(64))
+        order = np.argsort(key)
+        # consecutive cells along the Hilbert curve are neighbours
+        self.assertTrue((np.abs(np.diff(xs.ravel()[order])) + np.abs(np.diff(ys.ravel()[order])) == 1).all())
+
+        renumbered, lookup = postbp.renumber_hexagons(self.hexagons)
+        np.testing.assert_array_equal(renumbered['Node_ID'], np.arange(1, len(self.hexagons) + 1))
+        self.assertEqual(sorted(lookup['old_ID']), sorted(self.hexagons['Node_ID']))
+        old = self.hexagons.set_index('Node_ID').geometry.reindex(lookup['old_ID'])
+        self.assertTrue(old.geom_equals_exact(renumbered.geometry.set_axis(old.index), tolerance=1e-6).all())
+
+        def spread(hexagons, size=16):
+            centre = hexagons.sort_values('Node_ID').geometry.centroid
+            x, y = centre.x.to_numpy(), centre.y.to_numpy()
+            return np.mean([np.ptp(x[k:k + size]) + np.ptp(y[k:k + size]) for k in range(0, len(x), size)])
+        self.assertLess(spread(renumbered), spread(self.hexagons))
+
+        boundary = gpd.GeoDataFrame(geometry=[box(0, 0, 1000, 1000)], crs=CRS)
+        hexagons, nodes = postbp.create_hexagons_nodes(boundary, area=10000, order='hilbert')
+        pd.testing.assert_series_equal(hexagons['Node_ID'], renumbered['Node_ID'])
+        self.assertTrue(hexagons.geometry.geom_equals_exact(renumbered.geometry, tolerance=1e-6).all())
+        self.assertLess(nodes.geometry.distance(hexagons.geometry.centroid).max(), 1e-6)
+
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            self.skipTest('write_sorted requires pyarrow')
+        vectors = postbp.generate_fire_vectors(self.fireshp, self.ignition, self.hexagons).sample(frac=1, random_state=0)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'vectors.parquet')
+            written = postbp.write_sorted(vectors, path, row_group_size=50)
+            read = pd.read_parquet(path)
+            metadata = pq.ParquetFile(path).metadata
+        pd.testing.assert_frame_equal(read, written)
+        pd.testing.assert_frame_equal(written, vectors.sort_values(['column_i', 'column_j'], kind='stable').reset_index(drop=True))
+        self.assertEqual(metadata.num_row_groups, -(-len(vectors) // 50))
+        column = metadata.schema.names.index('column_i')
+        stats = [metadata.row_group(k).column(column).statistics for k in range(metadata.num_row_groups)]
+        self.assertTrue(all(a.max <= b.min for a, b in zip(stats[:-1], stats[1:])))